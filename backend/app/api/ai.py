@@ -1,5 +1,9 @@
-from fastapi import APIRouter
-from ..core.ai_agents import GOOGLE_API_KEY, get_ingestion_agent, get_consensus_agent, get_genai_client
+from fastapi import APIRouter, Depends
+from ..core.ai_agents import GOOGLE_API_KEY, get_ingestion_agent, get_consensus_agent, get_genai_client, provider_for
+from ..core.ocr_cache import ocr_cache
+from ..core.image_prep import image_preparer
+from ..core.embeddings import embedding_queue
+from ..core.security import Principal, get_current_principal
 
 router = APIRouter()
 
@@ -29,9 +33,33 @@ def ai_health():
     except Exception:
         consensus_available = False
 
+    try:
+        providers = {agent: provider_for(agent) for agent in ("ocr", "ingestion", "consensus", "tutor")}
+    except ValueError as e:
+        providers = {"error": str(e)}
+
     return {
         "google_api_key_present": key_present,
+        "model_providers": providers,
         "genai_client_initialized": client_ok,
         "ingestion_agent_available": ingestion_available,
         "consensus_agent_available": consensus_available,
     }
+
+
+@router.get("/ocr-cache")
+def ocr_cache_stats(principal: Principal = Depends(get_current_principal)):
+    """Hit/miss counters for the OCR result cache of this process."""
+    return ocr_cache.stats()
+
+
+@router.get("/image-prep")
+def image_prep_stats(principal: Principal = Depends(get_current_principal)):
+    """Images normalized before OCR in this process and the bytes saved."""
+    return image_preparer.stats()
+
+
+@router.get("/embeddings")
+def embedding_stats(principal: Principal = Depends(get_current_principal)):
+    """Notes and Master Notes embedded on write by this process, and the queue behind them."""
+    return embedding_queue.stats()
@@ -1,21 +1,16 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from ..database import get_db
-from ..models import Note, User
-from ..core.security import get_current_user
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
+from ..models import Note
+from ..core.security import Principal, get_current_principal
 
 router = APIRouter()
 
 @router.get("/report")
-async def get_analytics(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    user_email = current_user.get("sub")
-    user = db.query(User).filter(User.email == user_email).first()
-    
-    if not user:
-        return {"prep_score": 0, "contribution_score": 0}
-
+async def get_analytics(db: AsyncSession = Depends(get_async_db), principal: Principal = Depends(get_current_principal)):
     # Contribution Score: Simple count of notes uploaded
-    note_count = db.query(Note).filter(Note.user_id == user.id).count()
+    note_count = await db.scalar(select(func.count()).select_from(Note).where(Note.user_id == principal.user_id))
     # Normalize score: say 10 notes = 100% contribution level for the month
     contribution_score = min(100, note_count * 10)
 
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from ..database import get_db
 from ..schemas.schemas import UserCreate, UserResponse, UserLogin
 from ..models import User
-from ..core.security import get_password_hash, verify_password, create_access_token, decode_access_token, oauth2_scheme
+from ..core.security import get_password_hash, verify_password, create_access_token, Principal, get_current_principal
 
 router = APIRouter()
 
@@ -46,11 +46,8 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=UserResponse)
-def me(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = decode_access_token(token)
-    if payload is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
-    user = db.query(User).filter(User.email == payload.get('sub')).first()
+def me(principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    user = db.get(User, principal.user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return user
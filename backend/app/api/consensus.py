@@ -1,169 +1,217 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from ..database import AsyncSessionLocal, get_async_db
 from ..models import Note, MasterNote, Subject, User
 from ..core.ai_agents import get_consensus_agent
 from ..schemas.schemas import ConsensusRequest
-from ..core.security import decode_access_token
+from ..core.security import Principal, get_optional_principal, get_current_principal
+from ..core.consensus_synthesis import (
+    SYNTHESIS_MODES, CONSENSUS_FAN_OUT, CONSENSUS_BATCH_TOKENS, CONSENSUS_MAP_REDUCE_MIN_TOKENS,
+    estimate_tokens, synthesize_single, synthesize_map_reduce, synthesize_incremental,
+)
+from ..core.embeddings import embedding_queue
+from ..core.master_notes import MasterNoteIndexMissing, content_hash, load_manifest, record_manifest, upsert_master_note
 import json
+import time
 from typing import Optional
 
 router = APIRouter()
 
-def get_current_user_id(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
-    if not authorization:
-        return None
-    scheme, _, token = authorization.partition(" ")
-    payload = decode_access_token(token)
-    if not payload:
-        return None
-    user = db.query(User).filter(User.email == payload.get('sub')).first()
-    return user.id if user else None
+def get_current_user_id(principal: Optional[Principal] = Depends(get_optional_principal)):
+    return principal.user_id if principal else None
 
 @router.post("/process")
 async def run_consensus_v2(
-    payload: ConsensusRequest, 
-    db: Session = Depends(get_db),
+    payload: ConsensusRequest,
     user_id: int = Depends(get_current_user_id)
 ):
     if not user_id:
         raise HTTPException(status_code=401, detail="Authentication required")
-
-    # 1. Gather ONLY selected notes
-    notes = db.query(Note).filter(Note.id.in_(payload.note_ids)).all()
+    if payload.mode not in SYNTHESIS_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SYNTHESIS_MODES)}")
+
+    started = time.perf_counter()
+    timings = {}
+
+    # 1-2. Reads run on a short-lived session that is closed before the model is called,
+    # so a slow synthesis does not keep a pooled connection checked out.
+    async with AsyncSessionLocal() as db:
+        # 1. Gather ONLY selected notes
+        # Owners are loaded up front: lazy loads are not available on an AsyncSession
+        notes = (await db.scalars(
+            select(Note).options(selectinload(Note.owner)).where(Note.id.in_(payload.note_ids))
+        )).all()
     
-    if not notes:
-        raise HTTPException(status_code=400, detail="No notes selected for consensus")
+        if not notes:
+            raise HTTPException(status_code=400, detail="No notes selected for consensus")
 
-    # If chapter is not provided, try to infer it from the first note, or default to 1
-    target_chapter = payload.chapter
-    if target_chapter is None:
-        target_chapter = notes[0].chapter if (notes and notes[0].chapter is not None) else 1
+        # If chapter is not provided, try to infer it from the first note, or default to 1
+        target_chapter = payload.chapter
+        if target_chapter is None:
+            target_chapter = notes[0].chapter if (notes and notes[0].chapter is not None) else 1
     
-    print(f"DEBUG: Processing consensus for Subject {payload.subject_id}, Chapter {target_chapter}")
+        print(f"DEBUG: Processing consensus for Subject {payload.subject_id}, Chapter {target_chapter}")
 
-    # 2. Combine note contents for the agent
-    combined_notes = "\n---\n".join([f"Note from {n.owner.pseudo_name} ({n.owner.teacher}, {n.owner.year}):\n{n.content}" for n in notes])
+        existing_master = await db.scalar(select(MasterNote).where(
+            MasterNote.user_id == user_id,
+            MasterNote.subject_id == payload.subject_id,
+            MasterNote.chapter == target_chapter
+        ).limit(1))
+
+        # Content hashes of the selected notes become the source manifest of the new version
+        manifest = {n.id: content_hash(n.content) for n in notes}
+
+        # 2. Incremental mode: keep what the current version already covers and only send
+        # new or changed notes; nothing new means the LLM call is skipped entirely.
+        incremental = False
+        if payload.incremental and existing_master:
+            previous = await db.run_sync(load_manifest, existing_master.id, existing_master.version)
+            if previous:
+                notes = [n for n in notes if previous.get(n.id) != manifest[n.id]]
+                if not notes:
+                    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    return {"message": "Master Note already up to date", "notes_processed": 0, "chapter": target_chapter, "mode": "incremental", "version": existing_master.version, "skipped": True, "timings": timings}
+                manifest = {**previous, **manifest}
+                incremental = True
+
+        subject = await db.get(Subject, payload.subject_id)
+        topic_name = f"{subject.name if subject else 'Unknown'} - Chapter {target_chapter}"
+
+    # Label note contents for the agent
+    docs = [f"Note from {n.owner.pseudo_name} ({n.owner.teacher}, {n.owner.year}):\n{n.content}" for n in notes]
+    total_tokens = sum(estimate_tokens(d) for d in docs)
+    mode = payload.mode
+    if incremental:
+        mode = "incremental"
+    elif mode == "auto":
+        mode = "map_reduce" if total_tokens > CONSENSUS_MAP_REDUCE_MIN_TOKENS else "single"
+    timings["gather_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
     # 3. Call consensus agent...
     try:
         agent = get_consensus_agent()
         if not agent:
-            print("ERROR: Consensus agent not configured (check GOOGLE_API_KEY)")
+            print("ERROR: Consensus agent not configured (check GOOGLE_API_KEY or MODEL_PROVIDER)")
             raise HTTPException(status_code=503, detail="Consensus agent not configured")
 
-        prompt = f"Here are several student notes for Chapter {target_chapter}. Please synthesize them into a single Master Note:\n\n{combined_notes}"
-        print(f"DEBUG: Running consensus agent for Chapter {target_chapter} with {len(notes)} notes...")
-        print(f"DEBUG: Combined notes length: {len(combined_notes)} characters")
-        result = await agent.run(prompt)
-        
-        consensus_content = str(result.output)
+        print(f"DEBUG: Running consensus agent ({mode}) for Chapter {target_chapter} with {len(notes)} notes, ~{total_tokens} tokens...")
+        synthesis_started = time.perf_counter()
+        if mode == "incremental":
+            consensus_content, stages = await synthesize_incremental(agent, target_chapter, existing_master.content, docs)
+        elif mode == "map_reduce":
+            consensus_content, stages = await synthesize_map_reduce(
+                agent,
+                target_chapter,
+                docs,
+                fan_out=payload.fan_out or CONSENSUS_FAN_OUT,
+                batch_token_budget=payload.batch_token_budget or CONSENSUS_BATCH_TOKENS,
+            )
+        else:
+            consensus_content, stages = await synthesize_single(agent, target_chapter, docs)
+        timings["synthesis_ms"] = round((time.perf_counter() - synthesis_started) * 1000, 1)
+        timings["stages"] = stages
         print("DEBUG: Consensus synthesis complete.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR: Exception during consensus agent run: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"AI Agent error: {str(e)}")
 
-    # 4. Save/Update MasterNote (Per User, Subject, and Chapter)
-    try:
-        existing_master = db.query(MasterNote).filter(
-            MasterNote.user_id == user_id,
-            MasterNote.subject_id == payload.subject_id, 
-            MasterNote.chapter == target_chapter
-        ).first()
-        
-        subject = db.query(Subject).filter(Subject.id == payload.subject_id).first()
-        topic_name = f"{subject.name if subject else 'Unknown'} - Chapter {target_chapter}"
-
-        if existing_master:
-            print(f"DEBUG: Updating existing MasterNote ID {existing_master.id}")
-            existing_master.content = consensus_content
-            existing_master.version += 1
-            db.commit()
-        else:
-            print(f"DEBUG: Creating new MasterNote for user {user_id}, subject {payload.subject_id}, chapter {target_chapter}")
-            new_master = MasterNote(
-                user_id=user_id,
-                topic=topic_name,
-                subject_id=payload.subject_id,
-                chapter=target_chapter,
-                content=consensus_content,
-                version=1
+    # 4. Save/Update MasterNote (Per User, Subject, and Chapter) on a fresh session
+    save_started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        try:
+            # Single-statement upsert: concurrent runs for the same chapter serialize on the
+            # unique key instead of racing between a SELECT and an INSERT/UPDATE.
+            master_id, saved_version = await db.run_sync(
+                upsert_master_note, user_id, payload.subject_id, target_chapter, topic_name, consensus_content,
             )
-            db.add(new_master)
-            db.commit()
-    except Exception as e:
-        print(f"ERROR: Database error during MasterNote save: {str(e)}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Database error saving Master Note")
-
-    return {"message": "Consensus reached and Master Note updated", "notes_processed": len(notes), "chapter": target_chapter}
-
-from fastapi.responses import JSONResponse, Response
-from io import BytesIO
+            print(f"DEBUG: Saved MasterNote ID {master_id} version {saved_version}")
+            record_manifest(db, master_id, saved_version, manifest)
+            await db.commit()
+            embedding_queue.submit("master", [master_id])
+        except MasterNoteIndexMissing as e:
+            print(f"ERROR: {e}")
+            await db.rollback()
+            raise HTTPException(status_code=500, detail="Database schema is out of date: run the migrations (alembic upgrade head)")
+        except Exception as e:
+            print(f"ERROR: Database error during MasterNote save: {str(e)}")
+            await db.rollback()
+            raise HTTPException(status_code=500, detail="Database error saving Master Note")
+
+    timings["save_ms"] = round((time.perf_counter() - save_started) * 1000, 1)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    return {"message": "Consensus reached and Master Note updated", "notes_processed": len(notes), "chapter": target_chapter, "mode": mode, "version": saved_version, "skipped": False, "timings": timings}
+
+from fastapi import Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from ..core.pdf_render import PdfUnavailable, pdf_cache, pdf_etag, iter_pdf_chunks
 
 @router.get("/master/{subject_id}/{chapter}/pdf")
 async def download_master_pdf(
     subject_id: int, 
     chapter: int, 
-    db: Session = Depends(get_db),
-    user_id: int = Depends(get_current_user_id)
+    user_id: int = Depends(get_current_user_id),
+    if_none_match: Optional[str] = Header(None)
 ):
+    """Serves the Master Note as a PDF, rendered off the event loop and cached per version.
+
+    Responds 304 when the client's If-None-Match still names the current version.
+    """
     if not user_id:
         raise HTTPException(status_code=401, detail="Authentication required")
 
-    master = db.query(MasterNote).filter(
-        MasterNote.user_id == user_id,
-        MasterNote.subject_id == subject_id, 
-        MasterNote.chapter == chapter
-    ).first()
-    
+    # Read on a short-lived session, closed before rendering and streaming
+    async with AsyncSessionLocal() as db:
+        master = await db.scalar(select(MasterNote).where(
+            MasterNote.user_id == user_id,
+            MasterNote.subject_id == subject_id,
+            MasterNote.chapter == chapter
+        ).limit(1))
+
     if not master:
         raise HTTPException(status_code=404, detail="Master Note not found")
     
-    # Import reportlab lazily so the app can run without it installed
+    etag = pdf_etag(master.id, master.version)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"attachment; filename=MasterNote_{subject_id}_Ch{chapter}.pdf",
+    }
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
     try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-    except Exception:
+        pdf_value = await pdf_cache.get_or_render(
+            master.id, master.version, master.topic, master.created_at.strftime('%Y-%m-%d'), master.content,
+        )
+    except PdfUnavailable:
         return JSONResponse(status_code=503, content={"detail": "PDF generation not available - install 'reportlab' to enable this endpoint."})
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=LETTER)
-    styles = getSampleStyleSheet()
-
-    elements = []
-    elements.append(Paragraph(f"Master Note: {master.topic}", styles['Title']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph(f"Version: {master.version} | Date: {master.created_at.strftime('%Y-%m-%d')}", styles['Normal']))
-    elements.append(Spacer(1, 24))
-
-    # Process content paragraphs
-    for p in master.content.split('\n'):
-        if p.strip():
-            elements.append(Paragraph(p, styles['Normal']))
-            elements.append(Spacer(1, 6))
-
-    doc.build(elements)
-    pdf_value = buffer.getvalue()
-    buffer.close()
+    headers["Content-Length"] = str(len(pdf_value))
+    return StreamingResponse(iter_pdf_chunks(pdf_value), media_type="application/pdf", headers=headers)
 
-    filename = f"MasterNote_{subject_id}_Ch{chapter}.pdf"
-    return Response(content=pdf_value, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={filename}"})
+@router.get("/pdf-cache")
+def pdf_cache_stats(principal: Principal = Depends(get_current_principal)):
+    """Hit/miss counters and size of the Master Note PDF cache of this process."""
+    return pdf_cache.stats()
 
 @router.get("/master/latest")
 async def get_latest_master_note(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     if not user_id:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    master = db.query(MasterNote).filter(
+    master = await db.scalar(select(MasterNote).where(
         MasterNote.user_id == user_id
-    ).order_by(MasterNote.created_at.desc()).first()
+    ).order_by(MasterNote.created_at.desc()).limit(1))
     
     if not master:
         # Return 204 No Content to indicate there is no Master Note yet (not an error)
@@ -174,17 +222,17 @@ async def get_latest_master_note(
 async def get_master_note(
     subject_id: int, 
     chapter: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     if not user_id:
         raise HTTPException(status_code=401, detail="Authentication required")
 
-    master = db.query(MasterNote).filter(
+    master = await db.scalar(select(MasterNote).where(
         MasterNote.user_id == user_id,
-        MasterNote.subject_id == subject_id, 
+        MasterNote.subject_id == subject_id,
         MasterNote.chapter == chapter
-    ).first()
+    ).limit(1))
     
     if not master:
         raise HTTPException(status_code=404, detail="Master Note not found for this chapter")
@@ -1,86 +1,270 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..database import get_db
-from ..core.ai_agents import get_ingestion_agent, extract_text_from_image
-from ..core.security import get_current_user
-from ..models import Note
-import base64
+from ..database import get_db, get_async_db, AsyncSessionLocal
+from ..core.ingestion_pipeline import IngestionUnavailable, ingestion_available, extract_note_content, save_note, save_notes, PAGE_SEPARATOR
+from ..core.image_prep import UnsupportedImage
+from ..core.uploads import SpooledUpload, UploadForm, UploadTooLarge, InvalidUpload, receive_upload
+from ..core.ingestion_jobs import job_pool, create_job, TERMINAL_STATUSES
+from ..core.security import Principal, get_current_principal
+from ..models import IngestionJob
+from ..schemas.schemas import IngestionJobResponse
+import asyncio
+import json
 import os
+import time
 import traceback
 
 router = APIRouter()
 
-@router.post("/upload")
+INGESTION_SSE_POLL_SECONDS = float(os.getenv("INGESTION_SSE_POLL_SECONDS", "0.5"))
+INGESTION_BATCH_MAX_FILES = int(os.getenv("INGESTION_BATCH_MAX_FILES", "30"))
+# Pages of one batch OCR'd at once (the process-wide OCR_MAX_CONCURRENCY still applies)
+INGESTION_BATCH_CONCURRENCY = int(os.getenv("INGESTION_BATCH_CONCURRENCY", "4"))
+BATCH_MODES = ("merge", "pages")
+
+
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file", "subject_id", "chapter", "teacher"],
+            "properties": {
+                "file": {"type": "string", "format": "binary"},
+                "subject_id": {"type": "integer"},
+                "chapter": {"type": "integer"},
+                "teacher": {"type": "string"},
+                "background": {"type": "boolean", "default": False},
+            },
+        }}},
+    },
+}
+
+
+def _form_int(form: UploadForm, name: str) -> int:
+    value = form.require(name)
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidUpload(f"Form field '{name}' must be an integer")
+
+
+@router.post("/upload", openapi_extra=UPLOAD_FORM_SCHEMA)
 async def upload_note(
-    file: UploadFile = File(...), 
-    subject_id: int = Form(...),
-    chapter: int = Form(...),
-    teacher: str = Form(...),
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_current_principal)
 ):
-    user_id = current_user.get("sub") # Assuming 'sub' contains the user id (it was emailed in previous turns, but let's check)
-    # Actually, in auth.py we might have used 'email' or 'user_id'. 
-    # Let's check auth.py payload.
-    
-    print(f"[ingestion] upload called by user {user_id}, filename={file.filename}, subject={subject_id}, chapter={chapter}")
+    """Converts an uploaded note image or PDF into a Note.
+
+    PDF pages with a text layer are used as-is; the others are rendered and
+    OCR'd concurrently, and the page texts are joined in order.
+
+    The body is streamed: files over UPLOAD_MAX_BYTES are refused with 413 as
+    soon as that is known, and large images are spooled to disk rather than
+    held in memory.
+
+    With `background=true` the upload is queued and answered immediately with a
+    job id; poll `/ingestion/jobs/{id}` (or stream `/ingestion/jobs/{id}/events`)
+    for the resulting note.
+    """
+    if not ingestion_available():
+        return JSONResponse(status_code=503, content={"detail": "Ingestion agent not configured. Set GOOGLE_API_KEY, use MODEL_PROVIDER=local or enable MOCK_INGESTION for local testing."})
+
+    form = None
     try:
-        # Read image
-        content = await file.read()
-        image_b64 = base64.b64encode(content).decode('utf-8')
+        form = await receive_upload(request)
+        if not form.files:
+            raise InvalidUpload("Missing file")
+        upload = form.files[0]
+        subject_id, chapter = _form_int(form, "subject_id"), _form_int(form, "chapter")
+        teacher = form.require("teacher")
+        background = form.fields.get("background", "false").lower() in ("1", "true", "on", "yes")
+        print(f"[ingestion] upload called by user {principal.user_id}, filename={upload.filename}, size={upload.size}, subject={subject_id}, chapter={chapter}, background={background}")
+
+        if background:
+            # Jobs keep their payload in the database so they survive restarts
+            content = await run_in_threadpool(upload.read_bytes)
+            job = await db.run_sync(create_job, principal.user_id, subject_id, chapter, teacher, upload.filename, content)
+            job_pool.submit(job.id)
+            return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status, "status_url": f"/ingestion/jobs/{job.id}"})
+
+        extracted_content = await extract_note_content(upload, upload.filename)
+        new_note = await db.run_sync(save_note, principal.user_id, subject_id, chapter, teacher, extracted_content)
+
+        return JSONResponse(status_code=200, content={"id": new_note.id, "content": new_note.content})
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"detail": str(e)})
+    except InvalidUpload as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    except IngestionUnavailable as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
+    except UnsupportedImage as e:
+        return JSONResponse(status_code=415, content={"detail": f"Unsupported file: {e}"})
+    except Exception as e:
+        print("[ingestion] Exception:", e)
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+    finally:
+        if form is not None:
+            # Spooled files are deleted off the event loop
+            await run_in_threadpool(form.close)
+
+
+BATCH_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files", "subject_id", "chapter", "teacher"],
+            "properties": {
+                "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                "subject_id": {"type": "integer"},
+                "chapter": {"type": "integer"},
+                "teacher": {"type": "string"},
+                "mode": {"type": "string", "enum": list(BATCH_MODES), "default": "merge"},
+            },
+        }}},
+    },
+}
 
-        # Use PydanticAI to process image
+
+async def _ocr_page(index: int, upload: SpooledUpload, semaphore: asyncio.Semaphore) -> dict:
+    page = {"index": index, "filename": upload.filename, "bytes": upload.size}
+    async with semaphore:
+        started = time.perf_counter()
         try:
-            agent = get_ingestion_agent()
+            page["content"] = await extract_note_content(upload, upload.filename)
+            page["status"] = "ok"
+        except UnsupportedImage as e:
+            page["status"], page["error"] = "failed", f"Unsupported file: {e}"
+        except IngestionUnavailable:
+            raise
         except Exception as e:
-            print(f"[ingestion] get_ingestion_agent raised: {e}")
-            agent = None
-
-        # Allow a mock ingestion mode controlled by env var MOCK_INGESTION=1 (useful for local testing)
-        mock_mode = os.getenv('MOCK_INGESTION', '0') == '1'
-
-        if not agent and not mock_mode:
-            return JSONResponse(status_code=503, content={"detail": "Ingestion agent not configured. Set GOOGLE_API_KEY or enable MOCK_INGESTION for local testing."})
-
-        extracted_content = ""
-        if mock_mode:
-            # Simple deterministic mock: return filename and placeholder markdown
-            extracted_content = f"# Mocked Ingestion for {file.filename}\n\nThis is a mock conversion of the uploaded file. Replace with Gemini output when available.\n\n- Uploaded filename: {file.filename}\n- Suggested summary: This note covers the key points from the lecture."
-        else:
-            # Use our new high-quality OCR extraction
-            extracted_content = await extract_text_from_image(content)
-
-        # Save to DB
-        from ..models import User
-        # Prefer numeric user_id from token payload, fall back to email lookup
-        token_user_id = current_user.get('user_id') if isinstance(current_user, dict) else None
-        token_user_email = current_user.get('sub') if isinstance(current_user, dict) else None
-        db_user = None
-        if token_user_id:
-            db_user = db.query(User).filter(User.id == token_user_id).first()
-        if not db_user and token_user_email:
-            db_user = db.query(User).filter(User.email == token_user_email).first()
-        if not db_user:
-            return JSONResponse(status_code=401, content={"detail": "Authenticated user not found in database"})
-
-        new_note = Note(
-            content=extracted_content,
-            user_id=db_user.id,
-            subject_id=subject_id,
-            chapter=chapter,
-            teacher=teacher
-        )
-        db.add(new_note)
-        db.commit()
-        db.refresh(new_note)
-
-        # Trigger consensus check (placeholder for now)
-        # In a real app, this might be a background task
-        # check_consensus(subject_id, chapter, db)
+            print(f"[ingestion] batch page {index} ({upload.filename}) failed: {e}")
+            page["status"], page["error"] = "failed", str(e) or type(e).__name__
+        page["ocr_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return page
 
-        return JSONResponse(status_code=200, content={"id": new_note.id, "content": new_note.content})
+
+@router.post("/upload/batch", openapi_extra=BATCH_FORM_SCHEMA)
+async def upload_batch(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_current_principal)
+):
+    """Converts the photos of one lecture into notes in a single request.
+
+    Pages are OCR'd concurrently (INGESTION_BATCH_CONCURRENCY at a time). With
+    `mode=merge` (default) the pages that succeeded become one Note, in upload
+    order; with `mode=pages` each page becomes its own Note. All notes are
+    written in one transaction. A failed page is reported in `pages` without
+    failing the others; the response is 422 only when no page succeeded.
+    """
+    if not ingestion_available():
+        return JSONResponse(status_code=503, content={"detail": "Ingestion agent not configured. Set GOOGLE_API_KEY, use MODEL_PROVIDER=local or enable MOCK_INGESTION for local testing."})
+
+    started = time.perf_counter()
+    form = None
+    try:
+        form = await receive_upload(request, max_files=INGESTION_BATCH_MAX_FILES)
+        received = time.perf_counter()
+        if not form.files:
+            raise InvalidUpload("Missing files")
+        subject_id, chapter = _form_int(form, "subject_id"), _form_int(form, "chapter")
+        teacher = form.require("teacher")
+        mode = form.fields.get("mode", "merge")
+        if mode not in BATCH_MODES:
+            raise InvalidUpload(f"mode must be one of {', '.join(BATCH_MODES)}")
+        print(f"[ingestion] batch upload by user {principal.user_id}: {len(form.files)} pages, mode={mode}, subject={subject_id}, chapter={chapter}")
+
+        semaphore = asyncio.Semaphore(INGESTION_BATCH_CONCURRENCY)
+        pages = await asyncio.gather(*(_ocr_page(i, upload, semaphore) for i, upload in enumerate(form.files)))
+        extracted = time.perf_counter()
+
+        done = [page for page in pages if page["status"] == "ok"]
+        notes = []
+        if done:
+            if mode == "merge":
+                contents = [PAGE_SEPARATOR.join(page["content"] for page in done)]
+                groups = [[page["index"] for page in done]]
+            else:
+                contents = [page["content"] for page in done]
+                groups = [[page["index"]] for page in done]
+            ids = await db.run_sync(save_notes, principal.user_id, subject_id, chapter, teacher, contents)
+            notes = [{"id": note_id, "pages": group} for note_id, group in zip(ids, groups)]
+        saved = time.perf_counter()
+
+        for page in pages:
+            page.pop("content", None)
+        body = {
+            "mode": mode,
+            "notes": notes,
+            "pages": pages,
+            "succeeded": len(done),
+            "failed": len(pages) - len(done),
+            "timings": {
+                "receive_ms": round((received - started) * 1000, 1),
+                "ocr_ms": round((extracted - received) * 1000, 1),
+                "save_ms": round((saved - extracted) * 1000, 1),
+                "total_ms": round((saved - started) * 1000, 1),
+            },
+        }
+        return JSONResponse(status_code=200 if done else 422, content=body)
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"detail": str(e)})
+    except InvalidUpload as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    except IngestionUnavailable as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
     except Exception as e:
         print("[ingestion] Exception:", e)
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+    finally:
+        if form is not None:
+            await run_in_threadpool(form.close)
+
+
+def _load_job(db: Session, job_id: str, principal: Principal) -> IngestionJob:
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    if not job or job.user_id != principal.user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+def get_job(job_id: str, db: Session = Depends(get_db), principal: Principal = Depends(get_current_principal)):
+    return _load_job(db, job_id, principal)
+
+
+async def _job_snapshot(job_id: str) -> dict:
+    # A short-lived session per poll, so the stream holds no connection between polls
+    async with AsyncSessionLocal() as db:
+        job = await db.get(IngestionJob, job_id)
+        return IngestionJobResponse.model_validate(job).model_dump(mode="json")
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request, principal: Principal = Depends(get_current_principal)):
+    """Server-Sent Events stream that emits the job state on every change until it finishes."""
+    # Not a request-scoped session: that would stay checked out until the stream ends
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(_load_job, job_id, principal)
+
+    async def events():
+        last = None
+        while True:
+            snapshot = await _job_snapshot(job_id)
+            state = (snapshot["status"], snapshot["stage"])
+            if state != last:
+                last = state
+                yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+            if snapshot["status"] in TERMINAL_STATUSES or await request.is_disconnected():
+                return
+            await asyncio.sleep(INGESTION_SSE_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -1,61 +1,160 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import func, or_, and_, select
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_db, AsyncSessionLocal
 from ..models import Note, User, Subject
-from ..schemas.schemas import NoteResponse
+from ..schemas.schemas import NoteResponse, NoteSummaryResponse, SearchHit
 from typing import Optional
-from ..core.security import decode_access_token
+import base64
+import json
+import os
+from ..core.security import Principal, get_current_principal
+from ..core.vector_index import vector_index, hydrate_hits
 
 router = APIRouter()
 
 
-def get_current_user_from_header(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
-    if not authorization:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
-    scheme, _, token = authorization.partition(" ")
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    user = db.query(User).filter(User.email == payload.get('sub')).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
-
-
-@router.get("/all", response_model=list[NoteResponse])
-def all_notes(subject_id: int, chapter: Optional[int] = None, db: Session = Depends(get_db)):
-    """Fetch all notes for a specific subject (and optionally a chapter), including user metadata."""
-    query = db.query(Note, User.pseudo_name, User.teacher, User.year)\
-              .join(User, Note.user_id == User.id)\
-              .filter(Note.subject_id == subject_id)
+NOTES_PAGE_MAX = 200
+SUMMARY_EXCERPT_CHARS = int(os.getenv("NOTES_SUMMARY_EXCERPT_CHARS", "280"))
+NOTE_FIELDS = ("full", "summary")
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, types: list) -> list:
+    """Cursor values, checked against the key types so a crafted cursor is a 400, not a database error."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        values = None
+    # type() rather than isinstance(): JSON booleans are ints to Python
+    if not isinstance(values, list) or len(values) != len(types) or \
+            any(type(value) is not expected for value, expected in zip(values, types)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+def _after(keys: list, values: list):
+    """Keyset predicate: rows strictly after `values` in the order given by (expr, descending, type) `keys`."""
+    (expr, descending, _), value = keys[0], values[0]
+    beyond = expr < value if descending else expr > value
+    if len(keys) == 1:
+        return beyond
+    return or_(beyond, and_(expr == value, _after(keys[1:], values[1:])))
+
+
+def _page(query, keys: list, cursor: Optional[str], limit: Optional[int], response: Response, cursor_values):
+    """Applies keyset ordering and pagination; sets X-Next-Cursor when more rows follow."""
+    if cursor:
+        query = query.filter(_after(keys, _decode_cursor(cursor, [value_type for _, _, value_type in keys])))
+    query = query.order_by(*[expr.desc() if descending else expr.asc() for expr, descending, _ in keys])
+    if limit is None:
+        return query.all()
+    limit = max(1, min(limit, NOTES_PAGE_MAX))
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(cursor_values(rows[-1]))
+    return rows
+
+
+def _check_fields(fields: str):
+    if fields not in NOTE_FIELDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"fields must be one of {', '.join(NOTE_FIELDS)}")
+
+
+def _content_column(fields: str):
+    if fields == "summary":
+        # Excerpt is cut by the database so full note bodies never leave it
+        return func.substr(Note.content, 1, SUMMARY_EXCERPT_CHARS).label("excerpt")
+    return Note.content
+
+
+@router.get("/all", response_model=list[NoteResponse] | list[NoteSummaryResponse])
+def all_notes(
+    response: Response,
+    subject_id: int,
+    chapter: Optional[int] = None,
+    fields: str = "full",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Fetch all notes for a specific subject (and optionally a chapter), including user metadata.
+
+    Pass `limit` to paginate; the `X-Next-Cursor` response header carries the
+    `cursor` for the next page. `fields=summary` returns a short excerpt instead
+    of the full content.
+    """
+    _check_fields(fields)
+    query = db.query(
+        Note.id, Note.user_id, Note.subject_id, Note.chapter, Note.created_at, _content_column(fields),
+        User.pseudo_name, User.teacher, User.year,
+    ).join(User, Note.user_id == User.id)\
+     .filter(Note.subject_id == subject_id)
     
     if chapter is not None and chapter > 0:
         query = query.filter(Note.chapter == chapter)
-        
-    notes = query.order_by(User.teacher, User.year.desc(), User.pseudo_name).all()
-    
-    # Map the join result to a list of NoteResponse compatible objects
-    results = []
-    for note, p_name, teacher, year in notes:
-        n_dict = {
-            "id": note.id,
-            "content": note.content,
-            "user_id": note.user_id,
-            "subject_id": note.subject_id,
-            "chapter": note.chapter,
-            "created_at": note.created_at,
-            "pseudo_name": p_name,
-            "teacher": teacher,
-            "year": year
-        }
-        results.append(NoteResponse(**n_dict))
-    return results
-
-@router.get("/my", response_model=list[NoteResponse])
-def my_notes(subject_id: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user_from_header)):
-    q = db.query(Note).filter(Note.user_id == current_user.id)
+
+    # Same order as before (teacher, year desc, pseudo name) made total by the note id;
+    # NULLs are coalesced so the keyset comparison is well defined.
+    keys = [
+        (func.coalesce(User.teacher, ""), False, str),
+        (func.coalesce(User.year, 0), True, int),
+        (func.coalesce(User.pseudo_name, ""), False, str),
+        (Note.id, False, int),
+    ]
+    rows = _page(query, keys, cursor, limit, response,
+                 lambda r: [r.teacher or "", r.year or 0, r.pseudo_name or "", r.id])
+    return [row._asdict() for row in rows]
+
+@router.get("/my", response_model=list[NoteResponse] | list[NoteSummaryResponse])
+def my_notes(
+    response: Response,
+    subject_id: Optional[int] = None,
+    fields: str = "full",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_current_principal),
+):
+    _check_fields(fields)
+    q = db.query(
+        Note.id, Note.user_id, Note.subject_id, Note.chapter, Note.created_at, _content_column(fields),
+        Note.raw_image_url, Note.teacher,
+    ).filter(Note.user_id == principal.user_id)
     if subject_id:
         q = q.filter(Note.subject_id == subject_id)
-    # Order by chapter asc, then created_at asc
-    q = q.order_by(Note.chapter.asc().nulls_last(), Note.created_at.asc())
-    return q.all()
+    # Order by chapter asc, then upload order; ids are assigned in creation order,
+    # which keeps the cursor to plain integers.
+    keys = [(Note.chapter, False, int), (Note.id, False, int)]
+    rows = _page(q, keys, cursor, limit, response, lambda r: [r.chapter, r.id])
+    return [row._asdict() for row in rows]
+
+
+@router.get("/{note_id}/similar", response_model=list[SearchHit])
+async def similar_notes(note_id: int, k: int = 5, metric: str = "cosine", same_chapter: bool = True):
+    """Notes of the same subject (and by default the same chapter) whose embeddings are closest to this note's."""
+    async with AsyncSessionLocal() as db:
+        note = (await db.execute(
+            select(Note.id, Note.subject_id, Note.chapter, Note.embedding).where(Note.id == note_id)
+        )).first()
+    if not note:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
+    if not note.embedding:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Note has no embedding yet")
+    try:
+        hits = await vector_index.search(
+            note.embedding,
+            subject_id=note.subject_id,
+            chapter=note.chapter if same_chapter else None,
+            k=max(1, min(k, 100)),
+            metric=metric,
+            exclude_ids=(note.id,),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(hydrate_hits, "notes", hits)
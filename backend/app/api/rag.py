@@ -1,73 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from ..database import AsyncSessionLocal
 from ..models import MasterNote
-from ..schemas.schemas import TutorRequest
-from ..core.ai_agents import get_model
-from ..core.security import decode_access_token
-from pydantic_ai import Agent
+from ..schemas.schemas import TutorRequest, RagSearchRequest, SearchHit
+from ..core.ai_agents import get_tutor_agent
+from ..core.security import Principal, get_optional_principal, get_current_principal
+from ..core.vector_index import vector_index, hydrate_hits
+from ..core.embeddings import embed_query
+from ..core.quiz_store import get_quiz_store
 from typing import Optional
+import asyncio
 import json
+import logging
 import re
 
 router = APIRouter()
+logger = logging.getLogger("hivemind.tutor")
+
+async def _master_context(user_id: Optional[int], payload: TutorRequest) -> str:
+    """Builds the Master Note context on a short-lived session, closed before the tutor model is called."""
+    master = None
+    if user_id:
+        async with AsyncSessionLocal() as db:
+            if payload.subject_id > 0 and payload.chapter > 0:
+                master = await db.scalar(select(MasterNote).where(
+                    MasterNote.user_id == user_id,
+                    MasterNote.subject_id == payload.subject_id,
+                    MasterNote.chapter == payload.chapter
+                ).limit(1))
+
+            # Fallback: find the most recently updated master note for this user
+            if not master:
+                master = await db.scalar(select(MasterNote).where(
+                    MasterNote.user_id == user_id
+                ).order_by(MasterNote.created_at.desc()).limit(1))
+
+    if master:
+        return f"Here is the collective knowledge (Master Note) for this chapter created by the student:\n\n{master.content}\n\n"
+    return "Note: No specific Master Note has been found for the requested Subject/Chapter. Use your general training data to help the student.\n\n"
 
-# In-memory store for the latest quiz per user (dev-only; replace with persistent store for production)
-last_quiz_by_user: dict[int, dict] = {}
 
 @router.post("/tutor")
 async def tutor_interaction(
-    payload: TutorRequest, 
-    db: Session = Depends(get_db),
-    authorization: Optional[str] = Header(None)
+    payload: TutorRequest,
+    principal: Optional[Principal] = Depends(get_optional_principal)
 ):
-    user_id = None
-    if authorization:
-        scheme, _, token = authorization.partition(" ")
-        token_data = decode_access_token(token)
-        if token_data:
-            from ..models import User
-            user = db.query(User).filter(User.email == token_data.get('sub')).first()
-            if user:
-                user_id = user.id
-
-    master = None
-    if user_id:
-        if payload.subject_id > 0 and payload.chapter > 0:
-            master = db.query(MasterNote).filter(
-                MasterNote.user_id == user_id,
-                MasterNote.subject_id == payload.subject_id, 
-                MasterNote.chapter == payload.chapter
-            ).first()
-        
-        # Fallback: find the most recently updated master note for this user
-        if not master:
-            master = db.query(MasterNote).filter(
-                MasterNote.user_id == user_id
-            ).order_by(MasterNote.created_at.desc()).first()
-
-    context = ""
-    if master:
-        context = f"Here is the collective knowledge (Master Note) for this chapter created by the student:\n\n{master.content}\n\n"
-    else:
-        context = "Note: No specific Master Note has been found for the requested Subject/Chapter. Use your general training data to help the student.\n\n"
+    user_id = principal.user_id if principal else None
+    context = await _master_context(user_id, payload)
 
     # 2. Setup Tutor Agent
-    model = get_model('gemini-pro-latest')
-    tutor_agent = Agent(
-        model,
-        system_prompt=(
-            "You are an expert AI Tutor. Your goal is to help students learn using the collective classroom knowledge (Master Note provided). "
-            f"Mode: {payload.mode}. "
-            "If in 'chat' mode, answer questions clearly and directly using the Master Note as context when available. "
-            "If in 'quiz' mode, respond as follows: "
-            "- When the student asks for a quiz (e.g., 'quiz me', 'give me a question'), produce exactly ONE multiple-choice question with four options labeled A), B), C), and D). "
-            "- Do NOT include or reveal the correct answer in the same response — wait for the student to submit their choice. "
-            "- When the student submits an answer (e.g., 'I choose C' or 'Answer: B'), evaluate that choice against the Master Note and reply 'Correct' or 'Incorrect' followed by a brief explanation referencing the Master Note. "
-            "If in 'flashcards' mode, provide a term and its definition. "
-            "Always be encouraging, concise, and academic."
-        )
-    )
+    tutor_agent = get_tutor_agent(payload.mode)
 
     # 3. Special handling for quiz mode to keep state and evaluate answers
     if payload.mode == 'quiz':
@@ -80,11 +64,11 @@ async def tutor_interaction(
         # Detect answer submissions like 'A', 'I choose B', 'Answer: C', etc.
         if re.search(r"\b([abcd])\b", normalized):
             # This is an answer submission
-            if user_id not in last_quiz_by_user:
+            quiz = await run_in_threadpool(get_quiz_store().get, user_id)
+            if not quiz:
                 return {"answer": "I don't have an active quiz question for you. Say 'Quiz me' to get a question."}
-            match = re.search(r"([abcd])", normalized)
+            match = re.search(r"\b([abcd])\b", normalized)
             choice = match.group(1).upper() if match else None
-            quiz = last_quiz_by_user.get(user_id, {})
             correct = quiz.get('answer')
             explanation = quiz.get('explanation', '')
             if not choice or not correct:
@@ -111,7 +95,7 @@ async def tutor_interaction(
             parsed = json.loads(json_str)
 
             # Store the quiz (including answer) server-side for later evaluation
-            last_quiz_by_user[user_id] = parsed
+            await run_in_threadpool(get_quiz_store().set, user_id, parsed)
 
             # Build user-facing question without revealing the answer
             options_text = "\n".join([f"{k}) {v}" for k, v in parsed['options'].items()])
@@ -130,24 +114,102 @@ async def tutor_interaction(
         return {"answer": "I'm sorry, I am having trouble connecting to the brain right now."}
 
 
-@router.get("/search")
-async def search_rag():
-    return {"message": "RAG search results"}
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/tutor/stream")
+async def tutor_stream(
+    payload: TutorRequest,
+    request: Request,
+    principal: Optional[Principal] = Depends(get_optional_principal)
+):
+    """Streams the tutor answer as Server-Sent Events while it is generated (chat and flashcards modes).
+
+    Emits `delta` events carrying text chunks, then a single `done` event, or an
+    `error` event if generation fails. Quiz mode needs the whole structured
+    answer before replying, so it stays on POST /rag/tutor.
+    """
+    if payload.mode == 'quiz':
+        raise HTTPException(status_code=400, detail="Quiz mode is not streamed; use POST /rag/tutor")
+
+    user_id = principal.user_id if principal else None
+    prompt = f"{await _master_context(user_id, payload)}Student Request: {payload.question}"
+    tutor_agent = get_tutor_agent(payload.mode)
+
+    async def events():
+        # Headers are flushed with this first event, before the model is even called.
+        yield _sse("start", {"mode": payload.mode})
+        try:
+            async with tutor_agent.run_stream(prompt) as result:
+                # No debouncing: forward each chunk as soon as the model produces it
+                async for delta in result.stream_text(delta=True, debounce_by=None):
+                    if await request.is_disconnected():
+                        # Leaving the context manager closes the upstream model stream.
+                        logger.info("client disconnected, stopping tutor stream")
+                        return
+                    yield _sse("delta", {"text": delta})
+            yield _sse("done", {})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Tutor stream error: {e}")
+            yield _sse("error", {"detail": "I'm sorry, I am having trouble connecting to the brain right now."})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _search(payload: RagSearchRequest) -> list[dict]:
+    if (payload.embedding is None) == (payload.query is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'embedding' or 'query'")
+    if payload.query is not None and not payload.query.strip():
+        raise HTTPException(status_code=400, detail="query must not be empty")
+    embedding = payload.embedding if payload.embedding is not None else await embed_query(payload.query)
+    try:
+        hits = await vector_index.search(
+            embedding,
+            subject_id=payload.subject_id,
+            chapter=payload.chapter,
+            kind=payload.kind,
+            k=max(1, min(payload.k, 100)),
+            metric=payload.metric,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(hydrate_hits, payload.kind, hits)
+
+
+@router.post("/search", response_model=list[SearchHit])
+async def search_rag(payload: RagSearchRequest, principal: Principal = Depends(get_current_principal)):
+    """Exact top-k similarity search over note (or master note) embeddings of a subject/chapter.
+
+    The query is either `embedding`, a vector from the same embedder as the stored
+    rows, or `query` text that the server embeds with that embedder.
+    """
+    return await _search(payload)
+
+
+@router.get("/search", response_model=list[SearchHit])
+async def search_rag_by_text(
+    subject_id: int,
+    query: str,
+    chapter: Optional[int] = None,
+    kind: str = "notes",
+    k: int = 10,
+    metric: str = "cosine",
+    principal: Principal = Depends(get_current_principal),
+):
+    """GET form of /rag/search for text queries; a raw `embedding` has to be POSTed."""
+    return await _search(RagSearchRequest(subject_id=subject_id, chapter=chapter, query=query, kind=kind, k=k, metric=metric))
 
 @router.get("/quiz/latest")
-async def get_latest_quiz(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    scheme, _, token = authorization.partition(" ")
-    token_data = decode_access_token(token)
-    if not token_data:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    # Find user id
-    from ..models import User
-    user = db.query(User).filter(User.email == token_data.get('sub')).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    quiz = last_quiz_by_user.get(user.id)
+async def get_latest_quiz(principal: Principal = Depends(get_current_principal)):
+    quiz = await run_in_threadpool(get_quiz_store().get, principal.user_id)
     if not quiz:
         raise HTTPException(status_code=404, detail="No active quiz found")
     # Remove the answer before returning
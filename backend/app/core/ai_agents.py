@@ -1,45 +1,138 @@
+import asyncio
 import os
 from pydantic_ai import Agent
 from pydantic_ai.models.google import GoogleModel
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+import time
+from .llm_metrics import instrument_model, record_llm_call, outcome_of
+from .local_model import make_local_model, local_ocr
 
 load_dotenv()
 
 # Use the API key from environment
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Model provider per agent: MODEL_PROVIDER sets the default, <AGENT>_MODEL_PROVIDER
+# overrides it for one agent (OCR, INGESTION, CONSENSUS, TUTOR). "local" is a
+# deterministic offline stand-in with simulated latency (see core/local_model.py).
+MODEL_PROVIDERS = ("google", "local")
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "google")
+
+
+def provider_for(agent: str) -> str:
+    provider = os.getenv(f"{agent.upper()}_MODEL_PROVIDER", MODEL_PROVIDER)
+    if provider not in MODEL_PROVIDERS:
+        raise ValueError(f"Unknown model provider '{provider}' for {agent} (choose from {', '.join(MODEL_PROVIDERS)})")
+    return provider
+
+
+def provider_available(provider: str) -> bool:
+    return provider == "local" or bool(GOOGLE_API_KEY)
+
+# OCR runs through one long-lived client (its HTTP connection pool is reused across
+# uploads) and the async API, with a cap on concurrent Gemini calls per process.
+OCR_MODEL_ID = 'gemini-2.0-flash'  # very reliable in tests
+# Bump OCR_PROMPT_VERSION whenever OCR_PROMPT changes so cached OCR results are not reused.
+OCR_PROMPT_VERSION = '1'
+OCR_PROMPT = 'Extract all the text in this image verbatim. Do not summarize. Maintain the structure and if there is a table, format it as a markdown table.'
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "8"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "120"))
+
+_genai_client = None
+_ocr_semaphore = None
+
+
+def ocr_model_label() -> str:
+    """Model that OCR actually runs on; local results are labelled apart from Gemini's (metrics, OCR cache)."""
+    return f"local-{OCR_MODEL_ID}" if provider_for("ocr") == "local" else OCR_MODEL_ID
+
 def get_genai_client():
+    global _genai_client
     if not GOOGLE_API_KEY:
         return None
-    return genai.Client(api_key=GOOGLE_API_KEY)
+    if _genai_client is None:
+        _genai_client = genai.Client(api_key=GOOGLE_API_KEY)
+    return _genai_client
+
+async def close_genai_client():
+    """Releases the shared client's connection pool (called on app shutdown)."""
+    global _genai_client
+    if _genai_client is not None:
+        await _genai_client.aio.aclose()
+        _genai_client = None
+
+def _get_ocr_semaphore() -> asyncio.Semaphore:
+    global _ocr_semaphore
+    if _ocr_semaphore is None:
+        _ocr_semaphore = asyncio.Semaphore(OCR_MAX_CONCURRENCY)
+    return _ocr_semaphore
+
+async def extract_text_from_image(image_bytes: bytes, mime_type: str) -> str:
+    """Uses the latest google-genai SDK for high-quality OCR without blocking the event loop.
+
+    `mime_type` must describe `image_bytes` (see core/image_prep.py).
+    """
+    if provider_for("ocr") == "local":
+        async with _get_ocr_semaphore():
+            started = time.perf_counter()
+            try:
+                text, input_tokens, output_tokens = await local_ocr(image_bytes)
+            except BaseException as e:
+                record_llm_call("ocr", ocr_model_label(), time.perf_counter() - started, outcome=outcome_of(e))
+                raise
+        record_llm_call("ocr", ocr_model_label(), time.perf_counter() - started, input_tokens, output_tokens)
+        return text
 
-async def extract_text_from_image(image_bytes: bytes) -> str:
-    """Uses the latest google-genai SDK for high-quality OCR."""
     client = get_genai_client()
     if not client:
         raise ValueError("GOOGLE_API_KEY not configured")
-    
-    # Using gemini-2.0-flash which was very reliable in tests
-    model_id = 'gemini-2.0-flash'
-    
-    response = client.models.generate_content(
-        model=model_id,
-        contents=[
-            types.Part.from_bytes(
-                data=image_bytes,
-                mime_type='image/jpeg',
-            ),
-            'Extract all the text in this image verbatim. Do not summarize. Maintain the structure and if there is a table, format it as a markdown table.'
-        ]
+
+    async with _get_ocr_semaphore():
+        # Timed inside the semaphore: queueing for a slot is not model latency
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                client.aio.models.generate_content(
+                    model=OCR_MODEL_ID,
+                    contents=[
+                        types.Part.from_bytes(
+                            data=image_bytes,
+                            mime_type=mime_type,
+                        ),
+                        OCR_PROMPT
+                    ]
+                ),
+                timeout=OCR_TIMEOUT_SECONDS,
+            )
+        except BaseException as e:
+            record_llm_call("ocr", OCR_MODEL_ID, time.perf_counter() - started, outcome=outcome_of(e))
+            raise
+    usage = response.usage_metadata
+    record_llm_call(
+        "ocr", OCR_MODEL_ID, time.perf_counter() - started,
+        (usage.prompt_token_count or 0) if usage else 0,
+        (usage.candidates_token_count or 0) if usage else 0,
     )
     return response.text
 
-def get_model(model_name: str):
-    """Initializes the Google model. It picks up GOOGLE_API_KEY from os.environ."""
+_models = {}
+
+def _google_model(model_name: str):
+    # Picks up GOOGLE_API_KEY from os.environ
     return GoogleModel(model_name)
 
+_MODEL_FACTORIES = {"google": _google_model, "local": make_local_model}
+
+def get_model(model_name: str, provider: str = "google"):
+    """Returns the shared model for this provider and name."""
+    key = (provider, model_name)
+    model = _models.get(key)
+    if model is None:
+        model = _models[key] = _MODEL_FACTORIES[provider](model_name)
+    return model
+
 # Lazy-initialize agents so the server can run without API keys for local testing
 _ingestion_agent = None
 _consensus_agent = None
@@ -50,12 +143,13 @@ def get_ingestion_agent():
     global _ingestion_agent
     if _ingestion_agent is not None:
         return _ingestion_agent
-    if not GOOGLE_API_KEY:
+    provider = provider_for("ingestion")
+    if not provider_available(provider):
         return None
     try:
         # Using 'gemini-flash-latest' which was confirmed to work in Jan 2026 env
         _ingestion_agent = Agent(
-            get_model('gemini-flash-latest'),
+            instrument_model(get_model('gemini-flash-latest', provider), "ingestion"),
             system_prompt="You are an expert OCR and Note Synthesis agent. Convert images of handwritten notes into structured Markdown. Maintain original meaning but organize clearly.",
         )
         return _ingestion_agent
@@ -67,12 +161,13 @@ def get_consensus_agent():
     global _consensus_agent
     if _consensus_agent is not None:
         return _consensus_agent
-    if not GOOGLE_API_KEY:
+    provider = provider_for("consensus")
+    if not provider_available(provider):
         return None
     try:
         # Using 'gemini-pro-latest' which was confirmed to work in Jan 2026 env
         _consensus_agent = Agent(
-            get_model('gemini-pro-latest'),
+            instrument_model(get_model('gemini-pro-latest', provider), "consensus"),
             system_prompt="""You are a Master Note Synthesizer. 
             You will be provided with multiple sets of student notes for the same chapter.
             Your task is to create a single, comprehensive, and high-quality Markdown study guide.
@@ -88,3 +183,40 @@ def get_consensus_agent():
     except Exception as e:
         print(f"Warning: consensus agent not available: {e}")
         return None
+
+
+# Tutor agents are built once per (model, mode) and reused; only the Master Note
+# context and the student's question vary per request, and they go in the user prompt.
+TUTOR_MODEL = 'gemini-pro-latest'
+TUTOR_MODES = ('chat', 'quiz', 'flashcards')
+
+_TUTOR_BASE_PROMPT = (
+    "You are an expert AI Tutor. Your goal is to help students learn using the collective classroom knowledge (Master Note provided). "
+    "Always be encouraging, concise, and academic. "
+)
+_TUTOR_MODE_PROMPTS = {
+    'chat': "Mode: chat. Answer questions clearly and directly using the Master Note as context when available.",
+    'quiz': (
+        "Mode: quiz. Respond as follows: "
+        "- When the student asks for a quiz (e.g., 'quiz me', 'give me a question'), produce exactly ONE multiple-choice question with four options labeled A), B), C), and D). "
+        "- Do NOT include or reveal the correct answer in the same response — wait for the student to submit their choice. "
+        "- When the student submits an answer (e.g., 'I choose C' or 'Answer: B'), evaluate that choice against the Master Note and reply 'Correct' or 'Incorrect' followed by a brief explanation referencing the Master Note."
+    ),
+    'flashcards': "Mode: flashcards. Provide a term and its definition.",
+}
+
+_tutor_agents = {}
+
+def get_tutor_agent(mode: str, model_name: str = TUTOR_MODEL) -> Agent:
+    """Returns the cached tutor agent for this mode; unknown modes get the chat agent."""
+    if mode not in TUTOR_MODES:
+        mode = 'chat'
+    provider = provider_for("tutor")
+    key = (provider, model_name, mode)
+    agent = _tutor_agents.get(key)
+    if agent is None:
+        agent = _tutor_agents[key] = Agent(
+            instrument_model(get_model(model_name, provider), f"tutor_{mode}"),
+            system_prompt=_TUTOR_BASE_PROMPT + _TUTOR_MODE_PROMPTS[mode],
+        )
+    return agent
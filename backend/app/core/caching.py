@@ -0,0 +1,118 @@
+"""Shared in-process caching helpers.
+
+LRUCache is a thread-safe least-recently-used map bounded by entry count and/or
+total size, with optional per-entry expiry. SingleFlight lets concurrent
+coroutines asking for the same key share one run of the work instead of
+repeating it.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+class LRUCache(Generic[K, V]):
+    """Evicts the least recently used entries past max_entries or past max_size (as measured by `sizeof`).
+
+    Entries put with `expires_at` (on `clock`) read as missing once it has passed.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_size: Optional[int] = None,
+                 sizeof: Callable[[V], int] = lambda value: 1, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self._clock = clock
+        self._entries: OrderedDict[K, tuple[V, int, Optional[float]]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                self._size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V, expires_at: Optional[float] = None):
+        """Stores (or replaces) an entry; a value larger than max_size on its own is not stored."""
+        size = self._sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (value, size, expires_at)
+            self._size += size
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) or \
+                    (self.max_size is not None and self._size > self.max_size):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: K):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+class SingleFlight(Generic[K, T]):
+    """The first caller for a key runs the work; concurrent callers for the same key await its result.
+
+    For one event loop. If the running call is cancelled its waiters are
+    cancelled too; if it fails they get the same exception.
+    """
+
+    def __init__(self):
+        self._inflight: dict[K, asyncio.Future] = {}
+
+    async def run(self, key: K, work: Callable[[], Awaitable[T]]) -> T:
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await work()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark retrieved so an unawaited future does not log a warning
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,156 @@
+"""Single-shot, incremental and hierarchical (map-reduce) Master Note synthesis.
+
+In map-reduce mode the notes are grouped into batches of at most `fan_out`
+notes and `batch_token_budget` estimated tokens, each batch is synthesized into
+a partial note concurrently (at most `max_parallel` agent calls at a time), and
+the partials are merged level by level until one batch remains, which becomes
+the final Master Note.
+"""
+import asyncio
+import os
+import time
+
+CONSENSUS_FAN_OUT = int(os.getenv("CONSENSUS_FAN_OUT", "8"))
+CONSENSUS_BATCH_TOKENS = int(os.getenv("CONSENSUS_BATCH_TOKENS", "12000"))
+CONSENSUS_MAX_PARALLEL = int(os.getenv("CONSENSUS_MAX_PARALLEL", "4"))
+# In "auto" mode, note sets estimated above this many tokens use map-reduce
+CONSENSUS_MAP_REDUCE_MIN_TOKENS = int(os.getenv("CONSENSUS_MAP_REDUCE_MIN_TOKENS", "30000"))
+
+SYNTHESIS_MODES = ("auto", "single", "map_reduce")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return len(text) // 4 + 1
+
+
+def make_batches(docs: list[str], fan_out: int, token_budget: int) -> list[list[str]]:
+    """Greedily groups docs, in order, into batches bounded by count and estimated tokens.
+
+    A single doc larger than the budget gets a batch of its own.
+    """
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for doc in docs:
+        tokens = estimate_tokens(doc)
+        if current and (len(current) >= fan_out or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(doc)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _single_prompt(chapter: int, docs: list[str]) -> str:
+    combined_notes = "\n---\n".join(docs)
+    return f"Here are several student notes for Chapter {chapter}. Please synthesize them into a single Master Note:\n\n{combined_notes}"
+
+
+def _partial_prompt(chapter: int, docs: list[str], level: int, index: int, total: int) -> str:
+    combined = "\n---\n".join(docs)
+    if level == 0:
+        source = "student notes"
+    else:
+        source = "partial study guides, each synthesized from a different group of student notes"
+    return (
+        f"Here are {source} for Chapter {chapter} (group {index + 1} of {total}). "
+        "Synthesize them into one partial Master Note that keeps every unique fact, definition, table and example. "
+        "It will later be merged with other partial notes, so do not add an introduction or conclusion:\n\n"
+        f"{combined}"
+    )
+
+
+def _final_merge_prompt(chapter: int, partials: list[str]) -> str:
+    combined = "\n---\n".join(partials)
+    return (
+        f"Here are partial Master Notes for Chapter {chapter}, each synthesized from a different group of student notes. "
+        "Merge them into a single Master Note: remove duplication, reconcile overlapping sections and keep one logical flow:\n\n"
+        f"{combined}"
+    )
+
+
+def _incremental_prompt(chapter: int, master_content: str, docs: list[str]) -> str:
+    combined = "\n---\n".join(docs)
+    return (
+        f"Here is the current Master Note for Chapter {chapter}, followed by new or updated student notes. "
+        "Fold the new information into the Master Note: keep its structure and everything it already covers, "
+        "add any new facts in the right sections and correct anything the updated notes contradict. "
+        "Return the complete updated Master Note.\n\n"
+        f"CURRENT MASTER NOTE:\n{master_content}\n\nNEW NOTES:\n{combined}"
+    )
+
+
+async def synthesize_incremental(agent, chapter: int, master_content: str, docs: list[str]) -> tuple[str, list[dict]]:
+    """Updates an existing Master Note with only the new or changed notes."""
+    started = time.perf_counter()
+    result = await agent.run(_incremental_prompt(chapter, master_content, docs))
+    stage = {"stage": "incremental", "inputs": len(docs), "calls": 1, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    return str(result.output), [stage]
+
+
+async def synthesize_single(agent, chapter: int, docs: list[str]) -> tuple[str, list[dict]]:
+    started = time.perf_counter()
+    result = await agent.run(_single_prompt(chapter, docs))
+    stage = {"stage": "single", "inputs": len(docs), "calls": 1, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    return str(result.output), [stage]
+
+
+async def synthesize_map_reduce(
+    agent,
+    chapter: int,
+    docs: list[str],
+    fan_out: int = CONSENSUS_FAN_OUT,
+    batch_token_budget: int = CONSENSUS_BATCH_TOKENS,
+    max_parallel: int = CONSENSUS_MAX_PARALLEL,
+) -> tuple[str, list[dict]]:
+    """Returns the final Master Note content and per-stage timings."""
+    fan_out = max(2, fan_out)
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    stages: list[dict] = []
+
+    async def run_partial(prompt: str) -> str:
+        async with semaphore:
+            result = await agent.run(prompt)
+        return str(result.output)
+
+    current = docs
+    level = 0
+    while True:
+        batches = make_batches(current, fan_out, batch_token_budget)
+        if level > 0 and len(batches) == len(current):
+            # Partials are individually over budget; group by count alone so the tree still shrinks.
+            batches = [current[i:i + fan_out] for i in range(0, len(current), fan_out)]
+        if len(batches) == 1:
+            break
+        started = time.perf_counter()
+        current = await asyncio.gather(*[
+            run_partial(_partial_prompt(chapter, batch, level, i, len(batches)))
+            for i, batch in enumerate(batches)
+        ])
+        stages.append({
+            "stage": "map" if level == 0 else "reduce",
+            "level": level,
+            "inputs": sum(len(b) for b in batches),
+            "calls": len(batches),
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+        level += 1
+
+    if level == 0:
+        # Everything fits one batch: identical to the single-prompt synthesis.
+        content, single = await synthesize_single(agent, chapter, current)
+        return content, stages + single
+
+    started = time.perf_counter()
+    result = await agent.run(_final_merge_prompt(chapter, current))
+    stages.append({
+        "stage": "final",
+        "level": level,
+        "inputs": len(current),
+        "calls": 1,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    return str(result.output), stages
@@ -0,0 +1,165 @@
+"""Connection pool configuration and live pool statistics for the SQLAlchemy engine.
+
+All settings come from the environment:
+
+- DB_POOL_SIZE / DB_MAX_OVERFLOW: persistent connections and extra burst connections
+- DB_POOL_TIMEOUT: seconds a request waits for a free connection before failing
+- DB_POOL_RECYCLE: seconds after which a connection is replaced (-1 disables); keeps
+  connections younger than server/proxy idle timeouts
+- DB_POOL_PRE_PING: test each connection on checkout and transparently replace stale ones
+- DB_STATEMENT_TIMEOUT_MS: per-statement limit enforced by PostgreSQL (0 disables)
+
+The sync and async engines each get their own pool of this size, with separate metrics.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+class PoolMetrics:
+    """Process-wide counters fed by the instrumented pool and pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_seconds_total * 1000, 1),
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 1),
+            }
+
+
+# One PoolMetrics per engine, keyed by the pool's logging name ("sync" / "async")
+_metrics: dict[str, PoolMetrics] = {}
+
+
+def metrics_for(name: str) -> PoolMetrics:
+    return _metrics.setdefault(name, PoolMetrics())
+
+
+class _TimedCheckout:
+    """Records how long each checkout waited for a connection.
+
+    The wait includes opening a new connection when the pool grows into overflow.
+    """
+
+    def _do_get(self):
+        metrics = metrics_for(self.logging_name)
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        metrics.record_wait(time.perf_counter() - started)
+        return conn
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(database_url: str, name: str = "sync") -> dict:
+    """Keyword arguments for create_engine() / create_async_engine() derived from the DB_POOL_* settings.
+
+    `name` labels the pool in the metrics; "async" selects the asyncio-compatible pool.
+    """
+    url = make_url(database_url)
+    is_async = name == "async"
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE, "pool_logging_name": name}
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases live in a single connection; keep SQLAlchemy's default pool.
+            return options
+        if not is_async:
+            # Pooled SQLite connections move between request threads
+            options["connect_args"] = {"check_same_thread": False}
+    elif DB_STATEMENT_TIMEOUT_MS > 0 and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+def instrument(engine, name: str = "sync"):
+    """Hooks pool events of `engine` (the sync_engine of an async engine) into its metrics."""
+    pool_metrics = metrics_for(name)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        pool_metrics.incr("connects")
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.incr("checkouts")
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.incr("invalidations")
+
+
+def pool_stats(engine, name: str = "sync") -> dict:
+    """Live pool state plus cumulative counters for this process."""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=DB_MAX_OVERFLOW,
+            timeout_seconds=DB_POOL_TIMEOUT,
+        )
+    stats.update(pre_ping=DB_POOL_PRE_PING, recycle_seconds=DB_POOL_RECYCLE, statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS)
+    stats.update(metrics_for(name).snapshot())
+    return stats
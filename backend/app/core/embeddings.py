@@ -0,0 +1,319 @@
+"""Embeddings for the `embedding` columns of Note and MasterNote.
+
+Two providers (EMBEDDING_MODEL_PROVIDER):
+
+- "local" (default): a deterministic hashed n-gram embedder. Word unigrams,
+  word bigrams and character trigrams are hashed (crc32) into EMBEDDING_DIM
+  signed buckets, log-scaled and L2-normalized. It needs no network or model
+  download, and the same text always gives the same vector in every process,
+  so it is usable for similarity search offline and in tests.
+- "google": Gemini embeddings (EMBEDDING_MODEL) at EMBEDDING_DIM dimensions.
+
+New notes and Master Note versions are queued on `embedding_queue` when they
+are saved. A background task embeds them in batches (EMBEDDING_BATCH_SIZE, or
+whatever arrived within EMBEDDING_BATCH_WAIT_MS) and writes the vectors with
+one bulk UPDATE. Rows missed by the queue (restarts, failures) keep a NULL
+embedding and are picked up by scripts/backfill_embeddings.py.
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models import Note, MasterNote
+from .ai_agents import MODEL_PROVIDERS, get_genai_client
+from .llm_metrics import record_llm_call, outcome_of
+from .metrics import registry, Counter, Histogram
+from .vector_index import mark_dirty
+
+EMBEDDING_MODEL_PROVIDER = os.getenv("EMBEDDING_MODEL_PROVIDER", "local")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
+# 768 matches the Vector(768) the models are meant to move to with pgvector
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "200"))
+EMBEDDING_ON_WRITE = os.getenv("EMBEDDING_ON_WRITE", "1") == "1"
+# Gemini embeds at most ~2k tokens per text; the local embedder does not need more either
+EMBEDDING_MAX_CHARS = int(os.getenv("EMBEDDING_MAX_CHARS", "8000"))
+
+_MODELS = {"notes": Note, "master": MasterNote}
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+embeddings_total = registry.register(Counter(
+    "embeddings_total", "Rows embedded, by kind (notes / master) and outcome (ok / error / stale).", ("kind", "outcome"),
+))
+embedding_batch_duration_seconds = registry.register(Histogram(
+    "embedding_batch_duration_seconds", "Time to load, embed and store one batch of rows.", ("kind",),
+))
+
+
+def embedding_provider() -> str:
+    if EMBEDDING_MODEL_PROVIDER not in MODEL_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{EMBEDDING_MODEL_PROVIDER}' (choose from {', '.join(MODEL_PROVIDERS)})")
+    return EMBEDDING_MODEL_PROVIDER
+
+
+# ---- local hashed n-gram embedder ----------------------------------------------
+
+def _bucket(feature: str, dim: int) -> tuple[int, float]:
+    h = zlib.crc32(feature.encode("utf-8"))
+    # Signed hashing keeps collisions from only ever adding up
+    return h % dim, 1.0 if (h // dim) & 1 else -1.0
+
+
+@lru_cache(maxsize=65536)
+def _word_buckets(word: str, dim: int) -> tuple[tuple[int, ...], tuple[float, ...]]:
+    """Buckets and signed weights of a word and its character trigrams; words repeat, so they are cached."""
+    features = [("w:" + word, 1.0)]
+    padded = f"#{word}#"
+    features += [("c:" + padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+    indexes, weights = [], []
+    for feature, weight in features:
+        index, sign = _bucket(feature, dim)
+        indexes.append(index)
+        weights.append(sign * weight)
+    return tuple(indexes), tuple(weights)
+
+
+def hash_embed(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Deterministic unit vector for `text` (all zeros for text without words)."""
+    words = _WORD.findall(text[:EMBEDDING_MAX_CHARS].lower())
+    if not words:
+        return np.zeros(dim, dtype=np.float32)
+    indexes: list[int] = []
+    weights: list[float] = []
+    for word in words:
+        word_indexes, word_weights = _word_buckets(word, dim)
+        indexes.extend(word_indexes)
+        weights.extend(word_weights)
+    for first, second in zip(words, words[1:]):
+        index, sign = _bucket(f"b:{first} {second}", dim)
+        indexes.append(index)
+        weights.append(sign * 0.7)
+    vector = np.bincount(indexes, weights=weights, minlength=dim).astype(np.float32)
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+def hash_embed_batch(texts: list[str], dim: int = EMBEDDING_DIM) -> list[list[float]]:
+    return [hash_embed(text, dim).tolist() for text in texts]
+
+
+# ---- provider dispatch ---------------------------------------------------------
+
+async def _google_embed(texts: list[str], task_type: str) -> list[list[float]]:
+    from google.genai import types
+    client = get_genai_client()
+    if not client:
+        raise ValueError("GOOGLE_API_KEY not configured")
+    started = time.perf_counter()
+    try:
+        response = await client.aio.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=[text[:EMBEDDING_MAX_CHARS] for text in texts],
+            config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM, task_type=task_type),
+        )
+    except BaseException as e:
+        record_llm_call("embedding", EMBEDDING_MODEL, time.perf_counter() - started, outcome=outcome_of(e))
+        raise
+    record_llm_call("embedding", EMBEDDING_MODEL, time.perf_counter() - started)
+    return [list(embedding.values) for embedding in response.embeddings]
+
+
+async def embed_texts(texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+    """Embeds texts with the configured provider, in EMBEDDING_BATCH_SIZE requests.
+
+    `task_type` only matters to Gemini; the local embedder treats documents and queries alike.
+    """
+    if not texts:
+        return []
+    if embedding_provider() == "local":
+        # CPU-bound; keep it off the event loop
+        return await run_in_threadpool(hash_embed_batch, texts)
+    vectors: list[list[float]] = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(await _google_embed(texts[start:start + EMBEDDING_BATCH_SIZE], task_type))
+    return vectors
+
+
+async def embed_query(text: str) -> list[float]:
+    """Embedding of a search query, comparable with the stored note and Master Note embeddings."""
+    return (await embed_texts([text], task_type="RETRIEVAL_QUERY"))[0]
+
+
+# ---- storage -------------------------------------------------------------------
+
+def load_rows(db: Session, kind: str, ids: list[int]) -> list[tuple]:
+    """(id, content, subject_id, chapter, version) of the rows to embed; version is None for notes."""
+    model = _MODELS[kind]
+    version = MasterNote.version if kind == "master" else None
+    columns = [model.id, model.content, model.subject_id, model.chapter]
+    rows = db.execute(select(*columns, *([version] if version is not None else [])).where(model.id.in_(ids))).all()
+    return [tuple(row) + ((None,) if version is None else ()) for row in rows]
+
+
+def store_embeddings(db: Session, kind: str, rows: list[tuple], vectors: list[list[float]]) -> int:
+    """Bulk-updates the embeddings of `rows` (as returned by load_rows) in one executemany; the caller commits.
+
+    Master Notes are only updated while they still hold the version that was
+    embedded, so a slow batch never overwrites the vector of a newer version.
+    Returns the number of rows updated.
+    """
+    if not rows:
+        return 0
+    table = _MODELS[kind].__table__
+    stmt = update(table).where(table.c.id == bindparam("row_id")).values(embedding=bindparam("vector"))
+    params = [{"row_id": row[0], "vector": vector} for row, vector in zip(rows, vectors)]
+    if kind == "master":
+        stmt = stmt.where(table.c.version == bindparam("row_version"))
+        for param, row in zip(params, rows):
+            param["row_version"] = row[4]
+    result = db.execute(stmt, params)
+    # Core statements skip the ORM flush hooks, so queue the index invalidation here
+    for scope in {(row[2], row[3]) for row in rows}:
+        mark_dirty(db, kind, *scope)
+    return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(rows)
+
+
+async def embed_rows(kind: str, ids: list[int]) -> int:
+    """Loads, embeds and stores the given rows; returns how many were updated."""
+    started = time.perf_counter()
+
+    def load():
+        db = SessionLocal()
+        try:
+            return load_rows(db, kind, ids)
+        finally:
+            db.close()
+
+    def store(rows, vectors):
+        db = SessionLocal()
+        try:
+            updated = store_embeddings(db, kind, rows, vectors)
+            db.commit()
+            return updated
+        finally:
+            db.close()
+
+    rows = await run_in_threadpool(load)
+    vectors = await embed_texts([row[1] for row in rows])
+    updated = await run_in_threadpool(store, rows, vectors)
+    embeddings_total.inc((kind, "ok"), updated)
+    if len(rows) > updated:
+        embeddings_total.inc((kind, "stale"), len(rows) - updated)
+    embedding_batch_duration_seconds.observe((kind,), time.perf_counter() - started)
+    return updated
+
+
+# ---- write-time queue ----------------------------------------------------------
+
+class EmbeddingQueue:
+    """Batches rows saved anywhere in the process into embed_rows calls on one background task."""
+
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE, wait_seconds: float = EMBEDDING_BATCH_WAIT_MS / 1000):
+        self.batch_size = batch_size
+        self.wait_seconds = wait_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._counters = {"queued": 0, "embedded": 0, "failed": 0, "batches": 0}
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._worker())
+
+    async def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # Rows still queued keep a NULL embedding; the backfill picks them up
+        self._task = self._queue = self._loop = None
+
+    def _put(self, kind: str, ids: list[int]):
+        for row_id in ids:
+            self._queue.put_nowait((kind, row_id))
+        with self._lock:
+            self._counters["queued"] += len(ids)
+
+    def submit(self, kind: str, ids: list[int]):
+        """Queues rows for embedding once their transaction has committed. Safe from any thread."""
+        if not EMBEDDING_ON_WRITE or not ids:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Worker threads (background jobs) hand the rows to the app loop
+            loop = self._loop
+            if loop is not None and loop.is_running():
+                loop.call_soon_threadsafe(self._put, kind, list(ids))
+            return
+        self._ensure_started()
+        self._put(kind, ids)
+
+    async def _next_batch(self) -> list[tuple[str, int]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.wait_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            by_kind: dict[str, list[int]] = {}
+            for kind, row_id in batch:
+                ids = by_kind.setdefault(kind, [])
+                if row_id not in ids:
+                    ids.append(row_id)
+            for kind, ids in by_kind.items():
+                try:
+                    updated = await embed_rows(kind, ids)
+                    with self._lock:
+                        self._counters["embedded"] += updated
+                        self._counters["batches"] += 1
+                except Exception as e:
+                    print(f"[embeddings] batch of {len(ids)} {kind} failed: {e}")
+                    embeddings_total.inc((kind, "error"), len(ids))
+                    with self._lock:
+                        self._counters["failed"] += len(ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "provider": EMBEDDING_MODEL_PROVIDER,
+            "model": EMBEDDING_MODEL if EMBEDDING_MODEL_PROVIDER == "google" else "hashed-ngrams",
+            "dim": EMBEDDING_DIM,
+            "batch_size": self.batch_size,
+            "on_write": EMBEDDING_ON_WRITE,
+        }
+
+
+embedding_queue = EmbeddingQueue()
@@ -0,0 +1,48 @@
+"""Worker pools for CPU-bound work (PDF rendering, image normalization, PDF ingestion).
+
+Process pools are started with EXECUTOR_START_METHOD ("forkserver" by default,
+or "spawn"), never by forking the server itself: by the time the first pool is
+created uvicorn is running threads (the request threadpool, the logging
+listener, the ingestion job pool), and a forked child can inherit one of their
+locks held and deadlock on it.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+EXECUTOR_START_METHOD = os.getenv("EXECUTOR_START_METHOD", "forkserver")
+EXECUTOR_KINDS = ("process", "thread")
+
+
+def make_executor(kind: str, workers: int, name: str) -> Executor:
+    """A pool of `workers` threads or processes; `name` prefixes the thread names."""
+    if kind not in EXECUTOR_KINDS:
+        raise ValueError(f"Unknown executor '{kind}' for {name} (choose from {', '.join(EXECUTOR_KINDS)})")
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(EXECUTOR_START_METHOD))
+
+
+class LazyExecutor:
+    """An executor created on first use (so importing a module starts no workers) and shut down with the app."""
+
+    def __init__(self, kind: str, workers: int, name: str):
+        self.kind = kind
+        self.workers = workers
+        self.name = name
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = make_executor(self.kind, self.workers, self.name)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
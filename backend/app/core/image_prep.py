@@ -0,0 +1,239 @@
+"""Normalizes uploaded images before OCR.
+
+Phone photos arrive as multi-megabyte PNG/HEIC/JPEG files with EXIF rotation
+and metadata. Before an image is sent to the model it is decoded, rotated
+upright, stripped of metadata, downscaled so its long side is at most
+OCR_IMAGE_MAX_SIDE pixels and re-encoded as OCR_IMAGE_FORMAT. Decoding and
+encoding are CPU-bound, so they run in a worker pool
+(IMAGE_PREP_EXECUTOR = "process" or "thread"). The detected format also gives
+the real MIME type of the payload.
+
+Saved bytes are counted in /metrics (ocr_image_bytes_total) and /ai/image-prep.
+"""
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from .executors import LazyExecutor
+from .metrics import registry, Counter, Histogram
+
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "1") == "1"
+IMAGE_PREP_EXECUTOR = os.getenv("IMAGE_PREP_EXECUTOR", "process")
+IMAGE_PREP_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", "2"))
+# ~2k pixels on the long side keeps handwriting legible; Gemini tiles larger images anyway
+OCR_IMAGE_MAX_SIDE = int(os.getenv("OCR_IMAGE_MAX_SIDE", "2048"))
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "jpeg").lower()
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))
+# Refuse decompression bombs before decoding them
+IMAGE_PREP_MAX_PIXELS = int(os.getenv("IMAGE_PREP_MAX_PIXELS", str(80_000_000)))
+
+# Formats the model accepts as-is, by Pillow format name
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "HEIF": "image/heif",
+    "HEIC": "image/heic",
+}
+_ENCODERS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp"), "png": ("PNG", "image/png")}
+
+logger = logging.getLogger("hivemind.image_prep")
+
+image_prep_bytes_total = registry.register(Counter(
+    "ocr_image_bytes_total", "Image bytes received for OCR and sent to the model after normalization.", ("stage",),
+))
+image_prep_duration_seconds = registry.register(Histogram(
+    "ocr_image_prep_duration_seconds", "Time to normalize an image before OCR, including the wait for a worker.",
+))
+
+
+class UnsupportedImage(ValueError):
+    """The upload is not an image the pipeline can read."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    source_format: str
+    original_bytes: int
+    width: int
+    height: int
+    reencoded: bool
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    """MIME type from the file signature, for payloads Pillow cannot decode here (HEIC without pillow-heif)."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+
+def _open_image(data: bytes):
+    from PIL import Image
+    try:
+        # HEIC/HEIF support is optional
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+    Image.MAX_IMAGE_PIXELS = IMAGE_PREP_MAX_PIXELS
+    return Image.open(io.BytesIO(data))
+
+
+def normalize_image(data: bytes, max_side: int = OCR_IMAGE_MAX_SIDE, fmt: str = OCR_IMAGE_FORMAT,
+                    quality: int = OCR_IMAGE_QUALITY) -> PreparedImage:
+    """Decodes, orients, strips, downscales and re-encodes one image.
+
+    Module-level and plain-argument so it can run in a worker process.
+    """
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        mime = sniff_mime_type(data)
+        if mime is None:
+            raise UnsupportedImage("unrecognized image format")
+        return PreparedImage(data, mime, mime.split("/")[1].upper(), len(data), 0, 0, False)
+
+    try:
+        image = _open_image(data)
+        source_format = image.format or "UNKNOWN"
+        if source_format == "JPEG":
+            # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding (never below max_side)
+            image.draft("RGB" if image.mode == "CMYK" else image.mode, (max_side, max_side))
+        exif = image.getexif()
+        has_metadata = bool(exif) or bool(image.info.get("icc_profile"))
+        rotated = exif.get(0x0112, 1) not in (0, 1)  # Orientation tag
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        mime = sniff_mime_type(data)
+        if isinstance(e, Image.DecompressionBombError):
+            raise UnsupportedImage(f"image exceeds {IMAGE_PREP_MAX_PIXELS} pixels")
+        if mime is None:
+            raise UnsupportedImage("unrecognized image format")
+        # Readable by the model but not by this Pillow build (e.g. HEIC): send it untouched
+        return PreparedImage(data, mime, mime.split("/")[1].upper(), len(data), 0, 0, False)
+    except (OSError, SyntaxError) as e:
+        # Pillow reports corrupt headers and truncated data this way
+        raise UnsupportedImage(f"image is truncated or corrupt: {e}")
+
+    # Pixels are only decoded here, so a truncated upload fails in these steps rather than on open
+    try:
+        resized = max(image.size) > max_side
+        if resized:
+            # Bicubic is as legible as Lanczos for text at ~25% less CPU; the reducing gap box-filters big reductions first
+            image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+        pil_format, mime = _ENCODERS.get(fmt, _ENCODERS["jpeg"])
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            # JPEG has no alpha: flatten onto white, the colour of the paper
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+
+        out = io.BytesIO()
+        # Only pixels are written: no EXIF, ICC profile or text chunks
+        save_options = {"optimize": True}
+        if pil_format in ("JPEG", "WEBP"):
+            save_options["quality"] = quality
+        image.save(out, pil_format, **save_options)
+        encoded = out.getvalue()
+    except (OSError, SyntaxError) as e:
+        raise UnsupportedImage(f"image is truncated or corrupt: {e}")
+
+    width, height = image.size
+    if len(encoded) >= len(data) and not (resized or rotated or has_metadata) and source_format in MIME_TYPES:
+        # Already small and clean; re-encoding would only cost quality
+        return PreparedImage(data, MIME_TYPES[source_format], source_format, len(data), width, height, False)
+    return PreparedImage(encoded, mime, source_format, len(data), width, height, True)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def normalize_image_file(path: str) -> PreparedImage:
+    """normalize_image for a spooled upload: the file is read in the worker, not in the API process."""
+    return normalize_image(_read_file(path))
+
+
+class ImagePreparer:
+    def __init__(self):
+        self._executor = LazyExecutor(IMAGE_PREP_EXECUTOR, IMAGE_PREP_WORKERS, "image-prep")
+        self._lock = threading.Lock()
+        self._counters = {"images": 0, "reencoded": 0, "passthrough": 0, "rejected": 0,
+                          "original_bytes": 0, "sent_bytes": 0, "seconds": 0.0}
+
+    async def prepare(self, source: Union[bytes, str]) -> PreparedImage:
+        """Normalizes image bytes, or the image file at a path, in the worker pool.
+
+        When disabled the original bytes are returned untouched.
+        """
+        loop = asyncio.get_running_loop()
+        if not IMAGE_PREP_ENABLED:
+            data = source if isinstance(source, bytes) else await loop.run_in_executor(None, _read_file, source)
+            return PreparedImage(data, sniff_mime_type(data) or "image/jpeg", "UNKNOWN", len(data), 0, 0, False)
+
+        started = time.perf_counter()
+        normalize = normalize_image if isinstance(source, bytes) else normalize_image_file
+        try:
+            prepared = await loop.run_in_executor(self._executor.get(), normalize, source)
+        except UnsupportedImage:
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise
+        elapsed = time.perf_counter() - started
+
+        image_prep_duration_seconds.observe((), elapsed)
+        image_prep_bytes_total.inc(("original",), prepared.original_bytes)
+        image_prep_bytes_total.inc(("sent",), len(prepared.data))
+        with self._lock:
+            self._counters["images"] += 1
+            self._counters["reencoded" if prepared.reencoded else "passthrough"] += 1
+            self._counters["original_bytes"] += prepared.original_bytes
+            self._counters["sent_bytes"] += len(prepared.data)
+            self._counters["seconds"] += elapsed
+        logger.debug("%s %dB -> %s %dx%d %dB (saved %dB) in %.1fms", prepared.source_format.lower(), prepared.original_bytes,
+                     prepared.mime_type, prepared.width, prepared.height, len(prepared.data), prepared.bytes_saved, elapsed * 1000)
+        return prepared
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        original = counters["original_bytes"]
+        return {
+            **counters,
+            "seconds": round(counters["seconds"], 3),
+            "bytes_saved": original - counters["sent_bytes"],
+            "saved_ratio": round(1 - counters["sent_bytes"] / original, 4) if original else None,
+            "enabled": IMAGE_PREP_ENABLED,
+            "executor": IMAGE_PREP_EXECUTOR,
+            "max_side": OCR_IMAGE_MAX_SIDE,
+            "format": OCR_IMAGE_FORMAT,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+image_preparer = ImagePreparer()
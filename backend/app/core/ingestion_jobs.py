@@ -0,0 +1,225 @@
+"""In-process worker pool for background uploads, backed by the `ingestion_jobs` table.
+
+The table is the source of truth: the in-memory queue only carries job ids, and
+a periodic sweep re-enqueues jobs that are still `queued` (e.g. after a restart)
+or whose `running` lease went stale because the worker that held it died.
+Jobs are claimed with a conditional UPDATE so several uvicorn processes can
+sweep the same table without running a job twice. The worker renews the lease
+as pages are OCR'd, so a long PDF is not re-claimed while it is still being
+read, and a job claimed more than INGESTION_JOB_MAX_ATTEMPTS times (one that
+keeps taking its worker down) is marked `failed` instead of retried again.
+"""
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import update, or_, and_
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models import IngestionJob
+from .ingestion_pipeline import extract_note_content, save_note
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "4"))
+INGESTION_JOB_SWEEP_SECONDS = float(os.getenv("INGESTION_JOB_SWEEP_SECONDS", "30"))
+INGESTION_JOB_STALE_SECONDS = float(os.getenv("INGESTION_JOB_STALE_SECONDS", "600"))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv("INGESTION_JOB_MAX_ATTEMPTS", "3"))
+# Page progress renews the lease at most this often
+INGESTION_JOB_RENEW_SECONDS = INGESTION_JOB_STALE_SECONDS / 10
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def create_job(db, user_id: int, subject_id: int, chapter: int, teacher: str, filename: str, payload: bytes) -> IngestionJob:
+    job = IngestionJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        subject_id=subject_id,
+        chapter=chapter,
+        teacher=teacher,
+        filename=filename,
+        status="queued",
+        payload=payload,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _claim(job_id: str) -> Optional[dict]:
+    """Atomically moves a job to `running`; returns its inputs, or None if someone else has it."""
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=INGESTION_JOB_STALE_SECONDS)
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.id == job_id,
+                or_(
+                    IngestionJob.status == "queued",
+                    and_(IngestionJob.status == "running", IngestionJob.updated_at < stale_before),
+                ),
+            )
+            .values(status="running", stage="ocr", attempts=IngestionJob.attempts + 1, updated_at=datetime.now(timezone.utc))
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return None
+        job = db.get(IngestionJob, job_id)
+        if (job.attempts or 0) > INGESTION_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.stage = None
+            job.error = f"Gave up after {INGESTION_JOB_MAX_ATTEMPTS} attempts"
+            job.payload = None
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            print(f"[ingestion-jobs] job {job_id} failed: {job.error}")
+            return None
+        return {
+            "user_id": job.user_id,
+            "subject_id": job.subject_id,
+            "chapter": job.chapter,
+            "teacher": job.teacher,
+            "filename": job.filename,
+            "payload": job.payload,
+        }
+    finally:
+        db.close()
+
+
+def _update(job_id: str, **values):
+    db = SessionLocal()
+    try:
+        db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(updated_at=datetime.now(timezone.utc), **values))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _renew(job_id: str):
+    """Pushes the `running` lease forward so the sweep does not re-claim a job that is still progressing."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job_id, IngestionJob.status == "running")
+            .values(updated_at=datetime.now(timezone.utc))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _save(job_id: str, job: dict, content: str) -> int:
+    db = SessionLocal()
+    try:
+        note = save_note(db, job["user_id"], job["subject_id"], job["chapter"], job["teacher"], content)
+        return note.id
+    finally:
+        db.close()
+
+
+def _runnable_job_ids() -> list[str]:
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=INGESTION_JOB_STALE_SECONDS)
+    db = SessionLocal()
+    try:
+        rows = db.query(IngestionJob.id).filter(
+            or_(
+                IngestionJob.status == "queued",
+                and_(IngestionJob.status == "running", IngestionJob.updated_at < stale_before),
+            )
+        ).order_by(IngestionJob.created_at).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+class IngestionJobPool:
+    def __init__(self, workers: int = INGESTION_WORKERS):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: set[str] = set()
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+        # Jobs interrupted here stay `running` and are re-claimed once their lease goes stale.
+
+    def submit(self, job_id: str):
+        self._ensure_started()
+        if job_id not in self._pending:
+            self._pending.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _sweep(self):
+        while True:
+            try:
+                for job_id in await run_in_threadpool(_runnable_job_ids):
+                    self.submit(job_id)
+            except Exception as e:
+                print(f"[ingestion-jobs] sweep failed: {e}")
+            await asyncio.sleep(INGESTION_JOB_SWEEP_SECONDS)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"[ingestion-jobs] job {job_id} crashed: {e}")
+            finally:
+                self._pending.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await run_in_threadpool(_claim, job_id)
+        if job is None:
+            return
+        renewed = time.monotonic()
+
+        async def on_page():
+            nonlocal renewed
+            if time.monotonic() - renewed >= INGESTION_JOB_RENEW_SECONDS:
+                renewed = time.monotonic()
+                await run_in_threadpool(_renew, job_id)
+
+        try:
+            content = await extract_note_content(job["payload"], job["filename"], on_page)
+            await run_in_threadpool(_update, job_id, stage="saving")
+            note_id = await run_in_threadpool(_save, job_id, job, content)
+        except Exception as e:
+            print(f"[ingestion-jobs] job {job_id} failed: {e}")
+            await run_in_threadpool(
+                _update, job_id, status="failed", stage=None, error=str(e) or type(e).__name__,
+                payload=None, finished_at=datetime.now(timezone.utc),
+            )
+            return
+        await run_in_threadpool(
+            _update, job_id, status="succeeded", stage=None, note_id=note_id,
+            payload=None, finished_at=datetime.now(timezone.utc),
+        )
+
+
+job_pool = IngestionJobPool()
@@ -0,0 +1,132 @@
+"""Upload-to-Note pipeline shared by the synchronous upload endpoint and the job workers."""
+import os
+from typing import Awaitable, Callable, Optional, Union
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .ai_agents import extract_text_from_image, provider_available, provider_for
+from .embeddings import embedding_queue
+from .image_prep import image_preparer
+from .pdf_ingest import is_pdf, extract_pdf_content, PartialText, PAGE_SEPARATOR
+from .caching import SingleFlight
+from .ocr_cache import ocr_cache, image_digest, cache_key, OCR_CACHE_ENABLED
+from .uploads import SpooledUpload
+from ..models import Note
+
+# Identical images being OCR'd right now, so concurrent duplicates share one call
+_inflight: SingleFlight[str, str] = SingleFlight()
+
+
+class IngestionUnavailable(Exception):
+    """Raised when neither the AI agent nor mock ingestion is available."""
+
+
+def mock_ingestion_enabled() -> bool:
+    # Allow a mock ingestion mode controlled by env var MOCK_INGESTION=1 (useful for local testing)
+    return os.getenv('MOCK_INGESTION', '0') == '1'
+
+
+def ingestion_available() -> bool:
+    if mock_ingestion_enabled():
+        return True
+    # Uploads only go through OCR, so availability follows the OCR provider
+    try:
+        return provider_available(provider_for("ocr"))
+    except ValueError as e:
+        print(f"[ingestion] {e}")
+        return False
+
+
+async def extract_note_content(content: Union[bytes, SpooledUpload], filename: str,
+                               on_page: Optional[Callable[[], Awaitable[None]]] = None) -> str:
+    """Turns an uploaded image or PDF (bytes, or a streamed upload) into the Markdown stored on the Note.
+
+    `on_page()` is awaited after each OCR'd page of a PDF, for progress and job leases.
+    """
+    if mock_ingestion_enabled():
+        # Simple deterministic mock: return filename and placeholder markdown
+        return f"# Mocked Ingestion for {filename}\n\nThis is a mock conversion of the uploaded file. Replace with Gemini output when available.\n\n- Uploaded filename: {filename}\n- Suggested summary: This note covers the key points from the lecture."
+    if not ingestion_available():
+        raise IngestionUnavailable("Ingestion agent not configured. Set GOOGLE_API_KEY, use MODEL_PROVIDER=local or enable MOCK_INGESTION for local testing.")
+
+    streamed = isinstance(content, SpooledUpload)
+    # Streamed uploads were hashed while they arrived
+    digest = content.sha256 if streamed else image_digest(content)
+    head = (await run_in_threadpool(content.head, 8)) if streamed else content[:8]
+    if is_pdf(head):
+        source = content.source() if streamed else content
+        return await _cached_ocr(digest, lambda: extract_pdf_content(source, ocr_page_image, filename, on_page))
+    # Keyed by the original bytes, so a repeat upload skips normalization too
+    return await _cached_ocr(digest, lambda: _ocr(content))
+
+
+async def ocr_page_image(data: bytes, mime_type: str) -> str:
+    """OCR of an image that is already sized for the model (rendered PDF pages)."""
+    return await _cached_ocr(image_digest(data), lambda: extract_text_from_image(data, mime_type))
+
+
+async def _ocr(content: Union[bytes, SpooledUpload]) -> str:
+    # Normalized copy (upright, no metadata, downscaled) with its real MIME type;
+    # spooled uploads are read from disk by the worker
+    prepared = await image_preparer.prepare(content.source() if isinstance(content, SpooledUpload) else content)
+    return await extract_text_from_image(prepared.data, prepared.mime_type)
+
+
+async def _cached_ocr(digest: str, run: Callable[[], Awaitable[str]]) -> str:
+    """Result of `run()` through the OCR cache; concurrent requests for the same digest share one run.
+
+    PartialText results (documents with unreadable pages) are returned but not stored.
+    """
+    if not OCR_CACHE_ENABLED:
+        return await run()
+    key = cache_key(digest)
+    text = ocr_cache.get_memory(key)
+    if text is not None:
+        return text
+
+    async def load_or_run() -> str:
+        text = await run_in_threadpool(ocr_cache.get, key)
+        if text is None:
+            text = await run()
+            if not isinstance(text, PartialText):
+                await run_in_threadpool(ocr_cache.put, key, digest, text)
+        return text
+
+    return await _inflight.run(key, load_or_run)
+
+
+def save_note(db: Session, user_id: int, subject_id: int, chapter: int, teacher: str, content: str) -> Note:
+    new_note = Note(
+        content=content,
+        user_id=user_id,
+        subject_id=subject_id,
+        chapter=chapter,
+        teacher=teacher
+    )
+    db.add(new_note)
+    db.commit()
+    db.refresh(new_note)
+    embedding_queue.submit("notes", [new_note.id])
+
+    # Trigger consensus check (placeholder for now)
+    # check_consensus(subject_id, chapter, db)
+
+    return new_note
+
+
+def save_notes(db: Session, user_id: int, subject_id: int, chapter: int, teacher: str, contents: list[str]) -> list[int]:
+    """Inserts several notes in one transaction (one multi-row INSERT) and returns their ids in order."""
+    notes = [
+        Note(content=content, user_id=user_id, subject_id=subject_id, chapter=chapter, teacher=teacher)
+        for content in contents
+    ]
+    db.add_all(notes)
+    db.flush()
+    ids = [note.id for note in notes]
+    db.commit()
+    embedding_queue.submit("notes", ids)
+
+    # Trigger consensus check (placeholder for now)
+    # check_consensus(subject_id, chapter, db)
+
+    return ids
@@ -0,0 +1,129 @@
+"""Latency, token usage, retries and failures of every model call, per agent and model.
+
+pydantic-ai agents get their model wrapped in `InstrumentedModel`; direct
+google-genai calls (OCR) report through `record_llm_call`. Totals go to the
+/metrics registry, and calls made while serving an HTTP request are also summed
+into that request's `LlmUsage` (sent back as the X-LLM-Usage header).
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from pydantic_ai.messages import ModelRequest, RetryPromptPart
+from pydantic_ai.models.wrapper import WrapperModel
+
+from .metrics import registry, Counter, Histogram
+
+llm_requests_total = registry.register(Counter(
+    "llm_requests_total", "Model calls by agent, model and outcome (ok / error / cancelled).", ("agent", "model", "outcome"),
+))
+llm_request_duration_seconds = registry.register(Histogram(
+    "llm_request_duration_seconds", "Wall time of model calls, including streaming until the last chunk.", ("agent", "model"),
+))
+llm_tokens_total = registry.register(Counter(
+    "llm_tokens_total", "Tokens reported by the provider, by direction (input / output).", ("agent", "model", "direction"),
+))
+llm_retries_total = registry.register(Counter(
+    "llm_retries_total", "Model calls that re-asked the model after a rejected answer.", ("agent", "model"),
+))
+
+
+@dataclass
+class LlmUsage:
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    seconds: float = 0.0
+
+    def header_value(self) -> str:
+        return (f"calls={self.calls}; failures={self.failures}; retries={self.retries}; "
+                f"input_tokens={self.input_tokens}; output_tokens={self.output_tokens}; ms={round(self.seconds * 1000, 1)}")
+
+    def as_dict(self) -> dict:
+        return {"calls": self.calls, "failures": self.failures, "retries": self.retries,
+                "input_tokens": self.input_tokens, "output_tokens": self.output_tokens, "ms": round(self.seconds * 1000, 1)}
+
+
+# Usage of the HTTP request being served; tasks spawned by the handler share the same object
+request_usage_var: ContextVar[Optional[LlmUsage]] = ContextVar("llm_request_usage", default=None)
+
+
+def outcome_of(exc: Optional[BaseException]) -> str:
+    if exc is None:
+        return "ok"
+    # Client disconnects and shutdowns abandon the call; they are not model failures
+    return "cancelled" if isinstance(exc, (asyncio.CancelledError, GeneratorExit)) else "error"
+
+
+def record_llm_call(agent: str, model: str, seconds: float, input_tokens: int = 0, output_tokens: int = 0,
+                    outcome: str = "ok", retry: bool = False):
+    llm_requests_total.inc((agent, model, outcome))
+    llm_request_duration_seconds.observe((agent, model), seconds)
+    if input_tokens:
+        llm_tokens_total.inc((agent, model, "input"), input_tokens)
+    if output_tokens:
+        llm_tokens_total.inc((agent, model, "output"), output_tokens)
+    if retry:
+        llm_retries_total.inc((agent, model))
+
+    usage = request_usage_var.get()
+    if usage is not None:
+        usage.calls += 1
+        usage.failures += 1 if outcome == "error" else 0
+        usage.retries += 1 if retry else 0
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+        usage.seconds += seconds
+
+
+def _is_retry(messages) -> bool:
+    """pydantic-ai re-asks the model with a RetryPromptPart when a tool call or output was rejected."""
+    last = messages[-1] if messages else None
+    return isinstance(last, ModelRequest) and any(isinstance(p, RetryPromptPart) for p in last.parts)
+
+
+class InstrumentedModel(WrapperModel):
+    """Model wrapper that records every request (plain and streamed) under an agent label."""
+
+    def __init__(self, wrapped, agent: str):
+        super().__init__(wrapped)
+        self.agent = agent
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        started = time.perf_counter()
+        retry = _is_retry(messages)
+        try:
+            response = await super().request(messages, model_settings, model_request_parameters)
+        except BaseException as e:
+            record_llm_call(self.agent, self.model_name, time.perf_counter() - started, outcome=outcome_of(e), retry=retry)
+            raise
+        record_llm_call(self.agent, self.model_name, time.perf_counter() - started,
+                        response.usage.input_tokens, response.usage.output_tokens, retry=retry)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters, run_context=None):
+        started = time.perf_counter()
+        retry = _is_retry(messages)
+        stream = None
+        error = None
+        try:
+            async with super().request_stream(messages, model_settings, model_request_parameters, run_context) as stream:
+                yield stream
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            usage = stream.usage if stream is not None else None
+            record_llm_call(self.agent, self.model_name, time.perf_counter() - started,
+                            getattr(usage, "input_tokens", 0) or 0, getattr(usage, "output_tokens", 0) or 0,
+                            outcome=outcome_of(error), retry=retry)
+
+
+def instrument_model(model, agent: str) -> InstrumentedModel:
+    return InstrumentedModel(model, agent)
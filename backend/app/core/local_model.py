@@ -0,0 +1,109 @@
+"""Deterministic local stand-in for the Gemini models (MODEL_PROVIDER=local).
+
+Answers are derived from the prompt alone (same prompt, same answer) and shaped
+like the real ones: Markdown for notes and tutor chat, the expected JSON object
+for quiz questions. Timing is simulated: LOCAL_MODEL_LATENCY_MS (LOCAL_OCR_LATENCY_MS
+for images) before the first token, then LOCAL_MODEL_TOKENS_PER_SECOND for the
+rest (0 disables the throughput delay), so latency-sensitive
+paths (map-reduce fan-out, streaming, concurrency limits) behave realistically
+without a network.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+from pydantic_ai.usage import RequestUsage
+
+LOCAL_MODEL_LATENCY_MS = float(os.getenv("LOCAL_MODEL_LATENCY_MS", "200"))
+LOCAL_MODEL_TOKENS_PER_SECOND = float(os.getenv("LOCAL_MODEL_TOKENS_PER_SECOND", "400"))
+LOCAL_MODEL_OUTPUT_TOKENS = int(os.getenv("LOCAL_MODEL_OUTPUT_TOKENS", "300"))
+# Streaming granularity: tokens per emitted chunk
+LOCAL_MODEL_CHUNK_TOKENS = int(os.getenv("LOCAL_MODEL_CHUNK_TOKENS", "8"))
+# Image transcription is slower to first token than text prompts
+LOCAL_OCR_LATENCY_MS = float(os.getenv("LOCAL_OCR_LATENCY_MS", "300"))
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]{2,}")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _prompt_text(messages) -> str:
+    return "\n".join(
+        str(part.content) for message in messages for part in getattr(message, "parts", [])
+        if isinstance(getattr(part, "content", None), str)
+    )
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _answer(prompt: str, output_tokens: int) -> str:
+    seed = _seed(prompt)
+    words = _WORD.findall(prompt) or ["note"]
+    if "multiple-choice question" in prompt and "JSON" in prompt:
+        picks = [words[(seed >> (8 * i)) % len(words)] for i in range(5)]
+        return json.dumps({
+            "question": f"Which term best completes the idea of '{picks[0]}'?",
+            "options": {"A": picks[1], "B": picks[2], "C": picks[3], "D": picks[4]},
+            "answer": "ABCD"[seed % 4],
+            "explanation": f"The Master Note connects {picks[0]} with this term.",
+        })
+
+    # Markdown built from the prompt's own vocabulary, roughly output_tokens long
+    lines = [f"## Local model answer {seed % 10_000:04d}", ""]
+    step = (seed % 7) + 3
+    budget, i = output_tokens, seed % len(words)
+    while budget > 0:
+        sentence = " ".join(words[(i + k * step) % len(words)] for k in range(10))
+        lines.append(f"- **{sentence.split()[0]}**: {sentence}.")
+        budget -= estimate_tokens(sentence) + 2
+        i += 11
+    return "\n".join(lines)
+
+
+def _throughput_delay(tokens: int) -> float:
+    return tokens / LOCAL_MODEL_TOKENS_PER_SECOND if LOCAL_MODEL_TOKENS_PER_SECOND > 0 else 0.0
+
+
+def make_local_model(name: str) -> FunctionModel:
+    """A FunctionModel answering deterministically with simulated latency and throughput."""
+
+    async def respond(messages, info) -> ModelResponse:
+        prompt = _prompt_text(messages)
+        text = _answer(prompt, LOCAL_MODEL_OUTPUT_TOKENS)
+        output_tokens = estimate_tokens(text)
+        await asyncio.sleep(LOCAL_MODEL_LATENCY_MS / 1000 + _throughput_delay(output_tokens))
+        return ModelResponse(
+            parts=[TextPart(text)],
+            usage=RequestUsage(input_tokens=estimate_tokens(prompt), output_tokens=output_tokens),
+            model_name=f"local-{name}",
+        )
+
+    async def stream(messages, info):
+        text = _answer(_prompt_text(messages), LOCAL_MODEL_OUTPUT_TOKENS)
+        await asyncio.sleep(LOCAL_MODEL_LATENCY_MS / 1000)
+        chunk_chars = max(1, LOCAL_MODEL_CHUNK_TOKENS) * 4
+        for start in range(0, len(text), chunk_chars):
+            chunk = text[start:start + chunk_chars]
+            await asyncio.sleep(_throughput_delay(estimate_tokens(chunk)))
+            yield chunk
+
+    return FunctionModel(respond, stream_function=stream, model_name=f"local-{name}")
+
+
+async def local_ocr(image_bytes: bytes) -> tuple[str, int, int]:
+    """OCR stand-in: returns (text, input_tokens, output_tokens) for the image."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    text = _answer(f"page {digest} handwritten lecture notes transcription", LOCAL_MODEL_OUTPUT_TOKENS)
+    text = f"# Page {digest[:8]}\n\n{text}"
+    output_tokens = estimate_tokens(text)
+    await asyncio.sleep(LOCAL_OCR_LATENCY_MS / 1000 + _throughput_delay(output_tokens))
+    # Gemini bills a flat 258 tokens per image
+    return text, 258, output_tokens
@@ -0,0 +1,99 @@
+"""MasterNote persistence helpers: atomic upsert and source manifests per version."""
+import hashlib
+
+from sqlalchemy import func, null, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from ..models import MasterNote, MasterNoteSource
+from .vector_index import mark_dirty
+
+# Dialects whose INSERT supports ON CONFLICT ... DO UPDATE ... RETURNING
+_UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+class MasterNoteIndexMissing(RuntimeError):
+    """The database predates migration 0001: the unique key the upsert relies on is missing."""
+
+
+def _dialect_insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def upsert_master_note(db: Session, user_id: int, subject_id: int, chapter: int, topic: str, content: str) -> tuple[int, int]:
+    """Creates the (user, subject, chapter) MasterNote at version 1 or replaces its content
+    and bumps the version, in one statement. Returns (id, version); the caller commits.
+
+    The version is incremented by the database, so concurrent saves never lose a bump
+    or create a duplicate row. Relies on the unique index uq_master_notes_user_subject_chapter
+    (see migration 0001). A replaced version's embedding is reset to NULL until the
+    new content has been embedded.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in _UPSERT_DIALECTS:
+        insert = _dialect_insert(dialect)
+        stmt = insert(MasterNote).values(
+            user_id=user_id, subject_id=subject_id, chapter=chapter, topic=topic, content=content, version=1,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MasterNote.user_id, MasterNote.subject_id, MasterNote.chapter],
+            set_={"content": stmt.excluded.content, "version": func.coalesce(MasterNote.version, 0) + 1, "embedding": null()},
+        ).returning(MasterNote.id, MasterNote.version)
+        try:
+            master_id, version = db.execute(stmt).one()
+        except DBAPIError as e:
+            # PostgreSQL: "no unique or exclusion constraint matching the ON CONFLICT specification";
+            # SQLite: "ON CONFLICT clause does not match any PRIMARY KEY or UNIQUE constraint"
+            if "ON CONFLICT" not in str(e.orig):
+                raise
+            raise MasterNoteIndexMissing(
+                "master_notes has no unique index on (user_id, subject_id, chapter); "
+                "run `alembic upgrade head` from the backend directory"
+            ) from e
+    else:
+        # No portable upsert: row-lock the existing note, otherwise insert
+        row = db.execute(
+            select(MasterNote.id).where(
+                MasterNote.user_id == user_id, MasterNote.subject_id == subject_id, MasterNote.chapter == chapter,
+            ).with_for_update()
+        ).first()
+        if row:
+            master_id, version = db.execute(
+                update(MasterNote).where(MasterNote.id == row.id)
+                .values(content=content, version=func.coalesce(MasterNote.version, 0) + 1, embedding=null())
+                .returning(MasterNote.id, MasterNote.version)
+            ).one()
+        else:
+            master = MasterNote(user_id=user_id, subject_id=subject_id, chapter=chapter, topic=topic, content=content, version=1)
+            db.add(master)
+            db.flush()
+            master_id, version = master.id, master.version
+
+    # Core statements skip the ORM flush hooks, so queue the index invalidation here
+    mark_dirty(db, "master", subject_id, chapter)
+    return master_id, version
+
+
+def load_manifest(db: Session, master_note_id: int, version: int) -> dict[int, str]:
+    """Returns {note_id: content_sha256} for the notes that built this MasterNote version."""
+    rows = db.query(MasterNoteSource.note_id, MasterNoteSource.content_sha256).filter(
+        MasterNoteSource.master_note_id == master_note_id,
+        MasterNoteSource.version == version,
+    ).all()
+    return {note_id: sha for note_id, sha in rows}
+
+
+def record_manifest(db: Session, master_note_id: int, version: int, manifest: dict[int, str]):
+    """Adds the manifest rows for a version to the session; the caller commits."""
+    db.add_all([
+        MasterNoteSource(master_note_id=master_note_id, version=version, note_id=note_id, content_sha256=sha)
+        for note_id, sha in manifest.items()
+    ])
@@ -0,0 +1,160 @@
+"""Content-addressed cache of OCR results.
+
+Entries are keyed by the SHA-256 of the image bytes together with the OCR model
+(including its provider) and prompt version, so re-uploads of the same photo
+skip the Gemini call. A small in-process LRU sits in front of the `ocr_cache`
+table. Once the table passes OCR_CACHE_MAX_BYTES of text it is trimmed to
+OCR_CACHE_EVICT_TO of the limit by evicting least recently used rows. Stores
+keep a running estimate of the table size and only sum the table when the
+estimate passes the limit, or every OCR_CACHE_RESYNC_STORES stores (other
+workers write to the same table).
+"""
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import func, update
+
+from ..database import SessionLocal
+from ..models import OcrCacheEntry
+from .caching import LRUCache
+from .ai_agents import OCR_PROMPT_VERSION, ocr_model_label
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+OCR_CACHE_MEMORY_ENTRIES = int(os.getenv("OCR_CACHE_MEMORY_ENTRIES", "256"))
+OCR_CACHE_RESYNC_STORES = int(os.getenv("OCR_CACHE_RESYNC_STORES", "100"))
+# Eviction trims the table to this fraction of the limit, so it does not run again on the next store
+OCR_CACHE_EVICT_TO = float(os.getenv("OCR_CACHE_EVICT_TO", "0.9"))
+
+logger = logging.getLogger("hivemind.ocr_cache")
+
+
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(image_sha256: str, model_id: Optional[str] = None, prompt_version: str = OCR_PROMPT_VERSION) -> str:
+    # The label of the model that runs OCR now, so local stand-in text never answers for Gemini
+    model_id = model_id or ocr_model_label()
+    return hashlib.sha256(f"{image_sha256}:{model_id}:{prompt_version}".encode()).hexdigest()
+
+
+class OcrCache:
+    def __init__(self, max_bytes: int = OCR_CACHE_MAX_BYTES, memory_entries: int = OCR_CACHE_MEMORY_ENTRIES):
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory: LRUCache[str, str] = LRUCache(max_entries=memory_entries)
+        self._lock = threading.Lock()
+        # Bytes in the table as of the last full count plus what this process stored since
+        self._stored_bytes: Optional[int] = None
+        self._stores_since_sync = 0
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _remember(self, key: str, text: str):
+        self._memory.put(key, text)
+
+    def get_memory(self, key: str) -> Optional[str]:
+        text = self._memory.get(key)
+        if text is not None:
+            self._count("memory_hits")
+        return text
+
+    def get(self, key: str) -> Optional[str]:
+        """Looks the key up in memory, then in the database. Counts a miss when absent from both."""
+        text = self.get_memory(key)
+        if text is not None:
+            return text
+        db = SessionLocal()
+        try:
+            entry = db.get(OcrCacheEntry, key)
+            if entry is None:
+                self._count("misses")
+                return None
+            text = entry.text
+            db.execute(
+                update(OcrCacheEntry)
+                .where(OcrCacheEntry.key == key)
+                .values(hit_count=OcrCacheEntry.hit_count + 1, last_used_at=datetime.now(timezone.utc))
+            )
+            db.commit()
+        finally:
+            db.close()
+        self._count("db_hits")
+        self._remember(key, text)
+        return text
+
+    def put(self, key: str, image_sha256: str, text: str):
+        self._remember(key, text)
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        db = SessionLocal()
+        try:
+            if db.get(OcrCacheEntry, key) is None:
+                db.add(OcrCacheEntry(
+                    key=key,
+                    image_sha256=image_sha256,
+                    model_id=ocr_model_label(),
+                    prompt_version=OCR_PROMPT_VERSION,
+                    text=text,
+                    size_bytes=size,
+                ))
+                db.commit()
+                self._count("stores")
+                if self._eviction_due(size):
+                    self._evict(db)
+        except Exception as e:
+            # A concurrent insert of the same key is harmless; the cache is best-effort.
+            db.rollback()
+            logger.warning("store failed: %s", e)
+        finally:
+            db.close()
+
+    def _eviction_due(self, added: int) -> bool:
+        with self._lock:
+            self._stores_since_sync += 1
+            if self._stored_bytes is not None:
+                self._stored_bytes += added
+            due = (self._stored_bytes is None or self._stored_bytes > self.max_bytes
+                   or self._stores_since_sync >= OCR_CACHE_RESYNC_STORES)
+            if due:
+                self._stores_since_sync = 0
+            return due
+
+    def _evict(self, db):
+        total = db.query(func.coalesce(func.sum(OcrCacheEntry.size_bytes), 0)).scalar()
+        if total <= self.max_bytes:
+            with self._lock:
+                self._stored_bytes = total
+            return
+        target = int(self.max_bytes * OCR_CACHE_EVICT_TO)
+        victims = []
+        for key, size in db.query(OcrCacheEntry.key, OcrCacheEntry.size_bytes).order_by(OcrCacheEntry.last_used_at):
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size
+        db.query(OcrCacheEntry).filter(OcrCacheEntry.key.in_(victims)).delete(synchronize_session=False)
+        db.commit()
+        with self._lock:
+            self._stored_bytes = total
+        self._count("evictions", len(victims))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._memory)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        counters["hit_rate"] = round((counters["memory_hits"] + counters["db_hits"]) / lookups, 4) if lookups else 0.0
+        return counters
+
+
+ocr_cache = OcrCache()
@@ -0,0 +1,176 @@
+"""PDF notes (GoodNotes, Notability exports, scans) to Markdown.
+
+Pages that already carry a text layer of at least PDF_TEXT_MIN_CHARS characters
+are used as-is; the others are rasterized with PyMuPDF in a process pool
+(PDF_INGEST_WORKERS), in chunks of PDF_RASTER_CHUNK_PAGES so OCR of the first
+pages starts while later ones are still rendering, and OCR'd concurrently.
+Rasters are JPEGs sized for OCR (PDF_RASTER_DPI, capped at OCR_IMAGE_MAX_SIDE),
+so they skip the image normalization stage. The page texts are joined in page
+order.
+"""
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Awaitable, Callable, Optional, Union
+
+from .executors import LazyExecutor
+from .image_prep import UnsupportedImage, OCR_IMAGE_MAX_SIDE, OCR_IMAGE_QUALITY
+from .metrics import registry, Counter, Histogram
+
+PDF_INGEST_EXECUTOR = os.getenv("PDF_INGEST_EXECUTOR", "process")
+PDF_INGEST_WORKERS = int(os.getenv("PDF_INGEST_WORKERS", "2"))
+PDF_RASTER_DPI = int(os.getenv("PDF_RASTER_DPI", "150"))
+PDF_RASTER_CHUNK_PAGES = int(os.getenv("PDF_RASTER_CHUNK_PAGES", "2"))
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "40"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "200"))
+# Pages of one document OCR'd at once (the process-wide OCR_MAX_CONCURRENCY still applies)
+PDF_OCR_CONCURRENCY = int(os.getenv("PDF_OCR_CONCURRENCY", "4"))
+# In-memory PDFs above this are written to a temp file once instead of being sent to every worker task
+PDF_SPILL_BYTES = 1024 * 1024
+
+# Between pages of a multi-page note
+PAGE_SEPARATOR = "\n\n---\n\n"
+
+logger = logging.getLogger("hivemind.pdf_ingest")
+
+pdf_pages_total = registry.register(Counter(
+    "pdf_pages_total", "PDF pages ingested, by where their text came from (text_layer / ocr / failed).", ("source",),
+))
+pdf_ingest_duration_seconds = registry.register(Histogram(
+    "pdf_ingest_duration_seconds", "Time to turn one PDF into Markdown (inspection, rasterization and OCR).",
+))
+
+
+class UnsupportedPdf(UnsupportedImage):
+    """Unreadable, encrypted or over-long PDF; answered with 415 like other unusable uploads."""
+
+
+class PartialText(str):
+    """Document text in which some pages could not be read; usable as a str, but never cached."""
+
+
+def is_pdf(head: bytes) -> bool:
+    return head.startswith(b"%PDF-")
+
+
+def _open(source: Union[bytes, str]):
+    import pymupdf
+    try:
+        doc = pymupdf.open(source) if isinstance(source, str) else pymupdf.open(stream=source, filetype="pdf")
+    except Exception as e:
+        raise UnsupportedPdf(f"unreadable PDF ({e})")
+    if doc.needs_pass:
+        doc.close()
+        raise UnsupportedPdf("encrypted PDF")
+    return doc
+
+
+def _clean_text(text: str) -> str:
+    text = text.replace("\r\n", "\n").strip()
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
+def inspect_pdf(source: Union[bytes, str], min_chars: int = PDF_TEXT_MIN_CHARS, max_pages: int = PDF_MAX_PAGES) -> list[Optional[str]]:
+    """Text layer of every page, or None where the page needs OCR. Runs in a worker process."""
+    doc = _open(source)
+    try:
+        if doc.page_count > max_pages:
+            raise UnsupportedPdf(f"PDF has {doc.page_count} pages (limit {max_pages})")
+        texts = []
+        for page in doc:
+            text = _clean_text(page.get_text("text"))
+            texts.append(text if len(text) >= min_chars else None)
+        return texts
+    finally:
+        doc.close()
+
+
+def rasterize_pages(source: Union[bytes, str], indexes: list[int], dpi: int = PDF_RASTER_DPI,
+                    max_side: int = OCR_IMAGE_MAX_SIDE, quality: int = OCR_IMAGE_QUALITY) -> list[bytes]:
+    """JPEG renders of the given pages, at `dpi` but no larger than max_side. Runs in a worker process."""
+    import pymupdf
+    doc = _open(source)
+    try:
+        images = []
+        for index in indexes:
+            page = doc[index]
+            zoom = min(dpi / 72, max_side / max(page.rect.width, page.rect.height, 1))
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csRGB, alpha=False)
+            images.append(pixmap.tobytes("jpeg", jpg_quality=quality))
+        return images
+    finally:
+        doc.close()
+
+
+def _spill(data: bytes) -> str:
+    with tempfile.NamedTemporaryFile(prefix="pdf-", suffix=".pdf", delete=False) as f:
+        f.write(data)
+        return f.name
+
+
+_executor = LazyExecutor(PDF_INGEST_EXECUTOR, PDF_INGEST_WORKERS, "pdf-ingest")
+
+
+def shutdown():
+    _executor.shutdown()
+
+
+async def extract_pdf_content(source: Union[bytes, str], ocr: Callable[[bytes, str], Awaitable[str]],
+                              filename: str = "", on_page: Optional[Callable[[], Awaitable[None]]] = None) -> str:
+    """Markdown of a PDF given as bytes or a file path; `ocr(image, mime_type)` reads one rendered page.
+
+    `on_page()`, if given, is awaited after each OCR'd page (read or not).
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(source, bytes) and len(source) > PDF_SPILL_BYTES:
+        path = await loop.run_in_executor(None, _spill, source)
+        try:
+            return await extract_pdf_content(path, ocr, filename, on_page)
+        finally:
+            await loop.run_in_executor(None, os.unlink, path)
+
+    executor = _executor.get()
+    started = time.perf_counter()
+
+    texts = await loop.run_in_executor(executor, inspect_pdf, source)
+    if not texts:
+        raise UnsupportedPdf("PDF has no pages")
+    to_ocr = [i for i, text in enumerate(texts) if text is None]
+    failed: list[int] = []
+    semaphore = asyncio.Semaphore(PDF_OCR_CONCURRENCY)
+
+    async def ocr_page(index: int, image: bytes):
+        async with semaphore:
+            try:
+                texts[index] = await ocr(image, "image/jpeg")
+            except Exception as e:
+                logger.warning("%s page %d: OCR failed: %s", filename, index + 1, e)
+                failed.append(index)
+                texts[index] = f"*[Page {index + 1} could not be read]*"
+        if on_page is not None:
+            await on_page()
+
+    async def render_and_ocr(chunk: list[int]):
+        images = await loop.run_in_executor(executor, rasterize_pages, source, chunk)
+        await asyncio.gather(*(ocr_page(index, image) for index, image in zip(chunk, images)))
+
+    chunks = [to_ocr[i:i + PDF_RASTER_CHUNK_PAGES] for i in range(0, len(to_ocr), max(1, PDF_RASTER_CHUNK_PAGES))]
+    await asyncio.gather(*(render_and_ocr(chunk) for chunk in chunks))
+
+    if failed and len(failed) == len(texts):
+        raise RuntimeError(f"OCR failed on every page of {filename or 'the PDF'}")
+
+    elapsed = time.perf_counter() - started
+    pdf_ingest_duration_seconds.observe((), elapsed)
+    pdf_pages_total.inc(("text_layer",), len(texts) - len(to_ocr))
+    pdf_pages_total.inc(("ocr",), len(to_ocr) - len(failed))
+    if failed:
+        pdf_pages_total.inc(("failed",), len(failed))
+    logger.info("%s: %d pages (%d text layer, %d OCR, %d failed) in %.1fms (%.1f pages/s)", filename, len(texts),
+                len(texts) - len(to_ocr), len(to_ocr), len(failed), elapsed * 1000, len(texts) / elapsed)
+    text = PAGE_SEPARATOR.join(texts)
+    # Failures may be transient: a re-upload retries those pages (the others hit the per-page cache)
+    return PartialText(text) if failed else text
@@ -0,0 +1,122 @@
+"""Master Note PDF rendering off the event loop, with a size-bounded cache.
+
+ReportLab is CPU-bound, so documents are built in a worker pool
+(PDF_RENDER_EXECUTOR = "process" or "thread"). Results are cached per
+(master id, version) in an LRU bounded by PDF_CACHE_MAX_BYTES; a new version
+gets a new key, so saving a Master Note never serves a stale PDF. Concurrent
+requests for the same uncached version share one render.
+"""
+import asyncio
+import os
+from typing import Optional
+
+from .caching import LRUCache, SingleFlight
+from .executors import LazyExecutor
+
+PDF_RENDER_EXECUTOR = os.getenv("PDF_RENDER_EXECUTOR", "process")
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+PDF_STREAM_CHUNK_BYTES = int(os.getenv("PDF_STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+# Bump when the layout changes so clients drop PDFs cached under the old ETag
+PDF_LAYOUT_VERSION = "1"
+
+
+class PdfUnavailable(Exception):
+    """ReportLab is not installed."""
+
+
+def render_master_pdf(topic: str, version: int, date: str, content: str) -> bytes:
+    """Builds the Master Note PDF. Module-level and plain-argument so it can run in a worker process."""
+    # Import reportlab lazily so the app can run without it installed
+    try:
+        from io import BytesIO
+        from reportlab.lib.pagesizes import LETTER
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    except ImportError as e:
+        raise PdfUnavailable(str(e))
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=LETTER)
+    styles = getSampleStyleSheet()
+
+    elements = []
+    elements.append(Paragraph(f"Master Note: {topic}", styles['Title']))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph(f"Version: {version} | Date: {date}", styles['Normal']))
+    elements.append(Spacer(1, 24))
+
+    # Process content paragraphs
+    for p in content.split('\n'):
+        if p.strip():
+            elements.append(Paragraph(p, styles['Normal']))
+            elements.append(Spacer(1, 6))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def pdf_etag(master_id: int, version: int) -> str:
+    """Known before rendering, so If-None-Match revalidations never touch the renderer."""
+    return f'"master-{master_id}-v{version}-l{PDF_LAYOUT_VERSION}"'
+
+
+class PdfCache:
+    def __init__(self, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: LRUCache[tuple[int, int], bytes] = LRUCache(max_size=max_bytes, sizeof=len)
+        self._renders: SingleFlight[tuple[int, int], bytes] = SingleFlight()
+        self._executor = LazyExecutor(PDF_RENDER_EXECUTOR, PDF_RENDER_WORKERS, "pdf-render")
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+
+    def get(self, key: tuple[int, int]) -> Optional[bytes]:
+        return self._entries.get(key)
+
+    def put(self, key: tuple[int, int], data: bytes):
+        self._entries.put(key, data)
+
+    async def get_or_render(self, master_id: int, version: int, topic: str, date: str, content: str) -> bytes:
+        key = (master_id, version)
+        data = self.get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+
+        async def render() -> bytes:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._executor.get(), render_master_pdf, topic, version, date, content)
+            self.renders += 1
+            self.put(key, data)
+            return data
+
+        # Single-flight: the first request renders, concurrent ones await its result
+        return await self._renders.run(key, render)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._entries.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "renders": self.renders,
+            "evictions": self._entries.evictions,
+            "executor": PDF_RENDER_EXECUTOR,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+pdf_cache = PdfCache()
+
+
+async def iter_pdf_chunks(data: bytes):
+    """Streams a cached PDF without copying it: memoryview slices share the cached buffer."""
+    view = memoryview(data)
+    for start in range(0, len(view), PDF_STREAM_CHUNK_BYTES):
+        yield view[start:start + PDF_STREAM_CHUNK_BYTES]
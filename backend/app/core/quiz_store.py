@@ -0,0 +1,120 @@
+"""Storage for the active quiz question of each user.
+
+QUIZ_STORE selects the backend: "db" (default) keeps quizzes in the
+`quiz_states` table so every uvicorn worker sees them and they survive restarts;
+"memory" is a per-process LRU for single-worker development. Both expire
+entries after QUIZ_TTL_SECONDS.
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from ..database import SessionLocal
+from ..models import QuizState
+from .caching import LRUCache
+
+QUIZ_STORE = os.getenv("QUIZ_STORE", "db")
+QUIZ_TTL_SECONDS = int(os.getenv("QUIZ_TTL_SECONDS", "3600"))
+QUIZ_MEMORY_MAX_ENTRIES = int(os.getenv("QUIZ_MEMORY_MAX_ENTRIES", "10000"))
+
+
+class QuizStore(ABC):
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[dict]:
+        """The user's active quiz, or None when there is none or it expired."""
+
+    @abstractmethod
+    def set(self, user_id: int, quiz: dict):
+        """Replaces the user's active quiz."""
+
+    @abstractmethod
+    def delete(self, user_id: int):
+        """Drops the user's active quiz, if any."""
+
+
+class MemoryQuizStore(QuizStore):
+    """Bounded LRU with per-entry TTL."""
+
+    def __init__(self, ttl_seconds: int = QUIZ_TTL_SECONDS, max_entries: int = QUIZ_MEMORY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: LRUCache[int, dict] = LRUCache(max_entries=max_entries)
+
+    def get(self, user_id: int) -> Optional[dict]:
+        return self._entries.get(user_id)
+
+    def set(self, user_id: int, quiz: dict):
+        self._entries.put(user_id, quiz, expires_at=time.monotonic() + self.ttl_seconds)
+
+    def delete(self, user_id: int):
+        self._entries.pop(user_id)
+
+
+class DatabaseQuizStore(QuizStore):
+    """Keeps quizzes in `quiz_states`; expired rows are ignored on read and purged on write."""
+
+    def __init__(self, ttl_seconds: int = QUIZ_TTL_SECONDS, purge_interval_seconds: int = 300):
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = 0.0
+
+    def get(self, user_id: int) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            state = db.get(QuizState, user_id)
+            if state is None or _as_utc(state.expires_at) <= datetime.now(timezone.utc):
+                return None
+            return state.quiz
+        finally:
+            db.close()
+
+    def set(self, user_id: int, quiz: dict):
+        now = datetime.now(timezone.utc)
+        state = QuizState(user_id=user_id, quiz=quiz, expires_at=now + timedelta(seconds=self.ttl_seconds))
+        db = SessionLocal()
+        try:
+            try:
+                db.merge(state)
+                db.flush()
+            except IntegrityError:
+                # Another worker inserted this user's row between our SELECT and INSERT
+                db.rollback()
+                db.merge(state)
+            if time.monotonic() - self._last_purge > self.purge_interval_seconds:
+                self._last_purge = time.monotonic()
+                db.query(QuizState).filter(QuizState.expires_at <= now).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def delete(self, user_id: int):
+        db = SessionLocal()
+        try:
+            db.query(QuizState).filter(QuizState.user_id == user_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes for timezone-aware columns
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+_quiz_store: Optional[QuizStore] = None
+
+
+def get_quiz_store() -> QuizStore:
+    global _quiz_store
+    if _quiz_store is None:
+        if QUIZ_STORE == "memory":
+            _quiz_store = MemoryQuizStore()
+        elif QUIZ_STORE == "db":
+            _quiz_store = DatabaseQuizStore()
+        else:
+            raise ValueError(f"Unknown QUIZ_STORE '{QUIZ_STORE}' (expected 'db' or 'memory')")
+    return _quiz_store
@@ -0,0 +1,185 @@
+"""Structured access logging and per-route HTTP metrics.
+
+Each request produces at most one JSON log line. Lines are handed to a
+QueueHandler and written by a QueueListener thread, so the request path never
+waits on stdout. Successful fast requests are sampled (LOG_SAMPLE_RATE);
+server errors and requests slower than LOG_SLOW_REQUEST_MS are always logged.
+Headers are only logged with LOG_REQUEST_HEADERS=true, and credentials are
+redacted.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+from .metrics import http_requests_total, http_request_duration_seconds
+from .llm_metrics import LlmUsage, request_usage_var
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+LOG_REQUEST_HEADERS = os.getenv("LOG_REQUEST_HEADERS", "false").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED_HEADERS = {"authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key"} | {
+    h.strip().lower() for h in os.getenv("LOG_REDACT_HEADERS", "").split(",") if h.strip()
+}
+
+# Id of the request being handled, for log lines emitted further down the stack
+request_id_var: ContextVar[str] = ContextVar("request_id", default="")
+
+# Every hivemind.* logger (access lines, core modules) goes through the queued writer below
+app_logger = logging.getLogger("hivemind")
+app_logger.propagate = False
+access_logger = logging.getLogger("hivemind.access")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = record.msg if isinstance(record.msg, dict) else {"message": record.getMessage()}
+        return json.dumps({"ts": round(record.created, 3), "level": record.levelname.lower(), "logger": record.name, **payload}, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records when the queue is full instead of blocking the request."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
+
+    def prepare(self, record):
+        # The dict payload is formatted on the listener thread, not here
+        return record
+
+
+_listener = None
+
+
+def start_logging():
+    """Routes the hivemind loggers through a bounded queue to a background writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    app_logger.handlers = [_DroppingQueueHandler(log_queue)]
+    app_logger.setLevel(logging.INFO)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+
+def stop_logging():
+    """Flushes queued lines and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def redact_headers(headers: list[tuple[bytes, bytes]]) -> dict:
+    redacted = {}
+    for raw_name, raw_value in headers:
+        name = raw_name.decode("latin-1").lower()
+        redacted[name] = "[redacted]" if name in REDACTED_HEADERS else raw_value.decode("latin-1")
+    return redacted
+
+
+class RequestLoggingMiddleware:
+    """Pure ASGI middleware: times each request until its last body byte, records
+    route metrics and emits one structured log line (sampled).
+
+    The route label is the matched path template (/notes/{note_id}), never the raw
+    path, so metric cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        request_id = _header(scope, b"x-request-id") or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        usage = LlmUsage()
+        usage_token = request_usage_var.set(usage)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                # Model calls made before the response starts (streamed answers report in the log line)
+                if usage.calls:
+                    headers.append((b"x-llm-usage", usage.header_value().encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            route_path = route_template(scope)
+            method = scope["method"]
+            http_requests_total.inc((method, route_path, str(status)))
+            http_request_duration_seconds.observe((method, route_path), elapsed)
+
+            duration_ms = elapsed * 1000
+            if status >= 500 or duration_ms >= LOG_SLOW_REQUEST_MS or random.random() < LOG_SAMPLE_RATE:
+                entry = {
+                    "event": "request",
+                    "request_id": request_id,
+                    "method": method,
+                    "path": scope["path"],
+                    "route": route_path,
+                    "status": status,
+                    "duration_ms": round(duration_ms, 1),
+                    "client": (scope.get("client") or ("", 0))[0],
+                }
+                if usage.calls:
+                    entry["llm"] = usage.as_dict()
+                if LOG_REQUEST_HEADERS:
+                    entry["headers"] = redact_headers(scope.get("headers", []))
+                access_logger.info(entry)
+            request_usage_var.reset(usage_token)
+            request_id_var.reset(token)
+
+
+def route_template(scope) -> str:
+    """Full path template of the matched route, e.g. /notes/{note_id}/similar.
+
+    Routes from included routers may carry only their router-relative path, so the
+    router prefix is recovered from the raw path.
+    """
+    template = getattr(scope.get("route"), "path", None)
+    if not template:
+        return "unmatched"
+    try:
+        suffix = template.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    path = scope["path"]
+    if path.endswith(suffix):
+        return path[:len(path) - len(suffix)] + template
+    return template
+
+
+def _header(scope, name: bytes):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")[:128]
+    return None
@@ -1,20 +1,27 @@
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional
 import os
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+from ..database import get_db
+from .caching import LRUCache
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret_key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 4096))
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -40,13 +47,73 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller, as resolved from a verified access token."""
+    user_id: int
+    email: Optional[str]
+    claims: dict = field(default_factory=dict, compare=False)
+
+
+class _PrincipalCache:
+    """Bounded LRU of token -> Principal; entries expire with the token's `exp`."""
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # Token expiry is wall-clock time (the `exp` claim)
+        self._entries: LRUCache[str, Principal] = LRUCache(max_entries=max_entries, clock=time.time)
+
+    def get(self, token: str) -> Optional[Principal]:
+        return self._entries.get(token)
+
+    def put(self, token: str, expires_at: float, principal: Principal):
+        self._entries.put(token, principal, expires_at=expires_at)
+
+    def clear(self):
+        self._entries.clear()
+
+
+principal_cache = _PrincipalCache()
+
+
+def resolve_principal(token: str, db: Session) -> Optional[Principal]:
+    """Verifies the token once and caches the result until it expires.
+
+    Tokens carry the numeric `user_id` claim issued by /auth/login, so no user
+    lookup is needed; tokens issued before that claim existed fall back to an
+    email lookup (cached the same way).
+    """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     payload = decode_access_token(token)
     if payload is None:
+        return None
+    user_id = payload.get("user_id")
+    if user_id is None:
+        from ..models import User
+        user = db.query(User.id).filter(User.email == payload.get("sub")).first()
+        if user is None:
+            return None
+        user_id = user.id
+    principal = Principal(user_id=int(user_id), email=payload.get("sub"), claims=payload)
+    principal_cache.put(token, float(payload.get("exp", time.time())), principal)
+    return principal
+
+
+def get_optional_principal(token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)) -> Optional[Principal]:
+    """Dependency for routes that also serve anonymous callers."""
+    if not token:
+        return None
+    return resolve_principal(token, db)
+
+
+def get_current_principal(principal: Optional[Principal] = Depends(get_optional_principal)) -> Principal:
+    """Dependency for routes that require a valid access token."""
+    if principal is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return payload
-
+    return principal
@@ -0,0 +1,222 @@
+"""Streaming, size-bounded multipart uploads.
+
+`receive_upload` parses the request body as it arrives instead of buffering it:
+the Content-Length is checked before anything is read, every file is hashed
+(SHA-256) and counted chunk by chunk, and the request is rejected as soon as a
+file passes UPLOAD_MAX_BYTES. Files stay in memory up to UPLOAD_SPOOL_BYTES and
+are spooled to a named temporary file past that, so the image pipeline can read
+them from disk in its worker processes without the API process holding them.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+import python_multipart
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+# Form fields are small (ids, teacher name); anything bigger is not a legitimate upload
+UPLOAD_MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """A file (or the whole body) is over the configured limit; answered with 413."""
+
+
+class InvalidUpload(Exception):
+    """The body is not the multipart form the endpoint expects; answered with 422, like FastAPI's own form validation."""
+
+
+class SpooledUpload:
+    """One uploaded file: in memory while small, a named temp file once past the spool threshold."""
+
+    def __init__(self, field_name: str, filename: str, content_type: str, spool_bytes: int = UPLOAD_SPOOL_BYTES):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.path: Optional[str] = None
+        self._spool_bytes = spool_bytes
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self._hash = hashlib.sha256()
+        self.sha256 = ""
+
+    @property
+    def on_disk(self) -> bool:
+        return self.path is not None
+
+    def _roll_over(self):
+        self._file = tempfile.NamedTemporaryFile(prefix="upload-", dir=UPLOAD_SPOOL_DIR, delete=False)
+        self.path = self._file.name
+        self._file.write(self._buffer.getbuffer())
+        self._buffer = None
+
+    def write(self, data: bytes):
+        """Appends a chunk (blocking file I/O once spooled; call it in a thread then)."""
+        self._hash.update(data)
+        self.size += len(data)
+        if self._file is None and self.size > self._spool_bytes:
+            self._roll_over()
+        (self._file or self._buffer).write(data)
+
+    def finish(self):
+        self.sha256 = self._hash.hexdigest()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def source(self) -> Union[bytes, str]:
+        """The bytes when kept in memory, otherwise the path of the spooled file."""
+        return self.path if self.path is not None else self._buffer.getvalue()
+
+    def head(self, size: int = 16) -> bytes:
+        """First bytes of the file, for format sniffing."""
+        if self.path is None:
+            return self._buffer.getvalue()[:size]
+        with open(self.path, "rb") as f:
+            return f.read(size)
+
+    def read_bytes(self) -> bytes:
+        if self.path is None:
+            return self._buffer.getvalue()
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self._buffer = None
+
+
+@dataclass
+class UploadForm:
+    fields: dict[str, str] = field(default_factory=dict)
+    files: list[SpooledUpload] = field(default_factory=list)
+
+    def require(self, name: str) -> str:
+        value = self.fields.get(name)
+        if value is None:
+            raise InvalidUpload(f"Missing form field '{name}'")
+        return value
+
+    def close(self):
+        for upload in self.files:
+            upload.close()
+
+
+async def receive_upload(request: Request, max_bytes: int = UPLOAD_MAX_BYTES, max_files: int = 1,
+                         spool_bytes: int = UPLOAD_SPOOL_BYTES) -> UploadForm:
+    """Streams a multipart/form-data body into an UploadForm; the caller must close() it.
+
+    `max_bytes` bounds each file, so the whole body may be up to max_files times
+    that (plus the form fields).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidUpload("Expected a multipart/form-data body")
+    body_limit = max_files * max_bytes + UPLOAD_MAX_FIELD_BYTES
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > body_limit:
+        # Refused before a single byte of the body is read
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+
+    form = UploadForm()
+    state = {"headers": {}, "header_name": b"", "header_value": b"", "upload": None, "field": None, "data": bytearray()}
+    pending: list[tuple[SpooledUpload, bytes]] = []
+
+    def on_part_begin():
+        state["headers"], state["upload"], state["field"] = {}, None, None
+        state["data"] = bytearray()
+
+    def on_header_field(data, start, end):
+        state["header_name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_name"].lower()] = state["header_value"]
+        state["header_name"], state["header_value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name")
+        if name is None:
+            raise InvalidUpload("Form part without a name")
+        name = name.decode("utf-8", "replace")
+        if b"filename" in options:
+            if len(form.files) >= max_files:
+                raise InvalidUpload(f"At most {max_files} file(s) per request")
+            upload = SpooledUpload(name, options[b"filename"].decode("utf-8", "replace"),
+                                   state["headers"].get(b"content-type", b"application/octet-stream").decode("latin-1"),
+                                   spool_bytes)
+            form.files.append(upload)
+            state["upload"] = upload
+        else:
+            state["field"] = name
+
+    def on_part_data(data, start, end):
+        chunk = data[start:end]
+        upload = state["upload"]
+        if upload is None:
+            if len(state["data"]) + len(chunk) > UPLOAD_MAX_FIELD_BYTES:
+                raise InvalidUpload(f"Form field '{state['field']}' is too large")
+            state["data"] += chunk
+        else:
+            pending.append((upload, chunk))
+
+    def on_part_end():
+        if state["upload"] is None and state["field"] is not None:
+            form.fields[state["field"]] = state["data"].decode("utf-8", "replace")
+
+    parser = python_multipart.MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    try:
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > body_limit:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+            parser.write(chunk)
+            for upload, data in pending:
+                if upload.size + len(data) > max_bytes:
+                    raise UploadTooLarge(f"{upload.filename} exceeds {max_bytes} bytes")
+                if upload.on_disk or upload.size + len(data) > spool_bytes:
+                    await run_in_threadpool(upload.write, data)
+                else:
+                    upload.write(data)
+            pending.clear()
+        parser.finalize()
+        for upload in form.files:
+            upload.finish()
+    except FormParserError as e:
+        form.close()
+        raise InvalidUpload(f"Malformed multipart body: {e}")
+    except BaseException:
+        form.close()
+        raise
+    return form
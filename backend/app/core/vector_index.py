@@ -0,0 +1,220 @@
+"""In-process exact top-k similarity search over the JSON `embedding` columns.
+
+Embeddings for one (kind, subject, chapter) scope are decoded once into a
+contiguous float32 NumPy matrix and kept in an LRU bounded by
+VECTOR_INDEX_MAX_BYTES. Writes to `Note` / `MasterNote` mark the affected
+scopes stale when their transaction commits, and every scope also expires after
+VECTOR_INDEX_TTL_SECONDS so that other uvicorn workers pick up rows they did not
+write themselves. Concurrent searches of a scope that is not loaded share one
+load, which runs in a thread on its own short-lived session.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models import Note, MasterNote
+from .caching import LRUCache, SingleFlight
+
+VECTOR_INDEX_TTL_SECONDS = float(os.getenv("VECTOR_INDEX_TTL_SECONDS", "60"))
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+
+METRICS = ("cosine", "dot")
+_MODELS = {"notes": Note, "master": MasterNote}
+
+
+@dataclass
+class _Matrix:
+    ids: np.ndarray        # int64, shape (n,)
+    vectors: np.ndarray    # float32, shape (n, dim), C-contiguous
+    norms: np.ndarray      # float32, shape (n,)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.vectors.nbytes + self.norms.nbytes
+
+
+def _load(kind: str, subject_id: int, chapter: Optional[int]) -> _Matrix:
+    model = _MODELS[kind]
+    db = SessionLocal()
+    try:
+        q = db.query(model.id, model.embedding).filter(
+            model.subject_id == subject_id,
+            model.embedding.isnot(None),
+        )
+        if chapter is not None:
+            q = q.filter(model.chapter == chapter)
+        rows = q.order_by(model.id).all()
+    finally:
+        db.close()
+
+    # Keep only rows matching the dominant dimension; mixed dims can appear
+    # while embedding models are being switched.
+    dims: dict[int, int] = {}
+    for _, emb in rows:
+        if isinstance(emb, list) and emb:
+            dims[len(emb)] = dims.get(len(emb), 0) + 1
+    if not dims:
+        return _Matrix(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.float32))
+    dim = max(dims, key=dims.get)
+    kept = [(note_id, emb) for note_id, emb in rows if isinstance(emb, list) and len(emb) == dim]
+
+    ids = np.fromiter((note_id for note_id, _ in kept), dtype=np.int64, count=len(kept))
+    vectors = np.ascontiguousarray(np.array([emb for _, emb in kept], dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+    return _Matrix(ids, vectors, norms)
+
+
+def _top_k(matrix: _Matrix, query: list[float], k: int, metric: str, exclude_ids: tuple[int, ...]) -> list[tuple[int, float]]:
+    if matrix.ids.size == 0:
+        return []
+    q = np.asarray(query, dtype=np.float32)
+    if q.ndim != 1 or q.shape[0] != matrix.dim:
+        raise ValueError(f"Query has dimension {q.shape[-1] if q.ndim else 0}, index has {matrix.dim}")
+
+    scores = matrix.vectors @ q
+    if metric == "cosine":
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0.0:
+            return []
+        denom = matrix.norms * q_norm
+        scores = np.divide(scores, denom, out=np.zeros_like(scores), where=denom > 0)
+
+    if exclude_ids:
+        scores[np.isin(matrix.ids, exclude_ids)] = -np.inf
+
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(matrix.ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+class VectorIndex:
+    """Caches one embedding matrix per (kind, subject_id, chapter) scope.
+
+    `chapter=None` covers every chapter of the subject.
+    """
+
+    def __init__(self, ttl_seconds: float = VECTOR_INDEX_TTL_SECONDS, max_bytes: int = VECTOR_INDEX_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._matrices: LRUCache[tuple, _Matrix] = LRUCache(max_size=max_bytes, sizeof=lambda matrix: matrix.nbytes)
+        self._loads: SingleFlight[tuple, _Matrix] = SingleFlight()
+        # Bumped by every invalidation, so a load that overlapped a commit is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, kind: str, subject_id: Optional[int], chapter: Optional[int]):
+        """Drops the chapter scope and the subject-wide scope that contains it."""
+        with self._lock:
+            self._generation += 1
+        self._matrices.pop((kind, subject_id, chapter))
+        self._matrices.pop((kind, subject_id, None))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+        self._matrices.clear()
+
+    async def _get(self, kind: str, subject_id: int, chapter: Optional[int]) -> _Matrix:
+        key = (kind, subject_id, chapter)
+        matrix = self._matrices.get(key)
+        if matrix is not None:
+            return matrix
+
+        async def load() -> _Matrix:
+            generation = self._generation
+            matrix = await run_in_threadpool(_load, kind, subject_id, chapter)
+            if generation == self._generation:
+                self._matrices.put(key, matrix, expires_at=time.monotonic() + self.ttl_seconds)
+            return matrix
+
+        return await self._loads.run(key, load)
+
+    async def search(
+        self,
+        query: list[float],
+        subject_id: int,
+        chapter: Optional[int] = None,
+        kind: str = "notes",
+        k: int = 10,
+        metric: str = "cosine",
+        exclude_ids: tuple[int, ...] = (),
+    ) -> list[tuple[int, float]]:
+        """Returns up to k (id, score) pairs, best first."""
+        if kind not in _MODELS:
+            raise ValueError(f"Unknown kind '{kind}'")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'")
+
+        matrix = await self._get(kind, subject_id, chapter)
+        # Scoring a large scope is a matrix product; keep it off the event loop
+        return await run_in_threadpool(_top_k, matrix, query, k, metric, exclude_ids)
+
+
+vector_index = VectorIndex()
+
+
+def hydrate_hits(db: Session, kind: str, hits: list[tuple[int, float]]) -> list[dict]:
+    """Loads the rows behind (id, score) pairs in one query, keeping rank order."""
+    if not hits:
+        return []
+    model = _MODELS[kind]
+    rows = {row.id: row for row in db.query(model).filter(model.id.in_([i for i, _ in hits])).all()}
+    results = []
+    for row_id, score in hits:
+        row = rows.get(row_id)
+        if row is None:
+            continue
+        results.append({
+            "id": row.id,
+            "score": score,
+            "subject_id": row.subject_id,
+            "chapter": row.chapter,
+            "user_id": row.user_id,
+            "content": row.content,
+            "topic": getattr(row, "topic", None),
+        })
+    return results
+
+
+# Invalidate scopes touched by a transaction once it commits; invalidating on
+# flush would let a concurrent reader reload the matrix before the row is visible.
+_PENDING_KEY = "vector_index_pending"
+
+
+def mark_dirty(session: Session, kind: str, subject_id: Optional[int], chapter: Optional[int]):
+    """Queues an invalidation for the session's next commit; for Core statements that bypass flush."""
+    session.info.setdefault(_PENDING_KEY, set()).add((kind, subject_id, chapter))
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_dirty_scopes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for kind, model in _MODELS.items():
+            if isinstance(obj, model):
+                mark_dirty(session, kind, obj.subject_id, obj.chapter)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_scopes(session):
+    for kind, subject_id, chapter in session.info.pop(_PENDING_KEY, ()):
+        vector_index.invalidate(kind, subject_id, chapter)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_scopes(session):
+    session.info.pop(_PENDING_KEY, None)
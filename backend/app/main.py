@@ -1,10 +1,20 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from .database import engine, Base
+from .database import engine, async_engine, Base
 from .api import auth, ingestion, consensus, rag, analytics
 from .api import subjects, notes
 from .api import ai  # health check for AI integrations
+from .core.ai_agents import close_genai_client
+from .core.ingestion_jobs import job_pool
+from .core.embeddings import embedding_queue
+from .core.db_pool import pool_stats
+from .core.pdf_render import pdf_cache
+from .core.image_prep import image_preparer
+from .core import pdf_ingest
+from .core.metrics import registry, gauge_lines
+from .core.request_logging import RequestLoggingMiddleware, start_logging, stop_logging
 
 # Try to create tables (if pgvector isn't available, this should work with JSON fallback embeddings)
 try:
@@ -15,22 +25,13 @@ except Exception as e:
 
 app = FastAPI(title="HiveMind API")
 
-# Small startup info and request logging to help Railway debugging
+# Small startup info; per-request logging is structured and queued (see core/request_logging.py)
 import logging
-from starlette.requests import Request
-from starlette.middleware.base import BaseHTTPMiddleware
 
 logging.basicConfig(level=logging.INFO)
 port = os.getenv("PORT", "8000")
 print(f"Starting HiveMind API on port {port}")
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        print(f"REQ {request.method} {request.url.path} headers={dict(request.headers)}")
-        response = await call_next(request)
-        print(f"RESP {request.method} {request.url.path} status={response.status_code}")
-        return response
-
 app.add_middleware(RequestLoggingMiddleware)
 
 # Configure CORS for mobile and web
@@ -42,8 +43,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Disposition", "X-Request-ID", "X-LLM-Usage"],
 )
 
+@app.on_event("startup")
+async def startup():
+    start_logging()
+    # Resumes ingestion jobs left queued by a previous run
+    await job_pool.start()
+    await embedding_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_pool.stop()
+    await embedding_queue.stop()
+    await close_genai_client()
+    await async_engine.dispose()
+    pdf_cache.shutdown()
+    image_preparer.shutdown()
+    pdf_ingest.shutdown()
+    stop_logging()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to HiveMind API"}
@@ -52,6 +72,26 @@ async def root():
 async def health():
     return {"status": "ok", "port": port}
 
+@app.get("/health/db")
+def db_pool_health():
+    """Connection pool usage (checked out, overflow, checkout wait times) for sizing workers."""
+    return {"sync": pool_stats(engine), "async": pool_stats(async_engine.sync_engine, "async")}
+
+@registry.register_collector
+def _db_pool_gauges():
+    pools = {"sync": pool_stats(engine), "async": pool_stats(async_engine.sync_engine, "async")}
+    for field in ("checked_out", "overflow", "wait_ms_total", "timeouts"):
+        yield from gauge_lines(
+            f"db_pool_{field}",
+            f"Connection pool {field.replace('_', ' ')} (see /health/db).",
+            [(("engine",), (name,), stats.get(field, 0)) for name, stats in pools.items()],
+        )
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of this worker's request, pool and model metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Include routers
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(ingestion.router, prefix="/ingestion", tags=["ingestion"])
@@ -63,15 +103,9 @@ app.include_router(notes.router, prefix="/notes", tags=["notes"])
 app.include_router(ai.router, prefix="/ai", tags=["ai"])  # /ai/health for AI status
 
 # Simple protected endpoint to verify tokens
-from .core.security import decode_access_token
-from fastapi import Depends, HTTPException, status, Header
+from .core.security import Principal, get_current_principal
+from fastapi import Depends
 
 @app.get("/me")
-async def read_me(authorization: str = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
-    scheme, _, token = authorization.partition(" ")
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    return {"user": payload}
+def read_me(principal: Principal = Depends(get_current_principal)):
+    return {"user": principal.claims}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, JSON, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -38,6 +38,12 @@ class Note(Base):
     owner = relationship("User", back_populates="notes")
     subject = relationship("Subject", back_populates="notes")
 
+    # Hot lookup paths; existing databases get these from the Alembic migrations
+    __table_args__ = (
+        Index("ix_notes_subject_chapter", "subject_id", "chapter"),
+        Index("ix_notes_user_chapter", "user_id", "chapter", "id"),
+    )
+
 
 class Subject(Base):
     __tablename__ = "subjects"
@@ -64,6 +70,31 @@ class MasterNote(Base):
 
     owner = relationship("User")
 
+    __table_args__ = (
+        Index("uq_master_notes_user_subject_chapter", "user_id", "subject_id", "chapter", unique=True),
+        Index("ix_master_notes_user_created", "user_id", "created_at"),
+    )
+
+class MasterNoteSource(Base):
+    """One row per Note that went into a given MasterNote version."""
+    __tablename__ = "master_note_sources"
+
+    id = Column(Integer, primary_key=True, index=True)
+    master_note_id = Column(Integer, ForeignKey("master_notes.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    note_id = Column(Integer, nullable=False)  # no FK: keeps history when a note is deleted
+    content_sha256 = Column(String(64), nullable=False)
+
+    __table_args__ = (Index("ix_master_note_sources_master_version", "master_note_id", "version"),)
+
+class QuizState(Base):
+    """Active quiz question (with its answer) per user, shared by all API workers."""
+    __tablename__ = "quiz_states"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    quiz = Column(JSON, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
 class StudentAnalytics(Base):
     __tablename__ = "student_analytics"
 
@@ -74,3 +105,35 @@ class StudentAnalytics(Base):
     last_updated = Column(DateTime(timezone=True), onupdate=func.now())
 
     student = relationship("User", back_populates="analytics")
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex, handed to the client on upload
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=False)
+    chapter = Column(Integer, nullable=False)
+    teacher = Column(String, nullable=True)
+    filename = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued | running | succeeded | failed
+    stage = Column(String, nullable=True)  # ocr | saving while running
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=True)
+    payload = Column(LargeBinary, nullable=True)  # uploaded bytes; cleared once the job finishes
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class OcrCacheEntry(Base):
+    __tablename__ = "ocr_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of (image sha256, model id, prompt version)
+    image_sha256 = Column(String(64), nullable=False, index=True)
+    model_id = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    text = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -49,6 +49,17 @@ class NoteResponse(NoteBase):
     class Config:
         from_attributes = True
 
+class NoteSummaryResponse(BaseModel):
+    id: int
+    user_id: int
+    subject_id: int
+    chapter: int
+    created_at: datetime
+    excerpt: str
+    pseudo_name: Optional[str] = None
+    teacher: Optional[str] = None
+    year: Optional[int] = None
+
 class SubjectBase(BaseModel):
     name: str
 
@@ -89,3 +100,41 @@ class ConsensusRequest(BaseModel):
     subject_id: int
     chapter: Optional[int] = None
     note_ids: List[int]
+    mode: str = "auto"  # "auto", "single" or "map_reduce"
+    fan_out: Optional[int] = None  # max notes/partials merged per agent call (map_reduce)
+    batch_token_budget: Optional[int] = None  # max estimated tokens per agent call (map_reduce)
+    incremental: bool = False  # fold only new/changed notes into the existing Master Note
+
+class RagSearchRequest(BaseModel):
+    subject_id: int
+    chapter: Optional[int] = None
+    embedding: Optional[List[float]] = None  # a query vector from the same embedder as the stored rows
+    query: Optional[str] = None  # or text, embedded by the server (core/embeddings.py)
+    kind: str = "notes"  # "notes" or "master"
+    k: int = 10
+    metric: str = "cosine"  # "cosine" or "dot"
+
+class SearchHit(BaseModel):
+    id: int
+    score: float
+    subject_id: Optional[int] = None
+    chapter: Optional[int] = None
+    user_id: Optional[int] = None
+    content: str
+    topic: Optional[str] = None
+
+class IngestionJobResponse(BaseModel):
+    id: str
+    status: str
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    note_id: Optional[int] = None
+    filename: Optional[str] = None
+    subject_id: int
+    chapter: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
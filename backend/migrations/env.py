@@ -0,0 +1,41 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from app.database import engine, DATABASE_URL, Base
+import app.models  # noqa: F401  (registers the tables on Base.metadata)
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Reuse the application's engine so URL normalisation and connect args match the app
+    with engine.connect() as connection:
+        # Tables still come from the models (the app runs create_all too); creating them
+        # here first lets `upgrade head` run on an empty database before the first start
+        Base.metadata.create_all(connection)
+        connection.commit()
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
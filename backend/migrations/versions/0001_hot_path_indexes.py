@@ -0,0 +1,74 @@
+"""Composite indexes for hot lookups and a unique MasterNote key
+
+Tables themselves are still created by Base.metadata.create_all() at startup;
+this revision adds the indexes that existing databases are missing:
+
+- notes(subject_id, chapter): /notes/all, similar-notes search
+- notes(user_id, chapter, id): /notes/my
+- master_notes(user_id, subject_id, chapter) UNIQUE: tutor, consensus, get/PDF
+- master_notes(user_id, created_at): latest Master Note
+
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY so reads and
+writes continue during the migration. If a concurrent build fails it leaves an
+INVALID index behind; drop it and re-run the upgrade.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_notes_subject_chapter", "notes", ["subject_id", "chapter"], False),
+    ("ix_notes_user_chapter", "notes", ["user_id", "chapter", "id"], False),
+    ("uq_master_notes_user_subject_chapter", "master_notes", ["user_id", "subject_id", "chapter"], True),
+    ("ix_master_notes_user_created", "master_notes", ["user_id", "created_at"], False),
+]
+
+# Duplicate Master Notes (possible before the unique index existed): keep the
+# highest version, then the newest row.
+DUPLICATE_MASTER_IDS = """
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY user_id, subject_id, chapter ORDER BY version DESC, id DESC
+        ) AS rn
+        FROM master_notes
+        WHERE user_id IS NOT NULL AND subject_id IS NOT NULL AND chapter IS NOT NULL
+    ) ranked
+    WHERE rn > 1
+"""
+
+
+def _remove_duplicate_master_notes():
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table("master_note_sources"):
+        op.execute(f"DELETE FROM master_note_sources WHERE master_note_id IN ({DUPLICATE_MASTER_IDS})")
+    op.execute(f"DELETE FROM master_notes WHERE id IN ({DUPLICATE_MASTER_IDS})")
+
+
+def upgrade():
+    _remove_duplicate_master_notes()
+    if op.get_bind().dialect.name == "postgresql":
+        # CONCURRENTLY cannot run inside a transaction block
+        with op.get_context().autocommit_block():
+            for name, table, columns, unique in INDEXES:
+                op.create_index(name, table, columns, unique=unique, if_not_exists=True, postgresql_concurrently=True)
+    else:
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, table, _, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+    else:
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
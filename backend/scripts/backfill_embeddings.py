@@ -0,0 +1,173 @@
+"""Embed existing notes and Master Notes whose `embedding` is NULL.
+
+Rows are read in id order and embedded in batches of --batch-size with the
+configured provider (EMBEDDING_MODEL_PROVIDER, local hashed n-grams by default);
+each batch is written with one bulk UPDATE and committed on its own. On
+PostgreSQL the rows are streamed through a server-side cursor on a dedicated
+read connection; on other databases they are read in keyset pages (id > last id).
+
+The run is resumable: an interrupted backfill simply starts again, since only
+rows that are still NULL are selected. With --reembed every row is embedded
+again (e.g. after changing the embedding model) and the last committed id per
+kind is checkpointed in --state, so a restarted run continues where it stopped
+(--restart ignores the checkpoint).
+
+Usage (from the backend directory):
+    python scripts/backfill_embeddings.py                         # notes and master notes
+    python scripts/backfill_embeddings.py --kind notes --batch-size 256 --limit 10000
+    python scripts/backfill_embeddings.py --reembed               # resumable full re-embed
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, literal, select
+from app.database import engine, SessionLocal
+from app.models import Note, MasterNote
+from app.core.embeddings import EMBEDDING_DIM, embedding_provider, embed_texts, store_embeddings
+
+MODELS = {"notes": Note, "master": MasterNote}
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def pending_query(kind: str, after_id: int, reembed: bool):
+    """(id, content, subject_id, chapter, version) rows to embed, in id order (the shape load_rows returns)."""
+    model = MODELS[kind]
+    version = MasterNote.version if kind == "master" else literal(None)
+    query = select(model.id, model.content, model.subject_id, model.chapter, version).where(model.id > after_id)
+    if not reembed:
+        query = query.where(model.embedding.is_(None))
+    return query.order_by(model.id)
+
+
+def count_pending(kind: str, after_id: int, reembed: bool) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(pending_query(kind, after_id, reembed).subquery())).scalar_one()
+
+
+def iter_batches(kind: str, after_id: int, reembed: bool, batch_size: int):
+    """Yields lists of at most batch_size rows."""
+    query = pending_query(kind, after_id, reembed)
+    if engine.dialect.supports_server_side_cursors:
+        # One streaming read for the whole run; the writes commit on other connections
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            for partition in result.partitions(batch_size):
+                yield [tuple(row) for row in partition]
+        return
+    # No server-side cursors (SQLite): a short read per page, so the write lock is never held against it
+    last_id = after_id
+    while True:
+        model = MODELS[kind]
+        with engine.connect() as conn:
+            rows = [tuple(row) for row in conn.execute(query.where(model.id > last_id).limit(batch_size))]
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def write_batch(kind: str, rows: list[tuple], vectors: list[list[float]]) -> int:
+    db = SessionLocal()
+    try:
+        updated = store_embeddings(db, kind, rows, vectors)
+        db.commit()
+        return updated
+    finally:
+        db.close()
+
+
+async def backfill(kind: str, args, state: dict) -> dict:
+    after_id = state.get(kind, 0) if args.reembed else 0
+    total = count_pending(kind, after_id, args.reembed)
+    if args.limit:
+        total = min(total, args.limit)
+    print(f"[backfill] {kind}: {total} rows to embed" + (f" (resuming after id {after_id})" if after_id else ""))
+
+    done = updated = 0
+    embed_s = write_s = 0.0
+    started = last_report = time.perf_counter()
+    for rows in iter_batches(kind, after_id, args.reembed, args.batch_size):
+        if args.limit:
+            rows = rows[:args.limit - done]
+        t0 = time.perf_counter()
+        vectors = await embed_texts([content or "" for _, content, *_ in rows])
+        t1 = time.perf_counter()
+        updated += write_batch(kind, rows, vectors)
+        t2 = time.perf_counter()
+        embed_s += t1 - t0
+        write_s += t2 - t1
+        done += len(rows)
+
+        if args.reembed:
+            state[kind] = rows[-1][0]
+            save_state(args.state, state)
+        if t2 - last_report >= args.report_every or done >= total:
+            elapsed = t2 - started
+            rate = done / elapsed if elapsed else 0.0
+            eta = (total - done) / rate if rate and total > done else 0.0
+            percent = 100 * done / total if total else 100.0
+            print(f"[backfill] {kind}: {done}/{total} ({percent:.1f}%) {rate:.1f} rows/s, eta {eta:.0f}s")
+            last_report = t2
+        if args.limit and done >= args.limit:
+            break
+
+    if args.reembed and not args.limit:
+        # A full pass is complete; the next --reembed starts from the beginning
+        state.pop(kind, None)
+        save_state(args.state, state)
+    elapsed = time.perf_counter() - started
+    return {
+        "kind": kind,
+        "rows": done,
+        "updated": updated,
+        "skipped": done - updated,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(done / elapsed, 1) if elapsed else None,
+        "embed_s": round(embed_s, 2),
+        "write_s": round(write_s, 2),
+    }
+
+
+async def main(args):
+    state = {} if args.restart else load_state(args.state)
+    kinds = list(MODELS) if args.kind == "all" else [args.kind]
+    return [await backfill(kind, args, state) for kind in kinds]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed notes and Master Notes that have no embedding yet.")
+    parser.add_argument("--kind", choices=("notes", "master", "all"), default="all")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many rows per kind (0: no limit)")
+    parser.add_argument("--reembed", action="store_true", help="embed every row again, not only the NULL ones")
+    parser.add_argument("--state", default=".embedding_backfill.json", help="checkpoint file for --reembed")
+    parser.add_argument("--restart", action="store_true", help="ignore the --reembed checkpoint")
+    parser.add_argument("--report-every", type=float, default=2.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    print(f"[backfill] provider={embedding_provider()} dim={EMBEDDING_DIM} database={engine.dialect.name} "
+          f"batch={args.batch_size}")
+    results = asyncio.run(main(args))
+    for result in results:
+        print(json.dumps(result))
@@ -0,0 +1,382 @@
+"""Offline API benchmark: realistic request mixes against the in-process app with local models.
+
+Scenarios (each run as its own phase, then all together as a weighted mix):
+
+    upload       POST /ingestion/upload (unique phone-sized photos, local OCR)
+    upload_batch POST /ingestion/upload/batch with --batch-pages photos merged into one note
+    upload_pdf   POST /ingestion/upload with a --pdf-pages PDF, half typed (text layer), half scanned
+    consensus    POST /consensus/process on --consensus-notes notes
+    tutor_chat   POST /rag/tutor, chat mode
+    tutor_quiz   POST /rag/tutor, quiz mode: ask for a question, then answer it
+    notes_all    GET  /notes/all for a subject/chapter (summary fields, paginated)
+    notes_my     GET  /notes/my
+
+OCR, consensus and tutor run on the local model provider (MODEL_PROVIDER=local):
+deterministic answers with a fixed simulated latency, so results only move when
+the API, database or concurrency code does.
+The report is JSON: per scenario and per endpoint of the mixed phase it gives
+count, errors, throughput and p50/p95/p99/max latency; phases that ingest
+multi-page uploads also report pages per second. Compare the files from
+two commits to spot regressions.
+
+Usage (from the backend directory):
+    python scripts/bench_api.py --requests 200 --concurrency 16 --out bench.json
+    python scripts/bench_api.py --scenarios tutor_chat,notes_all --mix tutor_chat=3,notes_all=1
+    python scripts/bench_api.py --out new.json --compare old.json   # print p50/p95/throughput deltas
+
+Runs against a throwaway SQLite database unless DATABASE_URL is set (use a
+scratch PostgreSQL database to benchmark Postgres; the suite creates its own
+users and notes).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+# Every agent (and OCR) on the offline model; nothing is sent to Google
+os.environ["MODEL_PROVIDER"] = "local"
+for agent in ("OCR", "INGESTION", "CONSENSUS", "TUTOR"):
+    os.environ.pop(f"{agent}_MODEL_PROVIDER", None)
+os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+os.environ.pop("MOCK_INGESTION", None)
+
+import httpx
+
+import app.core.local_model as local_model
+from app.main import app
+from app.database import SessionLocal
+from app.models import User, Subject, Note
+from app.core.security import create_access_token, get_password_hash
+
+SCENARIOS = ("upload", "upload_batch", "upload_pdf", "consensus", "tutor_chat", "tutor_quiz", "notes_all", "notes_my")
+DEFAULT_MIX = "upload=2,consensus=1,tutor_chat=4,tutor_quiz=2,notes_all=3,notes_my=3"
+CHAPTERS = 10
+
+
+def page_photo(width: int = 3024, height: int = 4032) -> bytes:
+    """A phone-sized JPEG of a ruled, written page, with EXIF like a camera's."""
+    from PIL import Image, ImageDraw
+    image = Image.effect_noise((width, height), 8).convert("RGB")  # ~4 MB, like a 12 MP phone photo
+    draw = ImageDraw.Draw(image)
+    for y in range(200, height - 200, 90):
+        draw.line((150, y, width - 150, y), fill=(90, 120, 200), width=3)
+        draw.text((180, y - 60), "Lecture notes, line %d" % y, fill=(20, 20, 20))
+    exif = image.getexif()
+    exif[0x010F] = "Benchmark Phone"
+    exif[0x0112] = 6  # rotated 90 degrees, as portrait phone photos often are
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=92, exif=exif)
+    return out.getvalue()
+
+
+def page_pdf(scan: bytes, pages: int, marker: int) -> bytes:
+    """A PDF alternating typed pages (text layer, no OCR) and scanned pages (image only).
+
+    A short per-request marker on every scan keeps the renders unique, so page OCR is never a cache hit.
+    """
+    import pymupdf
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        if i % 2 == 0:
+            page.insert_textbox(pymupdf.Rect(72, 72, page.rect.width - 72, page.rect.height - 72),
+                                f"Lecture {marker}, page {i + 1}\n\n" + "Mitochondria turn glucose into ATP through cellular respiration. " * 20,
+                                fontsize=11)
+        else:
+            page.insert_image(page.rect, stream=scan)
+            page.insert_text((20, 20), f"{marker}-{i}", fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def configure_local_model(latency_ms: float, ocr_latency_ms: float, tokens_per_second: float):
+    local_model.LOCAL_MODEL_LATENCY_MS = latency_ms
+    local_model.LOCAL_OCR_LATENCY_MS = ocr_latency_ms
+    local_model.LOCAL_MODEL_TOKENS_PER_SECOND = tokens_per_second
+
+
+# ---- data ----------------------------------------------------------------------
+
+def seed(users: int, notes_per_chapter: int) -> dict:
+    db = SessionLocal()
+    try:
+        run = time.time_ns()
+        subject = Subject(name=f"Bench {run}")
+        db.add(subject)
+        accounts = [User(email=f"bench-{run}-{i}@example.com", hashed_password=get_password_hash("x"),
+                         pseudo_name=f"student{i}", teacher=f"Teacher {i % 3}", year=2026) for i in range(users)]
+        db.add_all(accounts)
+        db.commit()
+        notes_by_chapter = {}
+        for chapter in range(1, CHAPTERS + 1):
+            notes = [Note(user_id=accounts[i % users].id, subject_id=subject.id, chapter=chapter, teacher=accounts[i % users].teacher,
+                          content=f"Chapter {chapter}, note {i}. " + "Lecture content. " * 120)
+                     for i in range(notes_per_chapter)]
+            db.add_all(notes)
+            db.commit()
+            notes_by_chapter[chapter] = [n.id for n in notes]
+        tokens = [create_access_token({"sub": u.email, "user_id": u.id}) for u in accounts]
+        return {"subject_id": subject.id, "tokens": tokens, "notes_by_chapter": notes_by_chapter}
+    finally:
+        db.close()
+
+
+# ---- scenarios -----------------------------------------------------------------
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, data: dict, consensus_notes: int, batch_pages: int, pdf_pages: int):
+        self.client = client
+        self.batch_pages = batch_pages
+        self.pdf_pages = pdf_pages
+        # Pages ingested by successful multi-page uploads, for pages/s
+        self.pages = 0
+        self.data = data
+        self.consensus_notes = consensus_notes
+        self.rng = random.Random(42)
+        self.counter = 0
+        self.photo = page_photo()
+        self.scan = page_photo(1240, 1754)  # A4 at 150 dpi
+
+    def _auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.data['tokens'])}"}
+
+    async def _call(self, endpoint: str, method: str, url: str, record, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def upload(self, record):
+        self.counter += 1
+        # Bytes after the JPEG end marker are ignored by decoders but make every upload unique (no OCR cache hits)
+        image = self.photo + b"%08d" % self.counter
+        await self._call("POST /ingestion/upload", "POST", "/ingestion/upload", record, headers=self._auth(),
+                         files={"file": (f"page{self.counter}.jpg", image, "image/jpeg")},
+                         data={"subject_id": str(self.data["subject_id"]), "chapter": str(self.rng.randint(1, CHAPTERS)), "teacher": "Teacher 0"})
+
+    async def upload_batch(self, record):
+        self.counter += 1
+        files = [("files", (f"batch{self.counter}-{i}.jpg", self.photo + b"%08d-%03d" % (self.counter, i), "image/jpeg"))
+                 for i in range(self.batch_pages)]
+        response = await self._call("POST /ingestion/upload/batch", "POST", "/ingestion/upload/batch", record, headers=self._auth(), files=files,
+                                    data={"subject_id": str(self.data["subject_id"]), "chapter": str(self.rng.randint(1, CHAPTERS)), "teacher": "Teacher 0"})
+        if response is not None and response.status_code == 200:
+            self.pages += response.json()["succeeded"]
+
+    async def upload_pdf(self, record):
+        self.counter += 1
+        pdf = page_pdf(self.scan, self.pdf_pages, self.counter)
+        response = await self._call("POST /ingestion/upload (pdf)", "POST", "/ingestion/upload", record, headers=self._auth(),
+                                    files={"file": (f"lecture{self.counter}.pdf", pdf, "application/pdf")},
+                                    data={"subject_id": str(self.data["subject_id"]), "chapter": str(self.rng.randint(1, CHAPTERS)), "teacher": "Teacher 0"})
+        if response is not None and response.status_code == 200:
+            self.pages += self.pdf_pages
+
+    async def consensus(self, record):
+        chapter = self.rng.randint(1, CHAPTERS)
+        note_ids = self.data["notes_by_chapter"][chapter][:self.consensus_notes]
+        await self._call("POST /consensus/process", "POST", "/consensus/process", record, headers=self._auth(),
+                         json={"note_ids": note_ids, "subject_id": self.data["subject_id"], "chapter": chapter, "mode": "auto"})
+
+    async def tutor_chat(self, record):
+        chapter = self.rng.randint(1, CHAPTERS)
+        await self._call("POST /rag/tutor (chat)", "POST", "/rag/tutor", record, headers=self._auth(),
+                         json={"question": f"Explain the main idea of chapter {chapter}", "subject_id": self.data["subject_id"], "chapter": chapter, "mode": "chat"})
+
+    async def tutor_quiz(self, record):
+        headers = self._auth()
+        chapter = self.rng.randint(1, CHAPTERS)
+        body = {"subject_id": self.data["subject_id"], "chapter": chapter, "mode": "quiz"}
+        await self._call("POST /rag/tutor (quiz question)", "POST", "/rag/tutor", record, headers=headers, json={**body, "question": "Quiz me"})
+        await self._call("POST /rag/tutor (quiz answer)", "POST", "/rag/tutor", record, headers=headers, json={**body, "question": "I choose A"})
+
+    async def notes_all(self, record):
+        params = {"subject_id": self.data["subject_id"], "chapter": self.rng.randint(1, CHAPTERS), "fields": "summary", "limit": 50}
+        await self._call("GET /notes/all", "GET", "/notes/all", record, params=params)
+
+    async def notes_my(self, record):
+        await self._call("GET /notes/my", "GET", "/notes/my", record, headers=self._auth(), params={"limit": 50})
+
+
+def summarize(latencies: list[float], errors: int, wall_s: float) -> dict:
+    ordered = sorted(latencies)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2) if ordered else None
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / wall_s, 2) if wall_s else None,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+    }
+
+
+async def run_phase(bench: Bench, picks: list[str], concurrency: int) -> dict:
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+
+    def record(endpoint: str, seconds: float, ok: bool):
+        samples.setdefault(endpoint, []).append(seconds)
+        errors[endpoint] = errors.get(endpoint, 0) + (0 if ok else 1)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(name: str):
+        async with semaphore:
+            await getattr(bench, name)(record)
+
+    pages_before = bench.pages
+    started = time.perf_counter()
+    await asyncio.gather(*[one(name) for name in picks])
+    wall_s = time.perf_counter() - started
+    phase = {
+        "wall_s": round(wall_s, 3),
+        "endpoints": {endpoint: summarize(values, errors[endpoint], wall_s) for endpoint, values in sorted(samples.items())},
+    }
+    pages = bench.pages - pages_before
+    if pages:
+        phase["pages"] = pages
+        phase["pages_per_s"] = round(pages / wall_s, 2)
+    return phase
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def compare(baseline: dict, report: dict):
+    """Prints per-endpoint p50/p95 and throughput change against an earlier report."""
+    def flatten(r: dict) -> dict:
+        rows = {}
+        for scenario, phase in r.get("scenarios", {}).items():
+            for endpoint, stats in phase["endpoints"].items():
+                rows[f"{scenario:<11} {endpoint}"] = stats
+        for endpoint, stats in r.get("mixed", {}).get("endpoints", {}).items():
+            rows[f"{'mixed':<11} {endpoint}"] = stats
+        return rows
+
+    def delta(old, new):
+        if not old or new is None:
+            return "   n/a"
+        return f"{(new - old) / old * 100:+6.1f}%"
+
+    old_rows, new_rows = flatten(baseline), flatten(report)
+    print(f"vs {baseline.get('meta', {}).get('revision', '?')}: {'p50':>8} {'p95':>8} {'rps':>8}", file=sys.stderr)
+    for key, new in new_rows.items():
+        old = old_rows.get(key)
+        if old:
+            print(f"{key:<48} {delta(old['p50_ms'], new['p50_ms'])} {delta(old['p95_ms'], new['p95_ms'])} "
+                  f"{delta(old['throughput_rps'], new['throughput_rps'])}", file=sys.stderr)
+    for scenario, phase in report.get("scenarios", {}).items():
+        old = baseline.get("scenarios", {}).get(scenario, {}).get("pages_per_s")
+        if "pages_per_s" in phase and old:
+            print(f"{scenario:<11} pages/s {old} -> {phase['pages_per_s']} ({delta(old, phase['pages_per_s']).strip()})", file=sys.stderr)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def main(args) -> dict:
+    data = seed(args.users, max(args.consensus_notes, args.notes_per_chapter))
+    transport = httpx.ASGITransport(app=app)
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "database": os.environ["DATABASE_URL"].split("://")[0],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "model_latency_ms": args.model_latency_ms,
+            "ocr_latency_ms": args.ocr_latency_ms,
+            "model_tokens_per_second": args.model_tokens_per_second,
+            "consensus_notes": args.consensus_notes,
+            "batch_pages": args.batch_pages,
+            "pdf_pages": args.pdf_pages,
+            "users": args.users,
+        },
+        "scenarios": {},
+    }
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        bench = Bench(client, data, args.consensus_notes, args.batch_pages, args.pdf_pages)
+        # Warm-up: imports, agent construction, pools and caches
+        for name in SCENARIOS:
+            await getattr(bench, name)(lambda *a: None)
+
+        for name in args.scenarios:
+            report["scenarios"][name] = await run_phase(bench, [name] * args.requests, args.concurrency)
+            phase = report["scenarios"][name]
+            pages = f", {phase['pages_per_s']} pages/s" if "pages_per_s" in phase else ""
+            print(f"[bench] {name}: {phase['wall_s']}s{pages}", file=sys.stderr)
+
+        if args.mix:
+            mix = parse_mix(args.mix)
+            rng = random.Random(7)
+            picks = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+            report["mixed"] = {"mix": mix, **await run_phase(bench, picks, args.concurrency)}
+            print(f"[bench] mixed: {report['mixed']['wall_s']}s", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline API benchmark on the local model provider.")
+    parser.add_argument("--requests", type=int, default=100, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated phases to run alone ('' for none)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights for the mixed phase ('' to skip)")
+    parser.add_argument("--consensus-notes", type=int, default=12)
+    parser.add_argument("--batch-pages", type=int, default=8, help="photos per upload_batch request")
+    parser.add_argument("--pdf-pages", type=int, default=12, help="pages per upload_pdf document")
+    parser.add_argument("--notes-per-chapter", type=int, default=40)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--model-latency-ms", type=float, default=100)
+    parser.add_argument("--ocr-latency-ms", type=float, default=300)
+    parser.add_argument("--model-tokens-per-second", type=float, default=0,
+                        help="simulated generation speed on top of the latency (0: answers arrive all at once)")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to print deltas against")
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+
+    configure_local_model(args.model_latency_ms, args.ocr_latency_ms, args.model_tokens_per_second)
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+        print(f"[bench] report written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
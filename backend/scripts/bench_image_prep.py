@@ -0,0 +1,82 @@
+"""Benchmarks the pre-OCR image normalization (app/core/image_prep.py).
+
+Generates phone-like page photos (12 MP JPEG with EXIF rotation, full-size PNG
+screenshot, small transparent PNG), normalizes each one and prints the bytes
+saved and the time per image, then pushes a batch through the worker pool to
+report throughput.
+
+Usage (from the backend directory):
+    python scripts/bench_image_prep.py
+    OCR_IMAGE_MAX_SIDE=1600 IMAGE_PREP_WORKERS=4 python scripts/bench_image_prep.py --batch 32
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from app.core.image_prep import normalize_image, OCR_IMAGE_MAX_SIDE, OCR_IMAGE_FORMAT, IMAGE_PREP_WORKERS
+from app.core.executors import make_executor
+
+
+def page(width: int, height: int, noise: float) -> Image.Image:
+    image = Image.effect_noise((width, height), noise).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for y in range(120, height - 120, 80):
+        draw.line((100, y, width - 100, y), fill=(90, 120, 200), width=3)
+        draw.text((120, y - 50), "Lecture notes, line %d" % y, fill=(20, 20, 20))
+    return image
+
+
+def samples() -> dict[str, bytes]:
+    photo = page(3024, 4032, 8)
+    exif = photo.getexif()
+    exif[0x010F] = "Benchmark Phone"
+    exif[0x0112] = 6
+    jpeg = io.BytesIO()
+    photo.save(jpeg, "JPEG", quality=92, exif=exif)
+
+    screenshot = io.BytesIO()
+    page(2560, 1600, 2).save(screenshot, "PNG")
+
+    small = io.BytesIO()
+    Image.new("RGBA", (800, 600), (255, 255, 255, 0)).save(small, "PNG")
+    return {"phone_jpeg_12mp": jpeg.getvalue(), "screenshot_png": screenshot.getvalue(), "small_png": small.getvalue()}
+
+
+async def pool_throughput(data: bytes, batch: int) -> float:
+    """Same pool shape as the API's ImagePreparer (process executor, IMAGE_PREP_WORKERS)."""
+    loop = asyncio.get_running_loop()
+    with make_executor("process", IMAGE_PREP_WORKERS, "image-prep") as pool:
+        await asyncio.gather(*(loop.run_in_executor(pool, normalize_image, data) for _ in range(IMAGE_PREP_WORKERS)))  # warm up
+        started = time.perf_counter()
+        await asyncio.gather(*(loop.run_in_executor(pool, normalize_image, data) for _ in range(batch)))
+        return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image normalization before OCR.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per sample for the per-image timing")
+    parser.add_argument("--batch", type=int, default=16, help="images pushed through the worker pool at once")
+    args = parser.parse_args()
+
+    print(f"max_side={OCR_IMAGE_MAX_SIDE} format={OCR_IMAGE_FORMAT} workers={IMAGE_PREP_WORKERS}")
+    images = samples()
+    for name, data in images.items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            prepared = normalize_image(data)
+            timings.append(time.perf_counter() - started)
+        saved = prepared.bytes_saved / len(data) * 100
+        print(f"{name:18} {len(data):>10,}B -> {len(prepared.data):>9,}B {prepared.mime_type:10} "
+              f"{prepared.width}x{prepared.height}  saved {saved:5.1f}%  {min(timings) * 1000:7.1f} ms")
+
+    elapsed = asyncio.run(pool_throughput(images["phone_jpeg_12mp"], args.batch))
+    print(f"pool: {args.batch} phone photos in {elapsed:.2f}s ({args.batch / elapsed:.1f} images/s)")
@@ -0,0 +1,79 @@
+"""Micro-benchmark: per-request tutor agent setup cost, fresh Agent vs cached agent.
+
+No model calls are made; this only measures what happens before `agent.run()`.
+
+Usage: python scripts/bench_tutor_agent_setup.py [iterations]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# GoogleModel needs a key to construct; nothing is sent to Google here.
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-dummy-key")
+
+from pydantic_ai import Agent
+from pydantic_ai.models.google import GoogleModel
+from app.core.ai_agents import get_tutor_agent, TUTOR_MODEL, TUTOR_MODES
+
+# The system prompt the tutor endpoint used to build on every request
+LEGACY_SYSTEM_PROMPT = (
+    "You are an expert AI Tutor. Your goal is to help students learn using the collective classroom knowledge (Master Note provided). "
+    "Mode: {mode}. "
+    "If in 'chat' mode, answer questions clearly and directly using the Master Note as context when available. "
+    "If in 'quiz' mode, respond as follows: "
+    "- When the student asks for a quiz (e.g., 'quiz me', 'give me a question'), produce exactly ONE multiple-choice question with four options labeled A), B), C), and D). "
+    "- Do NOT include or reveal the correct answer in the same response — wait for the student to submit their choice. "
+    "- When the student submits an answer (e.g., 'I choose C' or 'Answer: B'), evaluate that choice against the Master Note and reply 'Correct' or 'Incorrect' followed by a brief explanation referencing the Master Note. "
+    "If in 'flashcards' mode, provide a term and its definition. "
+    "Always be encouraging, concise, and academic."
+)
+
+
+def legacy_setup(mode: str):
+    return Agent(GoogleModel(TUTOR_MODEL), system_prompt=LEGACY_SYSTEM_PROMPT.format(mode=mode))
+
+
+def cached_setup(mode: str):
+    return get_tutor_agent(mode)
+
+
+def measure(name: str, setup, iterations: int) -> dict:
+    modes = [TUTOR_MODES[i % len(TUTOR_MODES)] for i in range(iterations)]
+    setup(modes[0])  # warm up imports and the cache
+
+    gc.collect()
+    collections_before = sum(s["collections"] for s in gc.get_stats())
+    start = time.perf_counter()
+    for mode in modes:
+        setup(mode)
+    elapsed = time.perf_counter() - start
+    collections = sum(s["collections"] for s in gc.get_stats()) - collections_before
+
+    tracemalloc.start()
+    for mode in modes[:min(iterations, 200)]:
+        setup(mode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "us_per_request": round(elapsed / iterations * 1e6, 2),
+        "gc_collections": collections,
+        "peak_traced_kib": round(peak / 1024, 1),
+    }
+    print(f"{name:>8}: {result['us_per_request']:>10.2f} us/request, "
+          f"{collections} GC collections, peak {result['peak_traced_kib']} KiB traced")
+    return result
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    before = measure("legacy", legacy_setup, iterations)
+    after = measure("cached", cached_setup, iterations)
+    print(f"speedup: {before['us_per_request'] / max(after['us_per_request'], 1e-9):.0f}x")
@@ -0,0 +1,202 @@
+"""Peak memory of the API process under concurrent large uploads.
+
+Starts the API with uvicorn in a subprocess (throwaway SQLite database, local
+model provider), sends --rounds waves of --concurrency simultaneous uploads of a
+--size-mb photo and samples the resident set size of the server and of its
+child processes (image preparation workers) from /proc. Linux only.
+
+Compare two trees by pointing --app-dir at a checkout of the older revision:
+    git worktree add /tmp/hivemind-old <rev>
+    python scripts/bench_upload_memory.py --app-dir /tmp/hivemind-old/backend --out old.json
+    python scripts/bench_upload_memory.py --out new.json
+
+Usage (from the backend directory):
+    python scripts/bench_upload_memory.py --concurrency 16 --size-mb 8
+    python scripts/bench_upload_memory.py --ocr mock     # upload handling only, no image processing
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def photo(size_mb: float) -> bytes:
+    """A JPEG of roughly size_mb (noise does not compress), like a high-resolution phone photo."""
+    side = 1200
+    while True:
+        out = io.BytesIO()
+        Image.effect_noise((side, side * 4 // 3), 40).convert("RGB").save(out, "JPEG", quality=95)
+        if out.tell() >= size_mb * 1024 * 1024 or side > 8000:
+            return out.getvalue()
+        side = int(side * 1.25)
+
+
+def _status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+
+def _children(pid: int) -> list[int]:
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except FileNotFoundError:
+        pass
+    return pids
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_main_kb = 0
+        self.peak_children_kb = 0
+        self.peak_total_kb = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            main = _status_kb(self.pid, "VmRSS")
+            children = sum(_status_kb(child, "VmRSS") for child in _children(self.pid))
+            self.peak_main_kb = max(self.peak_main_kb, main)
+            self.peak_children_kb = max(self.peak_children_kb, children)
+            self.peak_total_kb = max(self.peak_total_kb, main + children)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app_dir: str, port: int, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'memory.db')}",
+        "MODEL_PROVIDER": "local",
+        "LOCAL_MODEL_LATENCY_MS": "50",
+        "LOCAL_OCR_LATENCY_MS": str(args.ocr_latency_ms),
+        "LOCAL_MODEL_TOKENS_PER_SECOND": "0",
+        "LOG_SAMPLE_RATE": "0",
+        "OCR_CACHE_ENABLED": "0",
+        "UPLOAD_MAX_BYTES": str(int(args.size_mb * 2 * 1024 * 1024)),
+        "MOCK_INGESTION": "1" if args.ocr == "mock" else "0",
+    }
+    env.pop("GOOGLE_API_KEY", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(200):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise SystemExit("server exited during startup")
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("server did not start")
+
+
+async def run(base_url: str, image: bytes, args, sampler_for) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        await client.post("/auth/register", json={"email": "memory@example.com", "password": "bench", "pseudo_name": "mem", "teacher": "t", "year": 1})
+        token = (await client.post("/auth/login", json={"email": "memory@example.com", "password": "bench"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        subject = (await client.post("/subjects/", json={"name": "Memory"})).json()
+        form = {"subject_id": str(subject.get("id", 1)), "chapter": "1", "teacher": "t"}
+
+        async def upload(i: int) -> int:
+            # A trailing counter keeps every upload distinct
+            response = await client.post("/ingestion/upload", headers=headers, data=form,
+                                         files={"file": (f"page{i}.jpg", image + b"%08d" % i, "image/jpeg")})
+            return response.status_code
+
+        # Warm-up: imports, worker processes, database
+        await upload(0)
+        await asyncio.sleep(0.5)
+        sampler = sampler_for()
+        baseline_kb = _status_kb(sampler.pid, "VmRSS")
+        sampler.start()
+        started = time.perf_counter()
+        statuses = []
+        for round_ in range(args.rounds):
+            statuses += await asyncio.gather(*(upload(1 + round_ * args.concurrency + i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    return {
+        "baseline_rss_mb": round(baseline_kb / 1024, 1),
+        "peak_rss_mb": round(sampler.peak_main_kb / 1024, 1),
+        "peak_rss_growth_mb": round((sampler.peak_main_kb - baseline_kb) / 1024, 1),
+        "peak_workers_rss_mb": round(sampler.peak_children_kb / 1024, 1),
+        "peak_total_rss_mb": round(sampler.peak_total_kb / 1024, 1),
+        "uploads": len(statuses),
+        "failed": sum(1 for s in statuses if s >= 400),
+        "wall_s": round(elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS of the API under concurrent uploads.")
+    parser.add_argument("--app-dir", default=BACKEND_DIR, help="backend directory of the tree to measure")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--ocr", choices=("local", "mock"), default="local",
+                        help="local: full pipeline on the local model; mock: upload handling only")
+    parser.add_argument("--ocr-latency-ms", type=float, default=300)
+    parser.add_argument("--out", help="write the JSON report here as well")
+    args = parser.parse_args()
+
+    image = photo(args.size_mb)
+    port = free_port()
+    server = start_server(os.path.abspath(args.app_dir), port, args)
+    try:
+        result = asyncio.run(run(f"http://127.0.0.1:{port}", image, args, lambda: RssSampler(server.pid)))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "meta": {
+            "app_dir": os.path.abspath(args.app_dir),
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "image_mb": round(len(image) / 1024 / 1024, 2),
+            "ocr": args.ocr,
+        },
+        **result,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
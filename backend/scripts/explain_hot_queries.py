@@ -0,0 +1,69 @@
+"""Print the query plans of the hot MasterNote / Note lookups.
+
+Usage (from the backend directory):
+    python scripts/explain_hot_queries.py            # plans against the current schema
+    python scripts/explain_hot_queries.py --upgrade  # plans, `alembic upgrade head`, plans again
+"""
+import os
+import subprocess
+import sys
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, text
+from app.database import engine
+from app.models import MasterNote, Note, User
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_keys(conn):
+    """Use a real (user, subject, chapter) if the database has one, so the plans reflect real selectivity."""
+    row = conn.execute(select(MasterNote.user_id, MasterNote.subject_id, MasterNote.chapter).limit(1)).first()
+    if row is None:
+        row = conn.execute(select(Note.user_id, Note.subject_id, Note.chapter).limit(1)).first()
+    return tuple(row) if row else (1, 1, 1)
+
+
+def hot_queries(user_id, subject_id, chapter):
+    return {
+        "master by (user, subject, chapter)  [tutor, consensus, get/pdf]": select(MasterNote).where(
+            MasterNote.user_id == user_id,
+            MasterNote.subject_id == subject_id,
+            MasterNote.chapter == chapter,
+        ),
+        "latest master of user  [/consensus/master/latest, tutor fallback]": select(MasterNote)
+            .where(MasterNote.user_id == user_id)
+            .order_by(MasterNote.created_at.desc())
+            .limit(1),
+        "notes by (subject, chapter)  [/notes/all]": select(Note.id, Note.content, User.pseudo_name)
+            .join(User, Note.user_id == User.id)
+            .where(Note.subject_id == subject_id, Note.chapter == chapter),
+        "notes of user by chapter  [/notes/my]": select(Note.id, Note.content)
+            .where(Note.user_id == user_id)
+            .order_by(Note.chapter, Note.id),
+    }
+
+
+def explain_all(label):
+    print(f"\n===== {label} =====")
+    with engine.connect() as conn:
+        keys = sample_keys(conn)
+        prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+        for name, query in hot_queries(*keys).items():
+            sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+            print(f"\n-- {name}")
+            for row in conn.execute(text(prefix + sql)):
+                print("   ", " | ".join(str(v) for v in row))
+
+
+if __name__ == "__main__":
+    if "--upgrade" in sys.argv:
+        explain_all("before")
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=BACKEND_DIR, check=True)
+        # Pooled connections may hold the pre-migration schema; start fresh ones
+        engine.dispose()
+        explain_all("after")
+    else:
+        explain_all("current schema")
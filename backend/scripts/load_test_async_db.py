@@ -0,0 +1,157 @@
+"""Load test: concurrent tutor and consensus requests against the in-process API.
+
+Model calls are replaced by a fake agent that awaits a fixed latency, so the
+numbers reflect the API and database path only. While the load runs, a
+heartbeat task measures event-loop lag: a handler that blocks the loop on a
+synchronous query shows up there and in the tail latency of every other
+request in flight.
+
+Usage:
+    python scripts/load_test_async_db.py [--requests 200] [--concurrency 32] [--model-latency-ms 50]
+
+Runs against a throwaway SQLite database unless DATABASE_URL is set. Prints a
+JSON report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}"
+
+import httpx
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from app.main import app
+from app.database import SessionLocal
+from app.models import User, Subject, Note, MasterNote
+from app.core.security import create_access_token
+import app.api.rag as rag
+import app.api.consensus as consensus
+
+CHAPTERS = 8
+NOTES_PER_CHAPTER = 5
+
+
+def fake_agent(latency_s: float) -> Agent:
+    async def respond(messages, info):
+        await asyncio.sleep(latency_s)
+        return ModelResponse(parts=[TextPart("Synthetic answer. " * 20)])
+    return Agent(FunctionModel(respond))
+
+
+def seed() -> tuple[str, int, dict[int, list[int]]]:
+    db = SessionLocal()
+    try:
+        user = User(email=f"load-{time.time_ns()}@example.com", hashed_password="x", pseudo_name="load", teacher="t", year=1)
+        subject = Subject(name=f"Load Test {time.time_ns()}")
+        db.add_all([user, subject])
+        db.commit()
+        notes_by_chapter = {}
+        for chapter in range(1, CHAPTERS + 1):
+            notes = [Note(user_id=user.id, subject_id=subject.id, chapter=chapter, content=f"Chapter {chapter} note {i} " * 50)
+                     for i in range(NOTES_PER_CHAPTER)]
+            db.add_all(notes)
+            db.add(MasterNote(user_id=user.id, subject_id=subject.id, chapter=chapter, topic="load", content="Master " * 200, version=1))
+            db.commit()
+            notes_by_chapter[chapter] = [n.id for n in notes]
+        token = create_access_token({"sub": user.email, "user_id": user.id})
+        return token, subject.id, notes_by_chapter
+    finally:
+        db.close()
+
+
+def summarize(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 1),
+        "p95_ms": round(pick(0.95) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 1),
+    }
+
+
+async def heartbeat(lags: list[float], stop: asyncio.Event, interval: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(requests: int, concurrency: int):
+    token, subject_id, notes_by_chapter = seed()
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = {"tutor": [], "consensus": []}
+    errors = {"tutor": 0, "consensus": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(client: httpx.AsyncClient, i: int):
+        chapter = i % CHAPTERS + 1
+        kind = "consensus" if i % 4 == 0 else "tutor"
+        if kind == "tutor":
+            request = ("/rag/tutor", {"question": f"Explain chapter {chapter}", "subject_id": subject_id, "chapter": chapter, "mode": "chat"})
+        else:
+            request = ("/consensus/process", {"note_ids": notes_by_chapter[chapter], "subject_id": subject_id, "chapter": chapter, "mode": "single"})
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(request[0], json=request[1], headers=headers)
+            latencies[kind].append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors[kind] += 1
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=120) as client:
+        # Warm up connections, the principal cache and lazy imports
+        await one(client, 1)
+        await one(client, 0)
+        latencies = {"tutor": [], "consensus": []}
+        beat = asyncio.create_task(heartbeat(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*[one(client, i) for i in range(requests)])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await beat
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "database": os.environ["DATABASE_URL"].split("://")[0],
+        "wall_s": round(elapsed, 2),
+        "throughput_rps": round(requests / elapsed, 1),
+        "tutor": summarize(latencies["tutor"]),
+        "consensus": summarize(latencies["consensus"]),
+        "errors": errors,
+        "event_loop_lag": summarize(lags),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--model-latency-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    agent = fake_agent(args.model_latency_ms / 1000)
+    rag.get_tutor_agent = lambda mode, *a, **kw: agent
+    consensus.get_consensus_agent = lambda: agent
+
+    report = asyncio.run(run(args.requests, args.concurrency))
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,122 @@
+"""Concurrency test: N simultaneous MasterNote saves for the same (user, subject, chapter).
+
+Every save must land: exactly one row remains and its version equals N.
+For comparison it also runs the old SELECT-then-UPDATE/INSERT save, which
+loses version bumps (or hits the unique key) under the same load.
+
+Usage: python scripts/test_master_upsert_concurrency.py [saves]
+Runs against a throwaway SQLite file unless TEST_DATABASE_URL is set
+(e.g. a scratch PostgreSQL database).
+"""
+import os
+import sys
+import tempfile
+import threading
+
+# Add the parent directory to sys.path so we can import from 'app'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import MasterNote, MasterNoteSource, User, Subject
+from app.core.master_notes import upsert_master_note, record_manifest
+
+CHAPTER = 1
+
+
+def make_engine():
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        return create_engine(url, pool_size=20, max_overflow=20)
+    path = os.path.join(tempfile.mkdtemp(), "upsert_test.db")
+    # Writers queue on SQLite's file lock; give them time instead of failing fast
+    return create_engine(f"sqlite:///{path}", connect_args={"timeout": 30, "check_same_thread": False})
+
+
+def setup(Session):
+    with Session() as db:
+        user = db.query(User).filter_by(email="upsert-test@example.com").first()
+        if not user:
+            user = User(email="upsert-test@example.com", hashed_password="x")
+            db.add(user)
+        subject = db.query(Subject).filter_by(name="Upsert Test Subject").first()
+        if not subject:
+            subject = Subject(name="Upsert Test Subject")
+            db.add(subject)
+        db.commit()
+        ids = (user.id, subject.id)
+        db.execute(delete(MasterNote).where(MasterNote.user_id == user.id, MasterNote.subject_id == subject.id))
+        db.commit()
+        return ids
+
+
+def upsert_save(Session, user_id, subject_id, i):
+    with Session() as db:
+        master_id, version = upsert_master_note(db, user_id, subject_id, CHAPTER, "Upsert test", f"content {i}")
+        record_manifest(db, master_id, version, {i: f"{i:064x}"})
+        db.commit()
+
+
+def legacy_save(Session, user_id, subject_id, i):
+    with Session() as db:
+        existing = db.query(MasterNote).filter(
+            MasterNote.user_id == user_id, MasterNote.subject_id == subject_id, MasterNote.chapter == CHAPTER,
+        ).first()
+        if existing:
+            existing.content = f"content {i}"
+            existing.version += 1
+        else:
+            db.add(MasterNote(user_id=user_id, subject_id=subject_id, chapter=CHAPTER, topic="Upsert test", content=f"content {i}", version=1))
+        db.commit()
+
+
+def fire(Session, save, n, user_id, subject_id):
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            save(Session, user_id, subject_id, i)
+        except Exception as e:
+            errors.append(type(e).__name__)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with Session() as db:
+        rows = db.execute(select(MasterNote.id, MasterNote.version).where(
+            MasterNote.user_id == user_id, MasterNote.subject_id == subject_id, MasterNote.chapter == CHAPTER,
+        )).all()
+        sources = db.scalar(select(func.count()).select_from(MasterNoteSource).where(
+            MasterNoteSource.master_note_id.in_([r.id for r in rows])
+        )) if rows else 0
+    return rows, sources, errors
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+    engine = make_engine()
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    user_id, subject_id = setup(Session)
+    rows, _, errors = fire(Session, legacy_save, n, user_id, subject_id)
+    final = rows[0].version if rows else 0
+    print(f"legacy select-then-write: {n} saves -> {len(rows)} row(s), version {final}, "
+          f"{n - final - len(errors)} lost bump(s), {len(errors)} error(s)")
+
+    user_id, subject_id = setup(Session)
+    rows, sources, errors = fire(Session, upsert_save, n, user_id, subject_id)
+    print(f"atomic upsert:            {n} saves -> {len(rows)} row(s), "
+          f"version {rows[0].version if rows else 0}, {sources} manifest rows, {len(errors)} error(s)")
+
+    assert not errors, f"upsert saves failed: {errors}"
+    assert len(rows) == 1, f"expected exactly one MasterNote, found {len(rows)}"
+    assert rows[0].version == n, f"expected version {n}, got {rows[0].version}"
+    assert sources == n, f"expected {n} manifest rows, got {sources}"
+    print("OK")
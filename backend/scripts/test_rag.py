@@ -1,13 +1,14 @@
+import asyncio
 import sys
 import os
-import random
 
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from sqlalchemy import select
 from app.database import SessionLocal
-from app.models import Note, User
+from app.models import Note, User, Subject
+from app.core.vector_index import vector_index
+from app.core.embeddings import hash_embed
 
 def test_rag_locally():
     db = SessionLocal()
@@ -19,34 +20,38 @@ def test_rag_locally():
             db.add(user)
             db.commit()
             db.refresh(user)
+        subject = db.query(Subject).filter_by(name="RAG Test Subject").first()
+        if not subject:
+            subject = Subject(name="RAG Test Subject")
+            db.add(subject)
+            db.commit()
+            db.refresh(subject)
+
+        # 2. Embed the note with the local hashed n-gram embedder (768 dimensions, like Gemini's)
+        content = "This is a test note about Photosynthesis."
+        note_embedding = hash_embed(content).tolist()
 
-        # 2. Create a dummy embedding (768 dimensions for Gemini)
-        mock_embedding = [random.uniform(-1, 1) for _ in range(768)]
-        
         # 3. Save a note with the embedding
-        print("Saving a note with a mock embedding...")
+        print("Saving a note with a local embedding...")
         new_note = Note(
-            content="This is a test note about Photosynthesis.",
+            content=content,
             user_id=user.id,
-            embedding=mock_embedding
+            subject_id=subject.id,
+            chapter=1,
+            embedding=note_embedding
         )
         db.add(new_note)
         db.commit()
 
         # 4. Perform a similarity search
         print("Performing similarity search...")
-        # L2 distance (<->), Cosine distance (<=>), or Inner product (<#>)
-        # Here we use the Note.embedding.cosine_distance logic
-        query_vector = mock_embedding # searching for itself should return it as #1
-        
-        results = db.scalars(
-            select(Note)
-            .order_by(Note.embedding.cosine_distance(query_vector))
-            .limit(1)
-        ).all()
+        query_vector = hash_embed("notes on photosynthesis").tolist()
+
+        results = asyncio.run(vector_index.search(query_vector, subject_id=subject.id, chapter=1, k=1))
 
         if results:
-            print(f"Success! Found matching note: {results[0].content}")
+            note_id, score = results[0]
+            print(f"Success! Found matching note {note_id} (cosine={score:.4f}): {db.get(Note, note_id).content}")
         else:
             print("No results found.")
 
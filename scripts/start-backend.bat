@@ -14,6 +14,18 @@ REM Upgrade packaging tools
 REM Install requirements
 .venv\Scripts\python.exe -m pip install -r backend\requirements.txt
 
+REM Apply database migrations before serving (alembic runs from the backend directory)
+echo Applying database migrations (alembic upgrade head)
+pushd backend
+..\.venv\Scripts\python.exe -m alembic upgrade head
+if errorlevel 1 (
+    popd
+    echo Database migration failed; not starting the server.
+    pause
+    exit /b 1
+)
+popd
+
 REM Run server
 .venv\Scripts\python.exe -m uvicorn backend.app.main:app --reload --host 0.0.0.0 --port 8000
 pause
\ No newline at end of file
@@ -4,6 +4,7 @@
 #  - create a .venv if missing
 #  - install/upgrade pip, setuptools, wheel
 #  - install backend/requirements.txt
+#  - apply database migrations (alembic upgrade head)
 #  - launch the uvicorn server
 
 $ErrorActionPreference = 'Stop'
@@ -40,6 +41,19 @@ Write-Host "Upgrading pip, wheel, setuptools..."
 Write-Host "Installing backend/requirements.txt..."
 & $python -m pip install -r backend/requirements.txt
 
+# Apply database migrations before serving (alembic runs from the backend directory)
+Write-Host "Applying database migrations (alembic upgrade head)..."
+Push-Location backend
+try {
+    & $python -m alembic upgrade head
+    if ($LASTEXITCODE -ne 0) {
+        Write-Error "Database migration failed; not starting the server."
+        exit 1
+    }
+} finally {
+    Pop-Location
+}
+
 # Run the server
 Write-Host "Running uvicorn backend.app.main:app on http://0.0.0.0:8000 (CTRL+C to stop)" -ForegroundColor Cyan
 & $python -m uvicorn backend.app.main:app --reload --host 0.0.0.0 --port 8000
@@ -25,6 +25,10 @@ PYTHON=.venv/bin/python
 $PYTHON -m pip install --upgrade pip setuptools wheel
 $PYTHON -m pip install -r backend/requirements.txt
 
+# Apply database migrations before serving (alembic runs from the backend directory)
+echo "Applying database migrations (alembic upgrade head)"
+(cd backend && ../$PYTHON -m alembic upgrade head)
+
 # Use Railway provided PORT if available, default to 8000
 PORT=${PORT:-8000}
 